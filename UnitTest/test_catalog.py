@@ -0,0 +1,89 @@
+import unittest
+from unittest import mock
+
+from core import catalog
+from db.collections import SYSTEMS
+
+MAPPING = {"id": "sku", "name": "title", "description": "d", "image": "img", "featureVector": "fv"}
+
+
+class TestBuild(unittest.TestCase):
+    def setUp(self):
+        patches = [
+            mock.patch.dict(SYSTEMS, {"shop": {"mapping": MAPPING}}),
+            mock.patch.object(catalog, "load_store", return_value=None),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+        catalog._rejected.clear()
+
+    def test_vectors_of_another_width_are_rejected(self):
+        docs = [{"sku": 1, "fv": [1, 0, 1]}, {"sku": 2, "fv": [1, 0]},
+                {"sku": 3, "fv": [0, 0, 1]}, {"title": "no id"}]
+        with mock.patch.object(catalog, "load_data", return_value=docs):
+            built = catalog._build("shop")
+        self.assertEqual(built.ids, ["1", "3"])
+        self.assertEqual(built.matrix.shape, (2, 3))
+        self.assertEqual(catalog.catalog_stats()["rejected"], {"shop": 2})
+
+
+class TestCache(unittest.TestCase):
+    def setUp(self):
+        self.builds = 0
+        self.during_build = None
+
+        def build(system):
+            self.builds += 1
+            if self.during_build:
+                self.during_build()
+            return catalog.Catalog(system, [])
+
+        patches = [
+            mock.patch.object(catalog, "SHARED_DIR", ""),
+            mock.patch.object(catalog, "_build", side_effect=build),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+        self.addCleanup(self._forget)
+        self._forget()
+
+    def _forget(self):
+        catalog._catalogs.pop("shop", None)
+        catalog._generations.pop("shop", None)
+
+    def test_loaded_once_until_invalidated(self):
+        first = catalog.get_catalog("shop")
+        self.assertIs(catalog.get_catalog("shop"), first)
+        self.assertIs(catalog.cached_catalog("shop"), first)
+        self.assertEqual(self.builds, 1)
+
+        catalog.invalidate_catalog("shop")
+        self.assertIsNone(catalog.cached_catalog("shop"))
+        self.assertIsNot(catalog.get_catalog("shop"), first)
+        self.assertEqual(self.builds, 2)
+
+    def test_load_overtaken_by_invalidation_is_not_cached(self):
+        self.during_build = lambda: catalog.invalidate_catalog("shop")
+        stale = catalog.get_catalog("shop")
+        self.assertIsNotNone(stale)  # the caller still gets an answer
+        self.assertIsNone(catalog.cached_catalog("shop"))
+
+        self.during_build = None
+        fresh = catalog.get_catalog("shop")
+        self.assertIs(catalog.cached_catalog("shop"), fresh)
+        self.assertEqual(self.builds, 2)
+
+    def test_expires_after_max_age(self):
+        first = catalog.get_catalog("shop")
+        first.loaded_at -= catalog.MAX_AGE
+        self.assertIsNone(catalog.cached_catalog("shop"))
+        second = catalog.get_catalog("shop")
+        self.assertIsNot(second, first)
+        self.assertIs(catalog.get_catalog("shop"), second)
+        self.assertEqual(self.builds, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
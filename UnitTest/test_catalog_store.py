@@ -0,0 +1,73 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from core import catalog_store
+from core.catalog import Catalog
+from core.data_utils import Item
+
+
+def make_items(count, width=6):
+    return [
+        Item(str(900 - i), f"item {i}", "", "", bytes((i >> b) & 1 for b in range(width)))
+        for i in range(count)
+    ]
+
+
+class TestCatalogStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = self.tmp.name
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def publish(self, catalog):
+        return catalog_store.publish(self.root, catalog.system, catalog.ids, catalog.matrix,
+                                     catalog.items, catalog.version)
+
+    def test_round_trip(self):
+        local = Catalog("movies", make_items(40))
+        self.publish(local)
+        meta, ids, index, matrix, items = catalog_store.attach(
+            self.root, catalog_store.current(self.root, "movies"))
+
+        self.assertEqual(meta["version"], local.version)
+        self.assertEqual(list(ids), local.ids)
+        self.assertEqual(list(items), local.items)
+        self.assertTrue(np.array_equal(matrix, local.matrix))
+        self.assertFalse(matrix.flags.writeable)
+        for item_id, row in local.index.items():
+            self.assertEqual(index[item_id], row)
+        self.assertNotIn("nope", index)
+        self.assertNotIn("9000000", index)
+
+    def test_republish_swaps_segment(self):
+        self.publish(Catalog("movies", make_items(5)))
+        first = catalog_store.current(self.root, "movies")
+        old = catalog_store.attach(self.root, first)
+        self.publish(Catalog("movies", make_items(8)))
+        second = catalog_store.current(self.root, "movies")
+
+        self.assertNotEqual(first, second)
+        self.assertFalse(os.path.exists(os.path.join(self.root, first)))
+        # the old mapping stays readable for workers that still use it
+        self.assertEqual(len(old[4]), 5)
+        self.assertEqual(old[4][4].name, "item 4")
+
+    def test_empty_catalog_and_unpublish(self):
+        self.publish(Catalog("a.b", []))
+        self.publish(Catalog("a", make_items(3)))
+        _, ids, index, _, items = catalog_store.attach(self.root, catalog_store.current(self.root, "a.b"))
+        self.assertEqual((len(ids), len(items)), (0, 0))
+        self.assertIsNone(index.get("1"))
+
+        catalog_store.unpublish(self.root, "a")
+        self.assertIsNone(catalog_store.current(self.root, "a"))
+        self.assertIsNotNone(catalog_store.current(self.root, "a.b"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+import queue
+import threading
+import unittest
+from unittest import mock
+
+from flask import Flask
+
+import click_logger
+
+
+class ClickCollection:
+    def __init__(self, fail=False):
+        self.batches = []
+        self.fail = fail
+
+    def insert_many(self, docs, ordered=True):
+        if self.fail:
+            raise RuntimeError("down")
+        self.batches.append(list(docs))
+
+
+class TestClickLogger(unittest.TestCase):
+    def setUp(self):
+        self.collection = ClickCollection()
+        # no background thread: batches are taken explicitly below
+        patches = [
+            mock.patch.object(click_logger, "_queue", queue.Queue(maxsize=3)),
+            mock.patch.object(click_logger, "QUEUE_MAX", 3),
+            mock.patch.object(click_logger, "BATCH_SIZE", 2),
+            mock.patch.object(click_logger, "_ensure_flusher"),
+            mock.patch.object(click_logger, "_stop", threading.Event()),
+            mock.patch.object(click_logger, "_flusher", None),
+            mock.patch.object(click_logger, "get_click_logs_collection", return_value=self.collection),
+            mock.patch.dict(click_logger._stats, {k: 0 for k in click_logger._stats}),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def test_full_buffer_drops(self):
+        accepted = [click_logger.enqueue_click({"n": i}) for i in range(5)]
+        self.assertEqual(accepted, [True, True, True, False, False])
+        stats = click_logger.click_stats()
+        self.assertEqual((stats["accepted"], stats["dropped"], stats["queued"]), (3, 2, 3))
+
+    def test_full_buffer_blocks_then_drops(self):
+        with mock.patch.object(click_logger, "OVERFLOW", "block"), \
+                mock.patch.object(click_logger, "BLOCK_TIMEOUT", 0.01):
+            for i in range(3):
+                click_logger.enqueue_click({"n": i})
+            self.assertFalse(click_logger.enqueue_click({"n": 3}))
+            click_logger._queue.get_nowait()  # room again
+            self.assertTrue(click_logger.enqueue_click({"n": 4}))
+
+    def test_batches_are_capped(self):
+        for i in range(3):
+            click_logger.enqueue_click({"n": i})
+        self.assertEqual(len(click_logger._take_batch(0)), 2)
+        self.assertEqual(len(click_logger._take_batch(0)), 1)
+        self.assertEqual(click_logger._take_batch(0), [])
+
+    def test_shutdown_flushes_the_buffer(self):
+        for i in range(3):
+            click_logger.enqueue_click({"n": i})
+        click_logger._shutdown()
+        self.assertEqual([[d["n"] for d in b] for b in self.collection.batches], [[0, 1], [2]])
+        stats = click_logger.click_stats()
+        self.assertEqual((stats["flushed"], stats["batches"], stats["queued"]), (3, 2, 0))
+
+    def test_failed_write_is_counted(self):
+        self.collection.fail = True
+        click_logger.enqueue_click({"n": 0})
+        click_logger.flush_clicks()
+        self.assertEqual(click_logger.click_stats()["failed"], 1)
+
+    def test_route(self):
+        app = Flask(__name__)
+        app.register_blueprint(click_logger.click_api, url_prefix="/api")
+        client = app.test_client()
+        self.assertEqual(client.post("/api/log_click", data="x").status_code, 400)
+        codes = [client.post("/api/log_click", json={"item": i}).status_code for i in range(4)]
+        self.assertEqual(codes, [202, 202, 202, 503])
+        self.assertIn("received_at", click_logger._queue.get_nowait())
+
+
+if __name__ == "__main__":
+    unittest.main()
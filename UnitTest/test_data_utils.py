@@ -0,0 +1,70 @@
+import unittest
+
+from core import data_utils
+from core.data_utils import Item, compiled, field_projection, normalize, vector_error
+
+MAPPING = {"id": "sku", "name": "title", "description": "about", "image": "img",
+           "featureVector": "fv", "latitude": "lat", "longitude": "lng"}
+DOC = {"sku": 7, "title": "T", "about": "long text", "img": "x.png", "fv": [1, 0],
+       "lat": 1.5, "lng": 2.5, "reviews": ["..."]}
+
+
+class TestFieldPresets(unittest.TestCase):
+    def test_projection(self):
+        self.assertEqual(field_projection(MAPPING, "scoring"), {"_id": 0, "sku": 1, "fv": 1})
+        self.assertEqual(field_projection({"id": "sku", "name": "title"}, "listing"),
+                         {"_id": 0, "sku": 1, "title": 1})
+        self.assertEqual(field_projection(MAPPING, ["id", "name"]), {"_id": 0, "sku": 1, "title": 1})
+
+    def test_normalize_presets(self):
+        self.assertEqual(normalize([DOC], MAPPING, "scoring"), [Item("7", features=b"\x01\x00")])
+        self.assertEqual(normalize([DOC], MAPPING, "listing"), [Item(
+            "7", "T", "long text", "x.png", latitude=1.5, longitude=2.5,
+        )])
+        self.assertEqual(normalize([DOC], MAPPING)[0].features, b"\x01\x00")
+        # no vector needed for a listing
+        self.assertEqual(normalize([{"sku": 1}], MAPPING, "listing")[0].name, "Unknown")
+        self.assertEqual(normalize([{"sku": 1}], MAPPING, "scoring"), [])
+
+    def test_bad_documents_go_to_rejected(self):
+        rejected = []
+        docs = [DOC, {"title": "no id"}, None, {"sku": 2}, {"sku": 3, "fv": [1, 300]}, {"sku": 4, "fv": 2}]
+        items = normalize(docs, MAPPING, "detail", rejected)
+        self.assertEqual([it.id for it in items], ["7"])
+        self.assertEqual(rejected, docs[1:])
+
+    def test_items(self):
+        item = normalize([{**DOC, "fv": [1.0, 0.0, 1.0]}], MAPPING)[0]
+        self.assertEqual(item.features, b"\x01\x00\x01")
+        self.assertEqual(item.to_dict(), {"id": "7", "name": "T", "description": "long text",
+                                          "image": "x.png", "latitude": 1.5, "longitude": 2.5})
+        self.assertEqual(Item("1").to_dict(), {"id": "1"})
+
+    def test_vectors_that_do_not_fit_are_rejected(self):
+        rejected = []
+        docs = [{"sku": i, "fv": fv} for i, fv in
+                enumerate(([0.5, 1.0], [-1.0, 0.0], [1.0, 300.0], [float("nan")], [[1], [0]], ["1"]))]
+        self.assertEqual(normalize(docs, MAPPING, "scoring", rejected), [])
+        self.assertEqual(rejected, docs)
+
+    def test_vector_error_names_the_first_bad_item(self):
+        self.assertIsNone(vector_error([DOC, {"sku": 2}], MAPPING))
+        error = vector_error([DOC, {"sku": 3, "fv": [1, -0.5]}, {"sku": 4, "fv": 2}], MAPPING)
+        self.assertIn("Item 3", error)
+        self.assertIn("0-255", error)
+
+    def test_compiled_per_mapping(self):
+        self.assertIs(compiled(MAPPING, "listing"), compiled(dict(MAPPING), "listing"))
+        remapped = compiled({**MAPPING, "name": "about"}, "listing")
+        self.assertIsNot(remapped, compiled(MAPPING, "listing"))
+        self.assertEqual(remapped([DOC], [])[0].name, "long text")
+
+    def test_compiled_cache_is_bounded(self):
+        for i in range(data_utils.MAX_COMPILED + 5):
+            compiled({**MAPPING, "id": f"sku{i}"}, "scoring")
+        self.assertEqual(len(data_utils._compiled), data_utils.MAX_COMPILED)
+        self.assertEqual(compiled(MAPPING, "scoring")([DOC], [])[0].id, "7")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,21 @@
+import random
+import unittest
+
+from core import evaluation
+
+
+class TestEvaluate(unittest.TestCase):
+    def test_pool_matches_inline_in_order(self):
+        rng = random.Random(1)
+        vectors = [[rng.randint(0, 1) for _ in range(6)] for _ in range(20)]
+        ratings = [rng.choice((1, 2, 3, 4, 5)) for _ in range(20)]
+        splits = evaluation.make_splits(len(vectors), [10, 14], 4, seed=3)
+        tasks = [("cbc", vectors, ratings, 6, train, test) for _, train, test in splits]
+
+        inline = [mae for mae, _ in evaluation._map(tasks, 1)]
+        pooled = [mae for mae, _ in evaluation._map(tasks, 3)]
+        self.assertEqual(pooled, inline)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from core import catalog, facets
+from core.data_utils import Item
+from core.facets import FacetIndex, rows_of
+
+
+class TestFacetIndex(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(3)
+        self.size = 200  # spans several 64-bit words, last one partial
+        self.tags = {v: set(rng.choice(self.size, 60, replace=False).tolist()) for v in "abc"}
+        self.index = FacetIndex("k", self.size, {v: sorted(rows) for v, rows in self.tags.items()})
+
+    def test_intersection_and_counts(self):
+        mask = self.index.mask(["a", "b"])
+        expected = self.tags["a"] & self.tags["b"]
+        self.assertEqual(rows_of(mask, self.size).tolist(), sorted(expected))
+        counts = self.index.counts(mask)
+        self.assertEqual(counts["a"], len(expected))
+        self.assertEqual(counts.get("c", 0), len(expected & self.tags["c"]))
+
+    def test_no_filter_and_unknown_value(self):
+        self.assertEqual(rows_of(self.index.mask([]), self.size).tolist(), list(range(self.size)))
+        self.assertEqual(self.index.counts(self.index.mask([]))["b"], 60)
+        self.assertEqual(len(rows_of(self.index.mask(["a", "nope"]), self.size)), 0)
+
+
+class TestGetFacets(unittest.TestCase):
+    def setUp(self):
+        patch = mock.patch.object(facets, "build_facets",
+                                  side_effect=lambda system, c: FacetIndex(facets._catalog_key(c), len(c), {}))
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.addCleanup(facets._indexes.pop, "shop", None)
+        self.addCleanup(catalog._generations.pop, "shop", None)
+
+    def load(self):
+        return catalog.Catalog("shop", [Item(id="1", features=b"\x01")])
+
+    def test_rebuilt_only_when_needed(self):
+        first = facets.get_facets("shop", self.load())
+        # an expired catalog reloads the same content: no new Mongo scan
+        self.assertIs(facets.get_facets("shop", self.load()), first)
+
+        catalog._generations["shop"] = catalog._generations.get("shop", 0) + 1  # an edit here
+        second = facets.get_facets("shop", self.load())
+        self.assertIsNot(second, first)
+
+        second.built_at -= facets.FACET_MAX_AGE  # edits by other workers
+        self.assertIsNot(facets.get_facets("shop", self.load()), second)
+        self.assertEqual(facets.build_facets.call_count, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
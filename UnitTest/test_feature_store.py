@@ -0,0 +1,96 @@
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from core import catalog, feature_store
+from db.collections import SYSTEMS
+
+MAPPING = {"id": "sku", "name": "name", "description": "d", "image": "i", "featureVector": "fv"}
+
+
+class FakeCollection:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def find(self, query, projection):
+        return self
+
+    def batch_size(self, size):
+        return iter([dict(d) for d in self.docs])
+
+
+class TestFeatureStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        patches = [
+            mock.patch.object(feature_store, "STORE_DIR", self.tmp.name),
+            mock.patch.dict(SYSTEMS, {"shop": {"mapping": MAPPING}}),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+        self.addCleanup(self.tmp.cleanup)
+        feature_store._stores.clear()
+
+    def build(self, docs):
+        with mock.patch.object(feature_store, "get_items_collection", return_value=FakeCollection(docs)):
+            return feature_store.load_store("shop")
+
+    def test_build_round_trip(self):
+        rng = np.random.default_rng(1)
+        matrix = rng.integers(0, 2, (30, 13))
+        docs = [{"sku": 100 + i, "fv": row.tolist()} for i, row in enumerate(matrix)]
+        store = self.build(docs)
+
+        self.assertEqual((len(store), store.width, store.packed.shape[1]), (30, 13, 2))
+        self.assertTrue(np.array_equal(store.matrix(), matrix))
+        self.assertEqual(store.vectors(["105", "nope"]), {"105": matrix[5].tolist()})
+        self.assertEqual(store.index["129"], 29)
+
+    def test_incremental_update(self):
+        old = self.build([{"sku": "a", "fv": [0, 0, 1]}, {"sku": "b", "fv": [1, 1, 1]}])
+        feature_store.update_store("shop", [
+            {"sku": "b", "fv": [0, 1, 0]},
+            {"sku": "c", "fv": [1, 0, 0]},
+        ])
+        # a worker still holding the old generation sees it unchanged
+        self.assertEqual(old.matrix().tolist(), [[0, 0, 1], [1, 1, 1]])
+        store = feature_store.load_store("shop", build=False)
+        self.assertEqual(list(store.ids), ["a", "b", "c"])
+        self.assertEqual(store.matrix().tolist(), [[0, 0, 1], [0, 1, 0], [1, 0, 0]])
+
+        # a vector of another width drops the store until it is rebuilt
+        feature_store.update_store("shop", [{"sku": "d", "fv": [1, 0]}])
+        self.assertIsNone(feature_store.load_store("shop", build=False))
+
+    def test_items_without_vector_array_are_skipped(self):
+        store = self.build([{"sku": "a", "fv": None}, {"sku": "b", "fv": [1, 0]},
+                            {"sku": "c", "fv": 3}, {"sku": "d"}, {"sku": "e", "fv": [0, 1]}])
+        self.assertEqual(list(store.ids), ["b", "e"])
+        self.assertEqual(feature_store.stored_filter("shop"), {"fv": {"$type": "array"}})
+
+    def test_catalog_uses_the_stored_items(self):
+        docs = [{"sku": "a", "fv": [1, 0]}, {"sku": "b", "fv": None}, {"sku": "c", "fv": [0, 1]}]
+        self.build(docs)
+
+        def load_data(system, fields=None, query=None):
+            # what Mongo sends for the {"$type": "array"} filter
+            self.assertEqual(query, {"fv": {"$type": "array"}})
+            return [{"sku": d["sku"]} for d in docs if isinstance(d["fv"], list)]
+
+        with mock.patch.object(catalog, "load_data", side_effect=load_data), \
+                mock.patch.object(catalog, "remove_store") as remove_store:
+            built = catalog._build("shop")
+        remove_store.assert_not_called()
+        self.assertEqual(built.ids, ["a", "c"])
+        self.assertEqual(built.matrix.tolist(), [[1, 0], [0, 1]])
+
+    def test_non_binary_vectors_are_not_stored(self):
+        self.assertIsNone(self.build([{"sku": "a", "fv": [0, 2, 1]}]))
+        self.assertIsNone(feature_store.load_store("shop"))
+
+
+if __name__ == "__main__":
+    unittest.main()
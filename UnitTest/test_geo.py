@@ -0,0 +1,86 @@
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from core import geo
+from db.collections import SYSTEMS
+
+MAPPING = {"id": "id", "name": "name", "description": "d", "image": "i",
+           "featureVector": "fv", "latitude": "lat", "longitude": "lng"}
+
+
+class FakeCollection:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def find(self, query, projection=None):
+        if "_id" in query:
+            return [dict(d) for d in self.docs if d["_id"] in query["_id"]["$in"]]
+        return [dict(d) for d in self.docs]
+
+
+class MetadataCollection:
+    def __init__(self):
+        self.docs = {}
+
+    def find_one(self, query, projection=None):
+        doc = self.docs.get(query["collection_name"], {})
+        if all(doc.get(k) == v for k, v in query.items() if k != "collection_name"):
+            return doc or None
+        return None
+
+    def update_one(self, query, update, upsert=False):
+        doc = self.docs.setdefault(query["collection_name"], {"collection_name": query["collection_name"]})
+        doc.update(update.get("$set", {}))
+        for k in update.get("$unset", {}):
+            doc.pop(k, None)
+
+
+class TestGeo(unittest.TestCase):
+    def test_haversine(self):
+        # Paris to London is about 344 km
+        km = geo.haversine_km(48.8566, 2.3522, np.array([51.5074, 48.8566]), np.array([-0.1278, 2.3522]))
+        self.assertAlmostEqual(km[0], 343.5, delta=1)
+        self.assertEqual(km[1], 0)
+
+    def test_geo_point(self):
+        self.assertEqual(geo.geo_point({"lat": "10.5", "lng": 20}, MAPPING),
+                         {"type": "Point", "coordinates": [20.0, 10.5]})
+        for bad in ({"lat": 91, "lng": 0}, {"lat": "x", "lng": 0}, {"lat": float("nan"), "lng": 0}, {}):
+            self.assertIsNone(geo.geo_point(bad, MAPPING))
+
+    def test_scan_nearby(self):
+        docs = [
+            {"_id": 1, "lat": 40.01, "lng": -74.0},    # ~1.1 km
+            {"_id": 2, "lat": 40.0, "lng": -74.0},     # 0 km
+            {"_id": 3, "lat": 41.0, "lng": -74.0},     # ~111 km
+            {"_id": 4, "lat": None, "lng": -74.0},
+            {"_id": 5, "lat": 40.02, "lng": -74.0},    # ~2.2 km
+        ]
+        with mock.patch.dict(SYSTEMS, {"places": {"mapping": MAPPING}}), \
+                mock.patch.object(geo, "get_items_collection", return_value=FakeCollection(docs)):
+            found = geo.scan_nearby("places", 40.0, -74.0, radius_km=10, limit=2)
+        self.assertEqual([d["_id"] for d in found], [2, 1])
+        self.assertAlmostEqual(found[1]["distance"], 1.11, places=2)
+
+    def test_backfill_runs_once_per_mapping(self):
+        metadata = MetadataCollection()
+        items = mock.Mock()
+        with mock.patch.object(geo, "get_system_metadata_collection", return_value=metadata), \
+                mock.patch.object(geo, "get_items_collection", return_value=items), \
+                mock.patch.object(geo, "_backfill") as backfill:
+            self.assertTrue(geo.ensure_geo_index("places", MAPPING))
+            self.assertTrue(geo.ensure_geo_index("places", MAPPING))
+            self.assertEqual(backfill.call_count, 1)
+            # remapped coordinates need a new backfill
+            self.assertTrue(geo.ensure_geo_index("places", {**MAPPING, "latitude": "y"}))
+            self.assertEqual(backfill.call_count, 2)
+            geo.clear_points("places")
+            geo.ensure_geo_index("places", {**MAPPING, "latitude": "y"})
+            self.assertEqual(backfill.call_count, 3)
+        self.assertEqual(items.create_index.call_count, 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
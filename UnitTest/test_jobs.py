@@ -0,0 +1,77 @@
+import random
+import unittest
+from unittest import mock
+
+from core import jobs
+from core.jobs import get_job, submit_fit, wait_for
+from core.math_utils import calc_delta, solve_profile
+from core.solvers import profile_objective
+
+
+def make_instance(seed, n=20, m=6):
+    rng = random.Random(seed)
+    ratings = [rng.choice((1, 2, 3, 4, 5)) for _ in range(m)]
+    vectors = [[int(rng.random() < 0.3) for _ in range(n)] + [r] for r in ratings]
+    return vectors, calc_delta(ratings, n)
+
+
+class TestProfileJobs(unittest.TestCase):
+    def test_fit_in_pool(self):
+        vectors, deltas = make_instance(1)
+        job = submit_fit("u1", "movie", vectors, deltas, persist=False)
+        self.assertTrue(wait_for(job, 60))
+        self.assertEqual(job.status, "done")
+        self.assertIs(get_job(job.id), job)
+        self.assertAlmostEqual(profile_objective(job.profile, vectors, deltas),
+                               profile_objective(solve_profile(vectors, deltas), vectors, deltas))
+
+    def test_optimal_previous_finishes_without_pool(self):
+        vectors, deltas = make_instance(2)
+        previous = [0.0] * len(vectors[0])
+        deltas = [0.0] * len(deltas)  # the empty profile fits exactly
+        job = submit_fit("u2", "movie", vectors, deltas, previous, persist=False)
+        self.assertTrue(job.done.is_set())
+        self.assertIs(job.profile, previous)
+
+    def test_submissions_are_coalesced(self):
+        first, second = make_instance(3), make_instance(4)
+        launched = []
+        # the pool is held back, so the first solve is still running
+        with mock.patch.object(jobs, "_launch", side_effect=lambda job, inputs: launched.append(inputs)):
+            job = submit_fit("u3", "movie", *first, persist=False)
+            again = submit_fit("u3", "movie", *second, persist=False)
+            self.assertIs(again, job)
+            self.assertEqual(len(launched), 1)
+
+            jobs._finished(job, DoneFuture(launched[0]))
+            # the later ratings are solved next, warm-started from the first result
+            self.assertEqual(len(launched), 2)
+            self.assertFalse(job.done.is_set())
+            jobs._finished(job, DoneFuture(launched[1]))
+
+        self.assertEqual(job.status, "done")
+        vectors, deltas = second
+        self.assertAlmostEqual(profile_objective(job.profile, vectors, deltas),
+                               profile_objective(solve_profile(vectors, deltas), vectors, deltas))
+
+    def test_failed_fit(self):
+        with mock.patch.object(jobs, "_launch", side_effect=lambda job, inputs: None):
+            job = submit_fit("u4", "movie", *make_instance(5), persist=False)
+        jobs._finished(job, DoneFuture(None))
+        self.assertTrue(wait_for(job, 0))
+        self.assertEqual(job.status, "failed")
+
+
+class DoneFuture:
+    """A finished future running the solve inline, or failing without inputs."""
+
+    def __init__(self, inputs):
+        self.inputs = inputs
+
+    def result(self):
+        if self.inputs is None:
+            raise RuntimeError("solver crashed")
+        return jobs._run(*self.inputs)
+
+if __name__ == "__main__":
+    unittest.main()
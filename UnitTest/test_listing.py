@@ -0,0 +1,115 @@
+import unittest
+from unittest import mock
+
+from bson import ObjectId
+
+from core import listing
+from core.catalog import Catalog
+from core.data_utils import Item
+from core.facets import FacetIndex
+from db.collections import SYSTEMS
+
+MAPPING = {"id": "sku", "name": "title", "description": "d", "image": "img", "featureVector": "fv"}
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, field, direction):
+        self.docs.sort(key=lambda d: d[field])
+        return self
+
+    def limit(self, n):
+        return iter(self.docs[:n])
+
+
+class FakeCollection:
+    def __init__(self, docs):
+        self.docs = docs
+        self.calls = []
+
+    def find(self, query, projection):
+        self.calls.append((query, projection))
+        cond = query["sku"]
+        docs = [d for d in self.docs if "$gt" not in cond or d["sku"] > cond["$gt"]]
+        return FakeCursor([{k: v for k, v in d.items() if k in projection} for d in docs])
+
+
+class TestItemPage(unittest.TestCase):
+    def test_cursor_round_trip_keeps_type(self):
+        for value in (7, "abc", ObjectId()):
+            self.assertEqual(listing.decode_cursor(listing.encode_cursor(value)), value)
+        with self.assertRaises(ValueError):
+            listing.decode_cursor("not a cursor")
+
+    def test_pages_through_by_id(self):
+        docs = [{"sku": i, "title": f"t{i}", "fv": [1, 0], "extra": "x"} for i in (5, 1, 4, 2, 3)]
+        collection = FakeCollection(docs)
+        with mock.patch.dict(SYSTEMS, {"shop": {"mapping": MAPPING}}), \
+                mock.patch.object(listing, "get_items_collection", return_value=collection):
+            first, cursor = listing.item_page("shop", limit=2)
+            second, cursor = listing.item_page("shop", after=cursor, limit=2)
+            last, end = listing.item_page("shop", after=cursor, limit=2)
+
+        self.assertEqual([[it.id for it in page] for page in (first, second, last)],
+                         [["1", "2"], ["3", "4"], ["5"]])
+        self.assertIsNone(end)
+        self.assertEqual(collection.calls[0][1], {"_id": 0, "sku": 1, "title": 1, "d": 1, "img": 1})
+        self.assertIsNone(first[0].features)
+
+
+class TestFacetPage(unittest.TestCase):
+    def setUp(self):
+        self.catalog = Catalog("shop", [Item(id=str(i), features=bytes([i])) for i in range(10)])
+        # "even" on rows 0, 2, ..., 8
+        self.facets = FacetIndex("k", 10, {"even": list(range(0, 10, 2)), "odd": list(range(1, 10, 2))})
+        patches = [
+            mock.patch.object(listing, "get_catalog", side_effect=lambda system: self.catalog),
+            mock.patch.object(listing, "get_facets", side_effect=lambda system, catalog: self.facets),
+            mock.patch.object(listing, "get_items_collection"),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def pages(self, limit):
+        pages, cursor = [], None
+        while True:
+            items, cursor = listing.facet_page("shop", ["even"], cursor, limit)
+            pages.append([it.id for it in items])
+            if cursor is None:
+                return pages
+
+    def test_pages_through_the_mask_without_mongo(self):
+        self.assertEqual(self.pages(2), [["0", "2"], ["4", "6"], ["8"]])
+        self.assertEqual(self.pages(5), [["0", "2", "4", "6", "8"]])
+        listing.get_items_collection.assert_not_called()
+        self.assertEqual(listing.facet_page("shop", ["even", "odd"]), ([], None))
+
+    def test_cursor_follows_its_item_across_reloads(self):
+        _, cursor = listing.facet_page("shop", ["even"], limit=2)  # ends at item "2"
+        # item "1" removed: "2" is now row 1 and the even values sit on rows 1, 3, ...
+        self.catalog = Catalog("shop", [Item(id=str(i), features=bytes([i])) for i in range(10) if i != 1])
+        self.facets = FacetIndex("k2", 9, {"even": [0, 1, 3, 5, 7]})
+        items, _ = listing.facet_page("shop", ["even"], cursor, limit=2)
+        self.assertEqual([it.id for it in items], ["4", "6"])
+        with self.assertRaises(ValueError):
+            listing.facet_page("shop", ["even"], listing.encode_cursor(7))
+
+
+class TestNearbyItems(unittest.TestCase):
+    def test_distances_follow_ids_past_rejected_documents(self):
+        docs = [
+            {"title": "no id", "distance": 0.1},
+            {"sku": 8, "title": "t8", "distance": 0.5},
+            {"sku": 3, "title": "t3", "distance": 2.0},
+        ]
+        with mock.patch.dict(SYSTEMS, {"shop": {"mapping": MAPPING}}), \
+                mock.patch.object(listing, "nearby", return_value=docs):
+            items = listing.nearby_items("shop", 40.0, -74.0)
+        self.assertEqual([(it.id, it.distance) for it in items], [("8", 0.5), ("3", 2.0)])
+
+
+if __name__ == "__main__":
+    unittest.main()
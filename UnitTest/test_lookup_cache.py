@@ -0,0 +1,50 @@
+import unittest
+
+from flask import Flask
+
+from core import lookup_cache
+
+
+class TestLookupCache(unittest.TestCase):
+    def setUp(self):
+        lookup_cache._entries.clear()
+        self.loads = 0
+
+    def load(self):
+        self.loads += 1
+        return {"n": self.loads}
+
+    def test_process_cache_and_invalidation(self):
+        self.assertEqual(lookup_cache.cached("user", "a", self.load), {"n": 1})
+        self.assertEqual(lookup_cache.cached("user", "a", self.load), {"n": 1})
+        lookup_cache.invalidate("user", "a")
+        self.assertEqual(lookup_cache.cached("user", "a", self.load), {"n": 2})
+        lookup_cache.cached("user", "b", self.load)
+        lookup_cache.invalidate("user")
+        lookup_cache.cached("user", "a", self.load)
+        lookup_cache.cached("user", "b", self.load)
+        self.assertEqual(self.loads, 5)
+
+    def test_request_memo_survives_expiry(self):
+        app = Flask(__name__)
+        with app.app_context():
+            lookup_cache.cached("taste", "u", self.load)
+            lookup_cache._entries.clear()  # as if the TTL ran out
+            lookup_cache.cached("taste", "u", self.load)
+            self.assertEqual(self.loads, 1)
+            lookup_cache.invalidate("taste", "u")
+            lookup_cache.cached("taste", "u", self.load)
+            self.assertEqual(self.loads, 2)
+
+    def test_invalidation_during_load_is_not_cached(self):
+        def racing_load():
+            lookup_cache.invalidate("system", "s")
+            return self.load()
+
+        lookup_cache.cached("system", "s", racing_load)
+        lookup_cache.cached("system", "s", self.load)
+        self.assertEqual(self.loads, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,48 @@
+import random
+import unittest
+
+import numpy as np
+
+from core.math_utils import est_rating, est_ratings, top_k
+
+
+class TestEstRatings(unittest.TestCase):
+    def test_matches_scalar_est_rating(self):
+        rng = random.Random(7)
+        for n in (1, 5, 17):
+            vectors = [[rng.randint(0, 1) for _ in range(n)] for _ in range(50)]
+            matrix = np.array(vectors, dtype=np.uint8)
+            profile = [float(rng.choice((-1, 0, 1))) for _ in range(n)]
+            expected = [est_rating(profile, v, n) for v in vectors]
+            self.assertEqual(est_ratings(profile, matrix, n).tolist(), expected)
+
+    def test_profile_with_extra_rating_column(self):
+        # Profiles fitted on vectors with the appended rating have n + 1 entries
+        vectors = [[1, 0, 1], [0, 0, 0]]
+        profile = [1, -1, 1, -1]
+        expected = [est_rating(profile, v, 3) for v in vectors]
+        matrix = np.array(vectors, dtype=np.uint8)
+        self.assertEqual(est_ratings(profile, matrix, 3).tolist(), expected)
+
+
+class TestTopK(unittest.TestCase):
+    def full_sort(self, scores):
+        return sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)
+
+    def test_matches_stable_full_sort_with_ties(self):
+        rng = random.Random(3)
+        scores = [rng.choice((1.0, 2.5, 3.0, 4.0, 5.0)) for _ in range(200)]
+        for k, offset in ((1, 0), (10, 0), (10, 10), (7, 190), (300, 0)):
+            self.assertEqual(top_k(scores, k, offset),
+                             self.full_sort(scores)[offset:offset + k])
+
+    def test_exclude_and_min_score(self):
+        scores = [5.0, 4.0, 3.0, 5.0, 1.0, 4.5]
+        self.assertEqual(top_k(scores, 3, exclude={0}), [3, 5, 1])
+        self.assertEqual(top_k(scores, 10, min_score=4.0), [0, 3, 5, 1])
+        self.assertEqual(top_k(scores, 0), [])
+        self.assertEqual(top_k([], 5), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,23 @@
+import random
+import unittest
+
+import numpy as np
+
+from core.math_utils import est_ratings
+from core.precompute import score_block
+
+
+class TestScoreBlock(unittest.TestCase):
+    def test_matches_est_ratings_per_user(self):
+        rng = random.Random(5)
+        n = 12
+        matrix = np.array([[rng.randint(0, 1) for _ in range(n)] for _ in range(80)], dtype=np.uint8)
+        # n + 1 entries like fitted profiles, with the odd unset feature
+        profiles = [[rng.choice((-1, 0, 1, None)) for _ in range(n + 1)] for _ in range(9)]
+        scores = score_block(matrix, profiles, n)
+        for u, profile in enumerate(profiles):
+            self.assertEqual(scores[:, u].tolist(), est_ratings(profile, matrix, n).tolist())
+
+
+if __name__ == "__main__":
+    unittest.main()
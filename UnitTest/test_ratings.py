@@ -0,0 +1,211 @@
+import unittest
+from datetime import datetime
+from unittest import mock
+
+from bson import ObjectId
+from flask import Flask
+from pymongo import DeleteOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+import apis
+
+from core import ratings
+
+
+class FakeCollection:
+    """find() with {field: {"$in": [...]}} filters; bulk_write records ops."""
+
+    def __init__(self, docs):
+        self.docs = docs
+        self.ops = []
+
+    def find(self, query, projection=None):
+        return [
+            dict(d) for d in self.docs
+            if all(d.get(field) in cond["$in"] for field, cond in query.items())
+        ]
+
+    def bulk_write(self, ops, ordered=True):
+        self.ops += ops
+
+
+class TestMigrateBatch(unittest.TestCase):
+    def setUp(self):
+        self.alice = ObjectId()
+        users = FakeCollection([{"_id": self.alice, "username": "alice"}])
+        patch = mock.patch.object(ratings, "get_users_collection", return_value=users)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def migrate(self, docs):
+        collection = FakeCollection(docs)
+        with mock.patch.object(ratings, "get_ratings_collection", return_value=collection):
+            counts = ratings._migrate_batch([dict(d) for d in docs])
+        return counts, collection.ops
+
+    def test_converts_and_merges(self):
+        old, new = datetime(2024, 1, 1), datetime(2024, 6, 1)
+        web = {"_id": ObjectId(), "user_id": self.alice, "system": "s", "item_id": "1",
+               "rating": 4.0, "timestamp": old}
+        api = {"_id": ObjectId(), "user_id": "alice", "system": "s", "item_id": "1",
+               "value": 2.0, "timestamp": new}
+        only_api = {"_id": ObjectId(), "user_id": "alice", "system": "s", "item_id": "2",
+                    "value": 5.0, "timestamp": new}
+        ghost = {"_id": ObjectId(), "user_id": "bob", "system": "s", "item_id": "1", "value": 1.0}
+        done = {"_id": ObjectId(), "user_id": self.alice, "system": "s", "item_id": "3", "value": 3.0}
+
+        counts, ops = self.migrate([api, web, only_api, ghost, done])
+
+        self.assertEqual(counts, {"converted": 2, "merged": 1, "skipped": 1})
+        self.assertEqual(ops, [
+            UpdateOne({"_id": web["_id"]},
+                      {"$set": {"user_id": self.alice, "value": 4.0}, "$unset": {"rating": ""}}),
+            # the API rating is newer, so its value replaces the web one
+            UpdateOne({"_id": web["_id"]},
+                      {"$set": {"value": 2.0, "timestamp": new}, "$unset": {"rating": ""}}),
+            DeleteOne({"_id": api["_id"]}),
+            UpdateOne({"_id": only_api["_id"]},
+                      {"$set": {"user_id": self.alice, "value": 5.0}, "$unset": {"rating": ""}}),
+        ])
+
+    def test_keeps_newer_canonical_rating(self):
+        canonical = {"_id": ObjectId(), "user_id": self.alice, "system": "s", "item_id": "1",
+                     "value": 3.0, "timestamp": datetime(2024, 6, 1)}
+        stale = {"_id": ObjectId(), "user_id": "alice", "system": "s", "item_id": "1",
+                 "value": 1.0, "timestamp": datetime(2024, 1, 1)}
+        counts, ops = self.migrate([canonical, stale])
+        self.assertEqual(counts, {"converted": 0, "merged": 1, "skipped": 0})
+        self.assertEqual(ops, [DeleteOne({"_id": stale["_id"]})])
+
+
+
+class QueryCollection:
+    """find() with equality and {"$in": [...]} conditions."""
+
+    def __init__(self, docs):
+        self.docs = docs
+
+    def find(self, query, projection=None):
+        def match(value, cond):
+            return value in cond["$in"] if isinstance(cond, dict) else value == cond
+        return [dict(d) for d in self.docs if all(match(d.get(f), c) for f, c in query.items())]
+
+
+class TestReads(unittest.TestCase):
+    def setUp(self):
+        self.alice = ObjectId()
+        self.docs = [
+            {"user_id": self.alice, "system": "s", "item_id": "1", "rating": 4.0},   # web, old field
+            {"user_id": "alice", "system": "s", "item_id": "2", "value": 2.0},       # API, old key
+            {"user_id": self.alice, "system": "s", "item_id": "3", "value": 5.0},
+            {"user_id": self.alice, "system": "s", "item_id": "4"},                   # no score at all
+        ]
+        patches = [
+            mock.patch.object(ratings, "get_ratings_collection", return_value=QueryCollection(self.docs)),
+            mock.patch.object(ratings, "user_object_id", return_value=self.alice),
+            mock.patch.object(ratings, "username_of", return_value="alice"),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def test_unmigrated_reads_see_old_ratings(self):
+        with mock.patch.object(ratings, "migrated", return_value=False):
+            expected = {"1": 4.0, "2": 2.0, "3": 5.0}
+            self.assertEqual(ratings.get_rating_map(self.alice, "s"), expected)
+            self.assertEqual(ratings.get_rating_map("alice", "s"), expected)
+            self.assertEqual(ratings.get_rating(self.alice, "s", "2"), 2.0)
+            self.assertEqual(ratings.get_ratings_by_items(self.alice, "s", ["1", "9"]), {"1": 4.0})
+            self.assertEqual(ratings.rated_items("s"), {str(self.alice): {"1", "2", "3", "4"}})
+
+    def test_migrated_reads_never_fail_on_old_fields(self):
+        with mock.patch.object(ratings, "migrated", return_value=True):
+            self.assertEqual(ratings.get_rating_map(self.alice, "s"), {"1": 4.0, "3": 5.0})
+
+
+class WriteCollection:
+    """bulk_write of UpdateOne upserts against a dict keyed by item_id."""
+
+    def __init__(self, existing=(), failing=()):
+        self.existing = set(existing)
+        self.failing = set(failing)
+        self.calls = 0
+        self.values = {}
+
+    def bulk_write(self, ops, ordered=True):
+        self.calls += 1
+        upserted, errors = {}, []
+        for i, op in enumerate(ops):
+            item_id = op._filter["item_id"]
+            if item_id in self.failing:
+                errors.append({"index": i, "errmsg": "write failed"})
+                continue
+            self.values[item_id] = op._doc["$set"]["value"]
+            if item_id not in self.existing:
+                upserted[i] = ObjectId()
+        if errors:
+            raise BulkWriteError({"writeErrors": errors,
+                                  "upserted": [{"index": i, "_id": v} for i, v in upserted.items()]})
+        return mock.Mock(upserted_ids=upserted)
+
+
+class TestWriteRatings(unittest.TestCase):
+    def setUp(self):
+        self.collection = WriteCollection(existing={"2"}, failing={"9"})
+        patch = mock.patch.object(ratings, "get_ratings_collection", return_value=self.collection)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def test_reports_each_item_in_input_order(self):
+        report = ratings.write_ratings(ObjectId(), "shop", [
+            {"item_id": "1", "value": 4},
+            {"item_id": 2, "rating": "3.5"},
+            {"item_id": "", "value": 1},
+            {"item_id": "3", "value": "x"},
+            {"item_id": "4", "value": float("nan")},
+            "not a dict",
+            {"item_id": "9", "value": 2},
+        ])
+        self.assertEqual([(e["item_id"], e["status"]) for e in report["items"]], [
+            ("1", "inserted"), ("2", "updated"), ("", "rejected"), ("3", "rejected"),
+            ("4", "rejected"), (None, "rejected"), ("9", "rejected"),
+        ])
+        self.assertEqual(report["items"][-1]["error"], "write failed")
+        self.assertEqual((report["inserted"], report["updated"], report["rejected"]), (1, 1, 5))
+        self.assertEqual(self.collection.calls, 1)
+
+    def test_last_entry_for_an_item_wins(self):
+        report = ratings.write_ratings(ObjectId(), "shop", [
+            {"item_id": "1", "value": 1}, {"item_id": "1", "value": 5},
+        ])
+        self.assertEqual([e["status"] for e in report["items"]], ["rejected", "inserted"])
+        self.assertEqual(report["items"][0]["error"], "superseded later in the batch")
+        self.assertEqual(self.collection.values, {"1": 5.0})
+
+    def test_unknown_user_writes_nothing(self):
+        with mock.patch.object(ratings, "user_object_id", return_value=None):
+            report = ratings.write_ratings("ghost", "shop", [{"item_id": "1", "value": 1}])
+        self.assertEqual(report["rejected"], 1)
+        self.assertEqual(self.collection.calls, 0)
+
+    def test_batch_without_valid_ratings_is_a_400(self):
+        app = Flask(__name__)
+        app.register_blueprint(apis.api_routes, url_prefix="/api")
+        with mock.patch.object(apis, "get_user", return_value={"_id": ObjectId()}), \
+                mock.patch.object(apis, "get_system", return_value={"collection_name": "shop"}), \
+                mock.patch.object(ratings, "user_object_id", return_value=ObjectId()):
+            client = app.test_client()
+            bad = client.post("/api/batch_ratings", json={
+                "user_id": "alice", "system": "shop",
+                "ratings": [{"item_id": "1", "value": "x"}, {"item_id": "9", "value": 1}],
+            })
+            good = client.post("/api/batch_ratings", json={
+                "user_id": "alice", "system": "shop", "ratings": [{"item_id": "1", "value": 1}],
+            })
+        self.assertEqual(bad.status_code, 400)
+        self.assertEqual(bad.get_json()["rejected"], 2)
+        self.assertEqual(good.status_code, 201)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+import os
+import tempfile
+import unittest
+
+from flask import Flask, session
+
+from session_store import HybridSessionInterface
+
+
+class TestHybridSessions(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        app = Flask(__name__)
+        app.secret_key = "test"
+        self.interface = HybridSessionInterface(
+            os.path.join(self.tmp.name, "s.sqlite3"), ttl=60, cookie_max=200, max_bytes=2000
+        )
+        app.session_interface = self.interface
+
+        @app.route("/set/<int:size>")
+        def set_value(size):
+            session["blob"] = "x" * size
+            return "ok"
+
+        @app.route("/get")
+        def get_value():
+            return f"{session.get('user_id')}:{len(session.get('blob', ''))}"
+
+        @app.route("/login/<user>")
+        def login(user):
+            session["user_id"] = user
+            return "ok"
+
+        @app.route("/clear")
+        def clear():
+            session.clear()
+            return "ok"
+
+        self.client = app.test_client()
+
+    def cookie(self):
+        return self.client.get_cookie("session").value
+
+    def rows(self):
+        return self.interface.store._conn().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def test_small_session_lives_in_cookie(self):
+        self.client.get("/set/10")
+        self.assertTrue(self.cookie().startswith("c."))
+        self.assertEqual(self.client.get("/get").text, "None:10")
+        self.assertEqual(self.rows(), 0)
+
+    def test_login_is_server_side_and_revoked_on_logout(self):
+        self.client.get("/set/10")
+        self.client.get("/login/u1")
+        stolen = self.cookie()
+        self.assertTrue(stolen.startswith("s."))
+        self.assertNotIn("u1", stolen)
+        self.assertEqual(self.client.get("/get").text, "u1:10")
+
+        self.client.get("/clear")
+        self.assertEqual(self.rows(), 0)
+        self.client.set_cookie("session", stolen)
+        self.assertEqual(self.client.get("/get").text, "None:0")
+
+    def test_new_login_gets_new_id(self):
+        self.client.get("/login/u1")
+        first = self.cookie()
+        self.client.get("/login/u2")
+        self.assertNotEqual(self.cookie(), first)
+        self.assertEqual(self.rows(), 1)
+        self.client.set_cookie("session", first)
+        self.assertEqual(self.client.get("/get").text, "None:0")
+
+    def test_large_session_spills_and_shrinks_back(self):
+        self.client.get("/set/500")
+        self.assertTrue(self.cookie().startswith("s."))
+        self.assertLess(len(self.cookie()), 200)
+        self.assertEqual(self.client.get("/get").text, "None:500")
+        self.assertEqual(self.rows(), 1)
+
+        self.client.get("/set/5")
+        self.assertTrue(self.cookie().startswith("c."))
+        self.assertEqual(self.rows(), 0)
+
+        self.client.get("/set/500")
+        self.client.get("/clear")
+        self.assertIsNone(self.client.get_cookie("session"))
+        self.assertEqual(self.rows(), 0)
+
+    def test_oversized_and_tampered(self):
+        self.client.get("/set/10")
+        with self.assertLogs(level="ERROR"):
+            self.client.get("/set/5000")
+        # saved all the same, so the request's changes aren't lost
+        self.assertEqual(self.client.get("/get").text, "None:5000")
+
+        self.client.set_cookie("session", "s.bogus")
+        self.assertEqual(self.client.get("/get").text, "None:0")
+
+
+if __name__ == "__main__":
+    unittest.main()
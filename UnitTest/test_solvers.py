@@ -0,0 +1,85 @@
+import random
+import unittest
+
+from core.catalog import Catalog
+from core.data_utils import Item
+from core.math_utils import calc_delta, solve_profile
+from core.solvers import (
+    profile_objective, solve_native, fit_profile, is_optimal, refit_profile, training_set,
+)
+
+
+def make_instance(rng, n, m, density):
+    # Same shape as the routes build: feature vector plus the rating appended
+    ratings = [rng.choice((1, 2, 3, 3.5, 4, 5)) for _ in range(m)]
+    vectors = [[int(rng.random() < density) for _ in range(n)] + [r] for r in ratings]
+    return vectors, calc_delta(ratings, n)
+
+
+class TestNativeSolver(unittest.TestCase):
+    def test_matches_cbc_objective(self):
+        rng = random.Random(11)
+        answered = fallbacks = 0
+        for n, m, density in ((6, 4, 0.5), (20, 5, 0.2), (40, 8, 0.1), (30, 10, 0.25)):
+            for _ in range(6):
+                vectors, deltas = make_instance(rng, n, m, density)
+                expected = profile_objective(solve_profile(vectors, deltas), vectors, deltas)
+                profile = solve_native(vectors, deltas)
+                if profile is None:
+                    fallbacks += 1  # search budget exceeded; fit_profile falls back to CBC
+                    continue
+                answered += 1
+                self.assertEqual(len(profile), n + 1)
+                self.assertTrue(set(profile) <= {-1.0, 0.0, 1.0})
+                self.assertAlmostEqual(profile_objective(profile, vectors, deltas), expected)
+        # the native solver must answer most instances itself, not hand them all to CBC
+        self.assertGreater(answered, 2 * fallbacks)
+
+    def test_warm_start_and_fallback(self):
+        rng = random.Random(5)
+        vectors, deltas = make_instance(rng, 30, 12, 0.25)
+        expected = profile_objective(solve_profile(vectors, deltas), vectors, deltas)
+        start = solve_profile(vectors, deltas)
+        for profile in (solve_native(vectors, deltas, start=start),
+                        solve_native(vectors, deltas, max_nodes=0) or solve_profile(vectors, deltas)):
+            if profile is not None:
+                self.assertAlmostEqual(profile_objective(profile, vectors, deltas), expected)
+
+    def test_fit_profile_unknown_system_uses_default(self):
+        vectors, deltas = make_instance(random.Random(1), 8, 4, 0.5)
+        profile = fit_profile("no-such-system", vectors, deltas)
+        self.assertAlmostEqual(profile_objective(profile, vectors, deltas),
+                               profile_objective(solve_profile(vectors, deltas), vectors, deltas))
+
+
+class TestRefit(unittest.TestCase):
+    def test_reuses_profile_only_while_optimal(self):
+        rng = random.Random(23)
+        reused = 0
+        for _ in range(15):
+            ratings = {str(i): rng.choice((1, 2, 3, 4, 5)) for i in range(6)}
+            items = [Item(str(i), features=bytes(int(rng.random() < 0.3) for _ in range(25)))
+                     for i in range(10)]
+            catalog = Catalog("test", items)
+            vectors, deltas, n = training_set(catalog, ratings)
+            self.assertEqual((len(vectors), n), (6, 25))
+            previous = solve_profile(vectors, deltas)
+
+            ratings[rng.choice(list(ratings))] = rng.choice((1, 2, 3, 4, 5))
+            vectors, deltas, _ = training_set(catalog, ratings)
+            profile, changed = refit_profile("test", vectors, deltas, previous)
+            reused += not changed
+            # a reused profile must be a genuine optimum, never just a near miss
+            self.assertAlmostEqual(profile_objective(profile, vectors, deltas),
+                                   profile_objective(solve_profile(vectors, deltas), vectors, deltas))
+        self.assertGreater(reused, 0)
+
+    def test_stale_profile_is_refitted(self):
+        vectors, deltas = make_instance(random.Random(2), 10, 5, 0.4)
+        self.assertFalse(is_optimal([1.0] * 4, vectors, deltas))
+        _, changed = refit_profile("test", vectors, deltas, None)
+        self.assertTrue(changed)
+
+
+if __name__ == "__main__":
+    unittest.main()
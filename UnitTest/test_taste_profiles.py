@@ -0,0 +1,15 @@
+import unittest
+
+from core.taste_profiles import pack, unpack
+
+
+class TestPacking(unittest.TestCase):
+    def test_round_trip(self):
+        profile = [1.0, -1.0, 0.0, None, 0.9999999, -1.0000001, 1]
+        data = pack(profile)
+        self.assertEqual(len(data), len(profile))
+        self.assertEqual(unpack(data), [1, -1, 0, 0, 1, -1, 1])
+
+
+if __name__ == "__main__":
+    unittest.main()
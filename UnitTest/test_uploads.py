@@ -0,0 +1,29 @@
+import io
+import json
+import random
+import unittest
+
+from core.uploads import UploadError, iter_json_objects
+
+
+class TestIterJsonObjects(unittest.TestCase):
+    def test_matches_json_load_across_chunk_boundaries(self):
+        rng = random.Random(0)
+        values = [1, -2.5, True, None, 'a"b\\', "x]}{[", "\\", "é\n", [], {"k": [1, {"n": "]"}]}]
+        for _ in range(200):
+            data = [{f"f{i}": rng.choice(values) for i in range(rng.randint(0, 4))}
+                    for _ in range(rng.randint(0, 6))]
+            raw = json.dumps(data, indent=rng.choice((None, 2)), ensure_ascii=rng.random() < 0.5)
+            got = list(iter_json_objects(io.BytesIO(raw.encode()), chunk_size=rng.randint(1, 16)))
+            self.assertEqual(got, data)
+
+    def test_rejects_anything_but_an_array_of_objects(self):
+        for raw in (b"", b"{}", b"[1]", b"[{},]", b"[{} {}]", b"[{},1]", b"[{}",
+                    b"[{}]x", b'["a"]', b"[[1]]", b"[{]"):
+            for chunk_size in (1, 64):
+                with self.assertRaises(UploadError, msg=raw):
+                    list(iter_json_objects(io.BytesIO(raw), chunk_size))
+
+
+if __name__ == "__main__":
+    unittest.main()
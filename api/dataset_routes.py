@@ -1,11 +1,17 @@
-import json
-
 from flask import (
     Blueprint, session, render_template, request,
     flash, redirect, url_for
 )
+from core.catalog import invalidate_catalog
+from core.data_utils import vector_error
+from core.feature_store import remove_store
+from core.lookup_cache import invalidate
+from core.taste_profiles import delete_system_profiles
+from core.uploads import (
+    UploadError, discard_upload, get_upload, iter_upload_batches, spool_upload
+)
 from db.connection import get_db
-from db.collections import SYSTEMS, get_ratings_collection, get_users_collection
+from db.collections import SYSTEMS, ensure_item_index, get_ratings_collection
 
 dataset_bp = Blueprint("dataset", __name__)
 
@@ -39,19 +45,20 @@ def upload_dataset():
             errors["collection_error"] = "Bad collection name."
             return render_template("upload_dataset.html", errors=errors)
 
-        if cname in db.list_collection_names() or cname in {"users", "ratings", "system_metadata"}:
+        if cname in db.list_collection_names() or cname in {"users", "ratings", "system_metadata", "click_logs", "recommendations", "taste_profiles", "migrations"}:
             errors["collection_error"] = "Collection exists/reserved."
             return render_template("upload_dataset.html", errors=errors)
 
+        # Parsed incrementally into a spool file; the session only keeps its id
         try:
-            data = json.load(f)
-            if not (isinstance(data, list) and all(isinstance(i, dict) for i in data)):
-                raise ValueError("JSON must be an array of objects.")
-        except Exception as e:
+            upload = spool_upload(f.stream)
+        except UploadError as e:
             errors["file_error"] = f"Invalid JSON: {e}"
             return render_template("upload_dataset.html", errors=errors)
 
-        session["dataset_data"] = data
+        if session.get("dataset_upload"):
+            discard_upload(session["dataset_upload"])
+        session["dataset_upload"] = upload["id"]
         session["collection_name"] = cname
         flash("Dataset uploaded. Map the fields.", "success")
         return redirect(url_for("dataset.map_dataset"))
@@ -67,11 +74,12 @@ def map_dataset():
 
     db = get_db()
 
-    if "dataset_data" not in session:
+    upload = get_upload(session["dataset_upload"]) if "dataset_upload" in session else None
+    if upload is None:
+        session.pop("dataset_upload", None)
         flash("Upload a dataset first.", "danger")
         return redirect(url_for("dataset.upload_dataset"))
 
-    data = session["dataset_data"]
     cname = session["collection_name"]
     errors = {}
 
@@ -84,18 +92,28 @@ def map_dataset():
             "featureVector": request.form.get("vector_field", "featureVector"),
         }
 
-        found_id = any(mapping["id"] in it for it in data)
-        found_vector = any(mapping["featureVector"] in it for it in data)
+        found_id = mapping["id"] in upload["fields"]
+        found_vector = mapping["featureVector"] in upload["fields"]
 
         if not found_id:
             errors["id_error"] = f"'{mapping['id']}' not found."
         if not found_vector:
             errors["vector_error"] = f"'{mapping['featureVector']}' not found."
 
+        if not errors:
+            # refuse vectors the catalog would drop, before anything is stored
+            for batch in iter_upload_batches(upload["id"]):
+                error = vector_error(batch, mapping)
+                if error:
+                    errors["vector_error"] = error
+                    break
+
         if errors:
-            return render_template("map_dataset.html", errors=errors)
+            return render_template("map_dataset.html", errors=errors, upload=upload)
 
-        db[cname].insert_many(data)
+        for batch in iter_upload_batches(upload["id"]):
+            db[cname].insert_many(batch, ordered=False)
+        ensure_item_index(cname, mapping)
         db["system_metadata"].update_one(
             {"collection_name": cname},
             {"$set": {"mapping": mapping}},
@@ -105,15 +123,19 @@ def map_dataset():
         SYSTEMS[cname] = {
             "display": cname.capitalize(),
             "mapping": mapping,
+            "solver": SYSTEMS.get(cname, {}).get("solver"),
         }
+        remove_store(cname)
+        invalidate("system", cname)
+        invalidate_catalog(cname)
 
-        session.pop("dataset_data")
+        discard_upload(session.pop("dataset_upload"))
         session.pop("collection_name")
 
         flash(f"Dataset '{cname}' saved.", "success")
         return redirect(url_for("item.index", system=cname))
 
-    return render_template("map_dataset.html", errors=errors)
+    return render_template("map_dataset.html", errors=errors, upload=upload)
 
 
 # ────────────── Delete Dataset ──────────────
@@ -124,7 +146,6 @@ def delete_dataset(collection_name):
 
     db = get_db()
     ratings_collection = get_ratings_collection()
-    users_collection = get_users_collection()
 
     if collection_name in {"movies", "restaurants"}:
         flash("Cannot delete predefined datasets.", "danger")
@@ -137,9 +158,13 @@ def delete_dataset(collection_name):
     db[collection_name].drop()
     db["system_metadata"].delete_one({"collection_name": collection_name})
     SYSTEMS.pop(collection_name, None)
+    remove_store(collection_name)
+    invalidate("system", collection_name)
+    invalidate_catalog(collection_name)
 
     ratings_collection.delete_many({"system": collection_name})
-    users_collection.update_many({}, {"$unset": {f"taste_vector.{collection_name}": ""}})
+    delete_system_profiles(collection_name)
+    invalidate("taste")
 
     flash(f"Dataset '{collection_name}' deleted.", "success")
     return redirect(url_for("system.choose_system"))
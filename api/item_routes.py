@@ -1,32 +1,21 @@
-from math import radians, sin, sqrt, cos, atan2
-
 from bson import ObjectId
-from flask import Blueprint, session, redirect, url_for, flash, render_template, request
+import math
+
+from flask import Blueprint, session, redirect, url_for, flash, render_template, request, jsonify, abort
 
-from core.data_utils import normalize, load_data
+from core.catalog import get_item
+from core.facets import FACET_FIELD, summary
+from core.geo import RADIUS_KM, has_location, valid_location
+from core.listing import MAX_PAGE_SIZE, PAGE_SIZE, facet_page, item_page, items_by_id, nearby_items
+from core.ratings import get_rating
 from core.users import get_taste
-from db.collections import SYSTEMS, get_ratings_collection
+from db.collections import SYSTEMS
 from db.connection import get_db
 
 
 item_bp = Blueprint("item", __name__)
 
 
-def haversine_distance(lat1, lon1, lat2, lon2):
-    """
-    Compute Haversine distance (in kilometers) between (lat1, lon1) and (lat2, lon2).
-    """
-    R = 6371.0  # Earth radius in kilometers
-
-    φ1 = radians(lat1)
-    φ2 = radians(lat2)
-    Δφ = radians(lat2 - lat1)
-    Δλ = radians(lon2 - lon1)
-
-    a = sin(Δφ / 2)**2 + cos(φ1) * cos(φ2) * sin(Δλ / 2)**2
-    c = 2 * atan2(sqrt(a), sqrt(1 - a))
-    return R * c
-
 @item_bp.route("/choose_system")
 def choose_system():
     if "username" not in session:
@@ -52,60 +41,39 @@ def index():
         flash("Invalid system selected.", "danger")
         return redirect(url_for("system.choose_system"))
 
-    price_raw    = request.args.get("price", "")
-    cuisine_raw  = request.args.get("cuisine", "")
-    meal_raw     = request.args.get("meal_type", "")
-
-    cuisines = [cuisine_raw] if cuisine_raw else []
-    feature_filters = []
-    if price_raw:
-        feature_filters.append(f"priceLevel.{price_raw}")
-    if cuisines:
-        feature_filters += [f"cuisines.{c}" for c in cuisines]
-    if meal_raw:
-        feature_filters.append(f"mealTypes.{meal_raw}")
+    price_raw, cuisines, meal_raw, feature_filters = _facet_args(request.args)
+    mongo_q = {FACET_FIELD: {"$all": feature_filters}} if feature_filters else {}
 
-    mongo_q = {"features": {"$all": feature_filters}} if feature_filters else {}
+    mapping = SYSTEMS[system]["mapping"]
 
-    db = get_db()
+    # “Near Me”: only the items around the user, nearest first ($geoNear)
+    near = None
+    if request.args.get("nearest", "") == "true" and has_location(mapping):
+        try:
+            near = (float(request.args.get("user_lat", "")), float(request.args.get("user_lon", "")))
+        except ValueError:
+            near = None
+        if near and not valid_location(*near):
+            abort(400, "user_lat must be within [-90, 90] and user_lon within [-180, 180].")
+    radius = request.args.get("radius_km", RADIUS_KM, type=float)
+    if not (math.isfinite(radius) and radius > 0):
+        abort(400, "radius_km must be a positive number.")
+
+    # the first page is rendered here, the rest fetched from /items_page
+    next_cursor, total, facet_counts = None, None, {}
     try:
-        raw_items = db[system].find(mongo_q)
-        items = normalize(list(raw_items), SYSTEMS[system]["mapping"])
+        if near:
+            items = nearby_items(system, near[0], near[1], mongo_q, radius_km=radius)
+        elif feature_filters:
+            items, next_cursor = facet_page(system, feature_filters)
+        else:
+            items, next_cursor = item_page(system)
+            # match counts from the facet bitmaps
+            total, facet_counts = summary(system, feature_filters)
     except Exception as e:
         flash(f"Error loading data: {e}", "danger")
         items = []
 
-    # “Near Me” logic: check for nearest/user_lat/user_lon
-    nearest_flag = request.args.get("nearest", "")
-    user_lat_str = request.args.get("user_lat", "")
-    user_lon_str = request.args.get("user_lon", "")
-
-    if nearest_flag == "true" and user_lat_str and user_lon_str:
-        try:
-            user_lat = float(user_lat_str)
-            user_lon = float(user_lon_str)
-        except ValueError:
-
-            user_lat = user_lon = None
-
-        if user_lat is not None and user_lon is not None:
-            for it in items:
-                item_lat = it.get("latitude", None)
-                item_lon = it.get("longitude", None)
-                if item_lat is not None and item_lon is not None:
-                    try:
-                        dist = haversine_distance(
-                            user_lat, user_lon,
-                            float(item_lat), float(item_lon)
-                        )
-                        it["distance"] = dist
-                    except (ValueError, TypeError):
-                        it["distance"] = float("inf")
-                else:
-                    it["distance"] = float("inf")
-
-            items = sorted(items, key=lambda x: x.get("distance", float("inf")))
-
     return render_template(
         "index.html",
         restaurants=items,
@@ -113,10 +81,60 @@ def index():
         current_price=price_raw,
         current_cuisines=cuisines,
         current_meal=meal_raw,
+        facet_counts=facet_counts,
+        total=total,
+        next_cursor=next_cursor,
         user_has_vector=(get_taste(session["user_id"], system) is not None)
     )
 
 
+@item_bp.route("/items_page")
+def items_page():
+    """JSON page of the item listing: {"items": [...], "next": cursor or null}.
+
+    Takes the listing's filters plus `after` (the previous page's cursor)
+    and `limit`; `ids` (comma separated) returns those items instead.
+    """
+    if "username" not in session:
+        return jsonify({"error": "Not logged in."}), 401
+
+    system = request.args.get("system", "restaurants")
+    if system not in SYSTEMS:
+        return jsonify({"error": f"System '{system}' not found."}), 404
+
+    if "ids" in request.args:
+        ids = [i for i in request.args["ids"].split(",") if i][:MAX_PAGE_SIZE]
+        return jsonify({"items": items_by_id(system, ids), "next": None}), 200
+
+    limit = min(max(request.args.get("limit", PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+    feature_filters = _facet_args(request.args)[3]
+    try:
+        if feature_filters:
+            items, next_cursor = facet_page(system, feature_filters, request.args.get("after"), limit)
+        else:
+            items, next_cursor = item_page(system, None, request.args.get("after"), limit)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"items": [it.to_dict() for it in items], "next": next_cursor}), 200
+
+
+def _facet_args(args):
+    """(price, cuisines, meal, facet values) from the listing's query string."""
+    price_raw    = args.get("price", "")
+    cuisine_raw  = args.get("cuisine", "")
+    meal_raw     = args.get("meal_type", "")
+
+    cuisines = [cuisine_raw] if cuisine_raw else []
+    feature_filters = []
+    if price_raw:
+        feature_filters.append(f"priceLevel.{price_raw}")
+    if cuisines:
+        feature_filters += [f"cuisines.{c}" for c in cuisines]
+    if meal_raw:
+        feature_filters.append(f"mealTypes.{meal_raw}")
+    return price_raw, cuisines, meal_raw, feature_filters
+
+
 @item_bp.route("/item_detail")
 def item_detail():
     if "username" not in session:
@@ -128,17 +146,11 @@ def item_detail():
         return redirect(url_for("system.choose_system"))
 
     item_id = request.args.get("id")
-    mapping = SYSTEMS[system]["mapping"]
-    norm = normalize(load_data(system), mapping)
-    item = next((it for it in norm if it["id"] == str(item_id)), None)
+    item = get_item(system, item_id) if item_id else None
     if not item:
         flash("Item not found.", "danger")
         return redirect(url_for("item.index", system=system))
 
-    rec = get_ratings_collection().find_one({
-        "user_id": ObjectId(session["user_id"]),
-        "system": system,
-        "item_id": item_id
-    })
+    rating = get_rating(ObjectId(session["user_id"]), system, item_id)
 
-    return render_template("item_detail.html", item=item, system=system, current_rating=rec["rating"] if rec else 0)
+    return render_template("item_detail.html", item=item, system=system, current_rating=rating or 0)
@@ -1,14 +1,16 @@
-from datetime import datetime
 from bson import ObjectId
 from flask import (
     Blueprint, session, redirect, url_for, flash,
     request, render_template, jsonify
 )
 
-from core.math_utils import solve_profile, calc_delta
-from core.users import set_taste
-from core.data_utils import load_data, normalize
-from db.collections import SYSTEMS, get_ratings_collection
+from core.jobs import WAIT, submit_fit, wait_for
+from core.ratings import get_rating_map, write_ratings
+from core.solvers import training_set
+from core.users import get_taste
+from core.catalog import get_catalog
+from core.precompute import drop_stored
+from db.collections import SYSTEMS
 
 rating_bp = Blueprint("rating", __name__)
 
@@ -17,6 +19,24 @@ def add_batch_ratings():
     return jsonify({"message": "Batch ratings endpoint works"})
 
 
+# ─────────── Taste Refresh ───────────
+def refresh_taste(u_id, system):
+    # Most edits leave the stored taste vector optimal; it is only re-solved
+    # (warm-started from the old one) when the new ratings prove it is not.
+    drop_stored(u_id, system)
+    existing = get_rating_map(ObjectId(u_id), system)
+    rated_vecs, deltas, _ = training_set(get_catalog(system), existing)
+    if not rated_vecs:
+        return
+    # waits briefly, like recommend; a slower solve keeps running in the
+    # pool and stores the new taste when it is done
+    job = submit_fit(u_id, system, rated_vecs, deltas, get_taste(u_id, system))
+    if not wait_for(job, WAIT):
+        flash("Your profile is still being updated; the dashboard may show your previous taste.", "info")
+    elif job.status == "failed":
+        flash("Your ratings were saved, but updating your profile failed. Please try again.", "danger")
+
+
 # ─────────── Route: Update Multiple Ratings ───────────
 @rating_bp.route("/update_ratings", methods=["POST"])
 def update_ratings():
@@ -35,43 +55,14 @@ def update_ratings():
         return redirect(url_for("rec.dashboard", system=system))
 
     updated_ids = updated_ids_str.split(",")
-    ratings_col = get_ratings_collection()
-
-    for item_id in updated_ids:
-        val = request.form.get(f"rating_{item_id}")
-        if not val:
-            continue
-        try:
-            new_r = float(val)
-        except ValueError:
-            continue
-        ratings_col.update_one(
-            {"user_id": ObjectId(u_id), "system": system, "item_id": item_id},
-            {"$set": {"rating": new_r, "timestamp": datetime.utcnow()}},
-            upsert=True,
-        )
-
-    mapping = SYSTEMS[system]["mapping"]
-    norm = normalize(load_data(system), mapping)
-    existing = {
-        r["item_id"]: r["rating"]
-        for r in ratings_col.find({"user_id": ObjectId(u_id), "system": system})
-    }
-
-    vectors = [
-        it["featureVector"][:] + [existing.get(it["id"], 3.0)]
-        for it in norm
-    ]
-    n = len(norm[0]["featureVector"])
-    rated_vecs, deltas = [], []
-
-    for i, it in enumerate(norm):
-        if it["id"] in existing:
-            rated_vecs.append(vectors[i])
-            deltas.append(existing[it["id"]])
-
-    profile = solve_profile(rated_vecs, calc_delta(deltas, n))
-    set_taste(u_id, system, profile)
+
+    # one bulk write; blank or non-numeric fields are rejected and skipped
+    write_ratings(ObjectId(u_id), system, [
+        {"item_id": item_id, "value": request.form.get(f"rating_{item_id}")}
+        for item_id in updated_ids if request.form.get(f"rating_{item_id}")
+    ])
+
+    refresh_taste(u_id, system)
 
     flash("Ratings updated.", "success")
     return redirect(url_for("rec.dashboard", system=system))
@@ -96,34 +87,9 @@ def update_item_rating():
         return redirect(url_for("rec.dashboard", system=system))
 
     u_id = session["user_id"]
-    ratings_col = get_ratings_collection()
-    ratings_col.update_one(
-        {"user_id": ObjectId(u_id), "system": system, "item_id": item_id},
-        {"$set": {"rating": new_r, "timestamp": datetime.utcnow()}},
-        upsert=True,
-    )
-
-    mapping = SYSTEMS[system]["mapping"]
-    norm = normalize(load_data(system), mapping)
-    existing = {
-        r["item_id"]: r["rating"]
-        for r in ratings_col.find({"user_id": ObjectId(u_id), "system": system})
-    }
-
-    vectors = [
-        it["featureVector"][:] + [existing.get(it["id"], 3.0)]
-        for it in norm
-    ]
-    n = len(norm[0]["featureVector"])
-    rated_vecs, deltas = [], []
-
-    for i, it in enumerate(norm):
-        if it["id"] in existing:
-            rated_vecs.append(vectors[i])
-            deltas.append(existing[it["id"]])
+    write_ratings(ObjectId(u_id), system, [{"item_id": item_id, "value": new_r}])
 
-    profile = solve_profile(rated_vecs, calc_delta(deltas, n))
-    set_taste(u_id, system, profile)
+    refresh_taste(u_id, system)
 
     flash("Rating updated.", "success")
     return redirect(url_for("rec.dashboard", system=system))
@@ -140,37 +106,24 @@ def my_ratings():
         flash("Invalid system", "danger")
         return redirect(url_for("system.choose_system"))
 
-    mapping = SYSTEMS[system]["mapping"]
-    norm = normalize(load_data(system), mapping)
-    ratings_col = get_ratings_collection()
-    recs = list(ratings_col.find({"user_id": ObjectId(session["user_id"]), "system": system}))
-    ratings_map = {r["item_id"]: r["rating"] for r in recs}
-
-    rated_items = [
-        {
-            "id": it["id"],
-            "name": it["name"],
-            "image": it["image"],
-            "description": it["description"],
-            "rating": ratings_map[it["id"]],
-        }
-        for it in norm if it["id"] in ratings_map
-    ]
-
-    all_items = [
-        {
-            "id": it["id"],
-            "name": it["name"],
-            "image": it.get("image"),
-            "description": it.get("description", ""),
-        }
-        for it in norm
-    ]
+    catalog = get_catalog(system)
+    ratings_map = get_rating_map(ObjectId(session["user_id"]), system)
+
+    # only the rated rows; other items are fetched by the page as needed
+    rated_items = []
+    for row in sorted(catalog.rows(ratings_map)):
+        it = catalog.items[row]
+        rated_items.append({
+            "id": it.id,
+            "name": it.name,
+            "image": it.image,
+            "description": it.description,
+            "rating": ratings_map[it.id],
+        })
 
     return render_template(
         "my_ratings.html",
         rated_items=rated_items,
         system=system,
-        all_items=all_items
     )
 
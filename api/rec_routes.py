@@ -1,17 +1,53 @@
-from datetime import datetime
 from bson import ObjectId
 from flask import (
     Blueprint, session, redirect, url_for,
     request, flash, render_template
 )
 
-from core.math_utils import solve_profile, calc_delta, est_rating
-from core.users import get_taste, set_taste
-from core.data_utils import load_data, normalize
-from db.collections import SYSTEMS, get_ratings_collection, get_users_collection
+from core.math_utils import est_ratings, top_k
+from core.jobs import WAIT, submit_fit, wait_for
+from core.listing import item_page
+from core.lookup_cache import invalidate
+from core.precompute import drop_stored, stored_page
+from core.ratings import delete_all_ratings, get_rating_map, write_ratings
+from core.solvers import training_set
+from core.taste_profiles import delete_profile
+from core.users import get_taste
+from core.catalog import get_catalog
+from db.collections import SYSTEMS
 
 rec_bp = Blueprint("rec", __name__)
 
+PAGE_SIZE = 10
+
+
+def rank_catalog(catalog, profile, n, rated_ids=(), page=1, min_score=None):
+    """One page of (name, image, estimated rating, id) tuples, best first,
+    leaving out items the user already rated."""
+    scores = est_ratings(profile, catalog.matrix, n)
+    rows = top_k(
+        scores, PAGE_SIZE, offset=(page - 1) * PAGE_SIZE,
+        exclude=catalog.rows(rated_ids), min_score=min_score,
+    )
+    return [_card(catalog, r, scores[r]) for r in rows]
+
+
+def _card(catalog, row, score):
+    # items of a shared catalog are decoded on every access, so only once here
+    it = catalog.items[row]
+    return it.name, it.image, float(score), it.id
+
+
+def rate_items_page(system):
+    """The item listing, first page only (more are fetched from /items_page)."""
+    try:
+        items, next_cursor = item_page(system)
+    except Exception:
+        items, next_cursor = [], None
+    return render_template("index.html", restaurants=items, next_cursor=next_cursor,
+                           system=system, user_has_vector=False)
+
+
 @rec_bp.route("/recommendations", methods=["GET"])
 def get_recommendations():
     return {"message": "Recommendation endpoint works"}
@@ -28,12 +64,7 @@ def show_recommendations():
 
     if not get_taste(session["user_id"], system):
         flash("Rate some items first.", "warning")
-        mapping = SYSTEMS[system]["mapping"]
-        try:
-            norm = normalize(load_data(system), mapping)
-        except Exception:
-            norm = []
-        return render_template("index.html", restaurants=norm, system=system, user_has_vector=False)
+        return rate_items_page(system)
 
     return redirect(url_for("rec.dashboard", system=system))
 
@@ -48,35 +79,25 @@ def recommend():
         flash("Invalid system", "danger")
         return redirect(url_for("system.choose_system"))
 
-    mapping = SYSTEMS[system]["mapping"]
     try:
-        norm = normalize(load_data(system), mapping)
+        catalog = get_catalog(system)
     except Exception as e:
         flash(f"Dataset error: {e}", "danger")
         return render_template("index.html", restaurants=[], system=system, user_has_vector=False)
 
     u_id = session["user_id"]
-    ratings_collection = get_ratings_collection()
 
     if request.method == "POST":
         privacy_mode = request.form.get("privacy_mode") == "1"
         ids_str = request.form.get("selected_ids", "").strip()
         if ids_str:
             selected_ids = ids_str.split(",")
-            for sid in selected_ids:
-                rating_val = request.form.get(f"rating_{sid}")
-                if not rating_val:
-                    continue
-                try:
-                    r = float(rating_val)
-                except ValueError:
-                    continue
-                if not privacy_mode:
-                    ratings_collection.update_one(
-                        {"user_id": ObjectId(u_id), "system": system, "item_id": sid},
-                        {"$set": {"rating": r, "timestamp": datetime.utcnow()}},
-                        upsert=True,
-                    )
+            if not privacy_mode:
+                write_ratings(ObjectId(u_id), system, [
+                    {"item_id": sid, "value": request.form.get(f"rating_{sid}")}
+                    for sid in selected_ids if request.form.get(f"rating_{sid}")
+                ])
+                drop_stored(u_id, system)
 
     privacy_mode = request.form.get("privacy_mode") == "1" if request.method == "POST" else False
 
@@ -97,42 +118,37 @@ def recommend():
         else:
             existing = {}
     else:
-        existing = {
-            r["item_id"]: r["rating"]
-            for r in ratings_collection.find({"user_id": ObjectId(u_id), "system": system})
-        }
+        existing = get_rating_map(ObjectId(u_id), system)
 
     if len(existing) < 4:
         flash("Please rate at least 4 items to get recommendations.", "danger")
-        return render_template("index.html", restaurants=norm, system=system, user_has_vector=False)
-
-    vectors = []
-    for it in norm:
-        fv = it["featureVector"][:] + [existing.get(it["id"], 3.0)]
-        vectors.append(fv)
-
-    n = len(norm[0]["featureVector"])
-    rated_vecs, deltas = [], []
-    for it in norm:
-        if it["id"] in existing:
-            rated_vecs.append(vectors[norm.index(it)])
-            deltas.append(existing[it["id"]])
-
-    profile = solve_profile(rated_vecs, calc_delta(deltas, n))
-    set_taste(u_id, system, profile)
+        return rate_items_page(system)
+
+    rated_vecs, deltas, n = training_set(catalog, existing)
+    previous = get_taste(u_id, system)
+    job = submit_fit(u_id, system, rated_vecs, deltas, previous)
+    finished = wait_for(job, WAIT)
+    if finished and job.status == "done":
+        profile = job.profile
+    elif finished:
+        # the fit failed; nothing is running any more
+        if not previous:
+            flash("Your profile could not be computed. Please try again.", "danger")
+            return rate_items_page(system)
+        flash("Updating your profile failed; showing your previous recommendations.", "warning")
+        profile = previous
+    elif previous:
+        # the solve keeps running in the pool and stores the taste when done
+        flash("Your profile is still being updated; showing your previous recommendations.", "info")
+        profile = previous
+    else:
+        flash("Your profile is still being computed. Please check back in a moment.", "info")
+        return rate_items_page(system)
 
     # ───── COMPUTE RECOMMENDATIONS ─────
-    rated = []
-    for it in norm:
-        rated.append((
-            it["name"],
-            it["image"],
-            est_rating(profile, it["featureVector"], n),
-            it["id"],
-        ))
-    rated.sort(key=lambda x: x[2], reverse=True)
+    recommendations = rank_catalog(catalog, profile, n, rated_ids=existing)
 
-    return render_template("recommendations.html", recommendations=rated[:10], system=system)
+    return render_template("recommendations.html", recommendations=recommendations, system=system, page=1)
 
 
 # ───────────── Dashboard View ─────────────
@@ -146,22 +162,26 @@ def dashboard():
         flash("Invalid system", "danger")
         return redirect(url_for("system.choose_system"))
 
-    mapping = SYSTEMS[system]["mapping"]
-    norm = normalize(load_data(system), mapping)
+    catalog = get_catalog(system)
     profile = get_taste(session["user_id"], system)
 
     if not profile:
         flash("Rate some items first.", "warning")
         return redirect(url_for("index", system=system))
 
-    n = len(norm[0]["featureVector"])
-    rated = [
-        (it["name"], it["image"], est_rating(profile, it["featureVector"], n), it["id"])
-        for it in norm
-    ]
-    rated.sort(key=lambda x: x[2], reverse=True)
+    n = catalog.matrix.shape[1]
+    page = max(request.args.get("page", 1, type=int), 1)
+    min_score = request.args.get("min_score", type=float)
+    # a fresh precomputed list (python -m core.precompute) saves scoring the catalog
+    stored = stored_page(session["user_id"], system, catalog, profile,
+                         (page - 1) * PAGE_SIZE, PAGE_SIZE, min_score)
+    if stored is not None:
+        recommendations = [_card(catalog, r, score) for r, score in stored]
+    else:
+        rated_ids = get_rating_map(ObjectId(session["user_id"]), system)
+        recommendations = rank_catalog(catalog, profile, n, rated_ids, page, min_score)
 
-    return render_template("recommendations.html", recommendations=rated[:10], system=system)
+    return render_template("recommendations.html", recommendations=recommendations, system=system, page=page)
 
 
 @rec_bp.route("/reset_taste")
@@ -175,14 +195,11 @@ def reset_taste():
         return redirect(url_for("system.choose_system"))
 
     u_id = session["user_id"]
-    ratings_collection = get_ratings_collection()
-    users_collection = get_users_collection()
 
-    ratings_collection.delete_many({"user_id": ObjectId(u_id), "system": system})
-    users_collection.update_one(
-        {"_id": ObjectId(u_id)},
-        {"$unset": {f"taste_vector.{system}": ""}},
-    )
+    delete_all_ratings(ObjectId(u_id), system)
+    drop_stored(u_id, system)
+    delete_profile(u_id, system)
+    invalidate("taste", u_id)
 
     flash("Selections reset.", "info")
     return redirect(url_for("item.index", system=system, reset_local="1"))
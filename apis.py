@@ -1,15 +1,23 @@
 
-from core.users import create_user, get_user, update_user, delete_user
+from core.users import create_user, get_user, update_user, delete_user, get_tastes, user_object_id
 from core.systems import create_system, update_system, delete_system, list_systems,add_items_to_system,edit_item_in_system
-from core.ratings import get_ratings,get_ratings_by_items,delete_all_user_ratings,delete_all_ratings_in_system,add_rating, update_rating, delete_rating,add_ratings, delete_all_ratings
+from core.ratings import get_ratings,get_ratings_by_items,delete_all_user_ratings,delete_all_ratings_in_system,add_rating, update_rating, delete_rating,add_ratings, delete_all_ratings, write_ratings, get_rating, get_rating_map
 import logging
-import random
 from flask import Blueprint, request, jsonify
-from core.math_utils import calc_delta, solve_profile, est_rating
-from core.systems import get_system, get_features
+from core.solvers import SOLVERS, training_set
+from core.systems import get_system, get_features_many
+from core.catalog import catalog_stats
+from core.lookup_cache import lookup_stats
+from core.jobs import get_job, job_stats
+from core.evaluation import evaluate
+from core.data_utils import vector_error
+from db.collections import SYSTEMS
 
 api_routes = Blueprint("api", __name__)
 
+# Upper bound on random splits per train size for /evaluate_mae
+MAX_EVAL_TRIALS = 1000
+
 # <---CRUD FOR USER--->
 @api_routes.route("/create_user", methods=["POST"])
 def api_create_user():
@@ -28,8 +36,10 @@ def api_create_user():
 def api_get_user(user_id):
     user_id = str(user_id)
     user = get_user(user_id)
-    if user:
-        return jsonify(user), 200
+    oid = user_object_id(user_id) if user else None
+    if oid is not None:
+        # taste vectors live in taste_profiles now; keep them in the response
+        return jsonify({**user, "taste_vector": get_tastes(oid)}), 200
     else:
         return jsonify({"error": "User not found."}), 404
 
@@ -71,18 +81,17 @@ def api_batch_ratings():
         return jsonify({"error": f"User '{user_id}' not found."}), 404
     if not get_system(system):
         return jsonify({"error": f"System '{system}' not found."}), 404
+    if not isinstance(raw_ratings, list) or not raw_ratings:
+        return jsonify({"error": "'ratings' must be a non-empty list."}), 400
 
-    ratings = []
-    for r in raw_ratings:
-        try:
-            item_id = str(r["item_id"])
-            value = float(r["value"])
-            ratings.append({"item_id": item_id, "value": value})
-        except (KeyError, TypeError, ValueError):
-            return jsonify({"error": f"Invalid rating format: {r}"}), 400
-
-    add_ratings(user_id, system, ratings)
-    return jsonify({"message": "Ratings added."}), 201
+    # Bad entries are reported per item instead of failing the whole batch
+    report = write_ratings(user_id, system, [
+        {"item_id": r.get("item_id"), "value": r.get("value")} if isinstance(r, dict) else r
+        for r in raw_ratings
+    ])
+    if not report["inserted"] and not report["updated"]:
+        return jsonify({"error": "No valid ratings in batch.", **report}), 400
+    return jsonify({"message": "Ratings added.", **report}), 201
 
 
 
@@ -90,27 +99,8 @@ def api_batch_ratings():
 # Get all ratings for a user and system
 @api_routes.route("/get_ratings_of_user_in_system/<user_id>/<system>", methods=["GET"])
 def api_get_ratings(user_id, system):
-    from db.collections import get_ratings_collection
-    from flask import jsonify
-    import logging
-
     try:
-        user_id = str(user_id)
-        system = str(system)
-
-        # Debug logging
-        logging.info(f"Fetching ratings for user_id: {user_id}, system: {system}")
-
-        # Query ratings collection
-        cursor = get_ratings_collection().find({"user_id": user_id, "system": system})
-        ratings = []
-        for doc in cursor:
-            ratings.append({
-                "item_id": doc.get("item_id"),
-                "value": doc.get("value")
-            })
-
-        return jsonify(ratings), 200
+        return jsonify(get_ratings(str(user_id), str(system))), 200
 
     except Exception as e:
         logging.error(f"Error in /get_ratings_of_user_in_system: {e}")
@@ -206,7 +196,10 @@ def api_create_system():
     system_id = data.get("system_id")
     display = data.get("display")
     mapping = data.get("mapping")
-    create_system(system_id, display, mapping)
+    solver = data.get("solver")
+    if solver and solver not in SOLVERS:
+        return jsonify({"error": f"Unknown solver '{solver}'. Use one of: {', '.join(SOLVERS)}"}), 400
+    create_system(system_id, display, mapping, solver)
     return jsonify({"message": "System created."}), 201
 
 @api_routes.route("/get_system/<system_id>", methods=["GET"])
@@ -250,6 +243,10 @@ def api_add_items():
     data = request.json
     system_id = data.get("system_id")
     new_items = data.get("items", [])
+    mapping = SYSTEMS.get(str(system_id), {}).get("mapping", {})
+    error = vector_error(new_items, mapping)
+    if error:
+        return jsonify({"error": error}), 400
 
     success = add_items_to_system(system_id, new_items)
     if success:
@@ -262,6 +259,10 @@ def api_edit_item():
     system_id = data.get("system_id")
     item_id = data.get("item_id")
     updated_fields = data.get("updated_fields", {})
+    mapping = SYSTEMS.get(str(system_id), {}).get("mapping", {})
+    error = vector_error([updated_fields], mapping)
+    if error:
+        return jsonify({"error": error}), 400
 
     success = edit_item_in_system(system_id, item_id, updated_fields)
     if success:
@@ -281,9 +282,11 @@ def api_get_ratings_by_items():
 
 @api_routes.route("/estimated_ratings", methods=["POST"])
 def api_estimated_ratings():
-    from core.data_utils import load_data, normalize
-    from db.collections import SYSTEMS, get_ratings_collection, get_users_collection
-    from core.math_utils import solve_profile, calc_delta, est_rating
+    from core.catalog import get_catalog
+    from db.collections import SYSTEMS, get_users_collection
+    from core.math_utils import est_ratings
+    from core.jobs import WAIT, submit_fit, wait_for
+    from core.users import get_taste
     from bson import ObjectId
     import logging
 
@@ -308,55 +311,38 @@ def api_estimated_ratings():
             return jsonify({"error": f"User '{username}' not found"}), 404
         user_obj_id = user_doc["_id"]
 
-        # Load and normalize system data
-        mapping = SYSTEMS[system]["mapping"]
-        norm = normalize(load_data(system), mapping)
-
-        # Support both user_id formats and allow system=None
-        collection = get_ratings_collection()
-        query = {
-            "$or": [
-                {"user_id": username},
-                {"user_id": user_obj_id}
-            ]
-        }
-        # Only include "system" if it's present in the documents
-        try:
-            test_doc = collection.find_one()
-            if test_doc and "system" in test_doc:
-                query["system"] = system
-        except Exception:
-            pass
-
-        # Fetch user ratings
-        user_ratings = {
-            doc["item_id"]: doc.get("value") or doc.get("rating")
-            for doc in collection.find(query)
-            if doc.get("value") is not None or doc.get("rating") is not None
-        }
+        # Cached normalized system data
+        catalog = get_catalog(system)
 
-        print("User ratings found:", user_ratings)
+        # Fetch user ratings (one covered index query)
+        user_ratings = get_rating_map(user_obj_id, system)
 
         if len(user_ratings) < 4:
             return jsonify({"error": "At least 4 ratings are required to estimate."}), 400
 
-        # Build user profile
-        n = len(norm[0]["featureVector"])
-        rated_vecs, deltas = [], []
-        for item in norm:
-            if item["id"] in user_ratings:
-                vec = item["featureVector"][:] + [user_ratings[item["id"]]]
-                rated_vecs.append(vec)
-                deltas.append(user_ratings[item["id"]])
-
-        profile = solve_profile(rated_vecs, calc_delta(deltas, n))
+        # Build user profile (only the rated items are decoded)
+        rated_vecs, deltas, n = training_set(catalog, user_ratings)
+
+        # Solve in the worker pool; answer 202 with the job id if it is slow
+        job = submit_fit(user_obj_id, system, rated_vecs, deltas,
+                         get_taste(user_obj_id, system))
+        if not wait_for(job, WAIT):
+            return jsonify({
+                "job_id": job.id,
+                "status": job.status,
+                "poll": f"/api/profile_jobs/{job.id}",
+            }), 202
+        if job.status != "done":
+            return jsonify({"error": f"Profile fit failed: {job.error}"}), 500
+        profile = job.profile
 
         # Estimate ratings
-        result = {}
-        for item in norm:
-            if item["id"] in item_ids:
-                rating = est_rating(profile, item["featureVector"], n)
-                result[item["id"]] = round(rating, 2)
+        rows = sorted(set(catalog.rows(item_ids)))
+        scores = est_ratings(profile, catalog.matrix[rows], n)
+        result = {
+            catalog.ids[row]: round(score, 2)
+            for row, score in zip(rows, scores.tolist())
+        }
 
         return jsonify(result), 200
 
@@ -365,6 +351,19 @@ def api_estimated_ratings():
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
 
+@api_routes.route("/profile_jobs/<job_id>", methods=["GET"])
+def api_profile_job(job_id):
+    job = get_job(job_id)
+    if not job:
+        return jsonify({"error": "Job not found or expired"}), 404
+    return jsonify(job.to_dict()), 200
+
+
+@api_routes.route("/profile_jobs", methods=["GET"])
+def api_profile_job_stats():
+    return jsonify(job_stats()), 200
+
+
 @api_routes.route("/evaluate_mae", methods=["POST"])
 def api_evaluate_mae():
     data = request.get_json() or {}
@@ -372,65 +371,60 @@ def api_evaluate_mae():
     system   = data.get("system")
     item_ids = data.get("item_ids", [])
     ratings  = data.get("ratings", [])
+    trials   = data.get("trials", 10)
+    seed     = data.get("seed")
 
     # 1. Basic validations
     if not system:
         return jsonify({"error": "Missing 'system' field."}), 400
+    if data.get("user_id") and not item_ids:
+        # evaluate on the user's whole rating history in this system
+        history = get_ratings(str(data["user_id"]), system)
+        item_ids = [r["item_id"] for r in history]
+        ratings = [r["value"] for r in history]
+    if seed is not None and not isinstance(seed, int):
+        return jsonify({"error": "'seed' must be an integer."}), 400
     if not isinstance(item_ids, list) or not isinstance(ratings, list):
         return jsonify({"error": "'item_ids' and 'ratings' must be lists."}), 400
-    if len(item_ids) != 8 or len(ratings) != 8:
-        return jsonify({"error": "Exactly 8 items and 8 ratings are required."}), 400
+    if len(item_ids) != len(ratings) or len(item_ids) < 2:
+        return jsonify({"error": "'item_ids' and 'ratings' need the same length, at least 2."}), 400
+    try:
+        ratings = [float(r) for r in ratings]
+    except (TypeError, ValueError):
+        return jsonify({"error": "'ratings' must be numbers."}), 400
+
+    total = len(item_ids)
+    # by default train on 4..N-1 items, as the original 8-item protocol did
+    train_sizes = data.get("train_sizes") or list(range(min(4, total - 1), total))
+    if not isinstance(trials, int) or not 1 <= trials <= MAX_EVAL_TRIALS:
+        return jsonify({"error": f"'trials' must be an integer from 1 to {MAX_EVAL_TRIALS}."}), 400
+    if not isinstance(train_sizes, list) or not all(
+        isinstance(t, int) and 1 <= t < total for t in train_sizes
+    ):
+        return jsonify({"error": f"'train_sizes' must be integers from 1 to {total - 1}."}), 400
     if not get_system(system):
         return jsonify({"error": f"System '{system}' not found."}), 404
 
-    total_indices = list(range(8))
-    # Pre-fetch one feature vector length
+    # 2. One batched fetch of every feature vector
     try:
-        sample_vec = get_features(item_ids[0], system)
-        n_features = len(sample_vec)
+        features = get_features_many(item_ids, system)
     except Exception as e:
-        return jsonify({"error": f"Failed to fetch features for item {item_ids[0]}: {e}"}), 500
-
-    # 2. For each train_size, run 10 tests and record MAEs
-    avg_maes = {}
-    for train_size in range(4, 8):  # 4,5,6,7
-        maes = []
-        for _ in range(10):
-            # 2a. Random split
-            train_idx = random.sample(total_indices, train_size)
-            test_idx  = [i for i in total_indices if i not in train_idx]
-
-            # 2b. Build profile from training subset
-            train_vecs   = []
-            train_ratings = []
-            for i in train_idx:
-                vec = get_features(item_ids[i], system)
-                train_vecs.append(vec)
-                train_ratings.append(ratings[i])
-
-            deltas  = calc_delta(train_ratings, n_features)
-            profile = solve_profile(train_vecs, deltas)
-
-            # 2c. Estimate & compute MAE on test subset
-            errors = []
-            for i in test_idx:
-                feats = get_features(item_ids[i], system)
-                pred  = est_rating(profile, feats, n_features)
-                errors.append(abs(ratings[i] - pred))
-
-            # if for some reason no test items, skip (shouldn’t happen)
-            if errors:
-                maes.append(sum(errors) / len(errors))
-
-        # 2d. Average the 10 MAEs for this train_size
-        if maes:
-            avg_maes[str(train_size)] = round(sum(maes) / len(maes), 4)
-        else:
-            avg_maes[str(train_size)] = None
-
-    # 3. Return all four averages
+        return jsonify({"error": f"Failed to fetch features: {e}"}), 500
+    missing = [str(i) for i in item_ids if str(i) not in features]
+    if missing:
+        return jsonify({"error": f"No features for items: {', '.join(missing)}"}), 404
+    vectors = [features[str(i)] for i in item_ids]
+    n_features = len(vectors[0])
+    if any(len(v) != n_features for v in vectors):
+        return jsonify({"error": "Items have feature vectors of different lengths."}), 400
+
+    # 3. Fit every random split in parallel and summarize per train size
+    result = evaluate(system, vectors, ratings, train_sizes, trials, seed)
     return jsonify({
-        "average_mae_by_train_size": avg_maes
+        "average_mae_by_train_size": {
+            size: entry["mean"] for size, entry in result["by_train_size"].items()
+        },
+        **result,
     }), 200
 
 
@@ -442,8 +436,12 @@ def api_get_single_rating(user_id, system, item_id):
     if not get_system(system):
         return jsonify({"error": f"System '{system}' not found."}), 404
 
-    ratings = get_ratings(user_id, system)
-    for r in ratings:
-        if r["item_id"] == item_id:
-            return jsonify(r), 200
+    value = get_rating(user_id, system, item_id)
+    if value is not None:
+        return jsonify({"item_id": item_id, "value": value}), 200
     return jsonify({"error": f"No rating found for item '{item_id}' by user '{user_id}'."}), 404
+
+
+@api_routes.route("/catalog_stats", methods=["GET"])
+def api_catalog_stats():
+    return jsonify({**catalog_stats(), "lookups": lookup_stats()}), 200
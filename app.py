@@ -1,5 +1,4 @@
 from flask import Flask, redirect, url_for
-from flask_session import Session
 from dotenv import load_dotenv
 from apis import api_routes
 from click_logger import click_api
@@ -15,7 +14,6 @@ load_dotenv()
 # ──────────────── App Setup ────────────────
 app = Flask(__name__)
 configure_app(app)
-Session(app)
 print("Session backend:", app.session_interface)
 
 # ─────── DB + Collection Setup ───────
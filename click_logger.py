@@ -1,14 +1,145 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
 
 from flask import Blueprint, request, jsonify
 from db.collections import get_click_logs_collection
 
 click_api = Blueprint("click_api", __name__)
 
+# ──────────────── Buffer Settings ────────────────
+# Clicks held in memory before the overflow policy kicks in
+QUEUE_MAX = int(os.getenv("CLICK_QUEUE_MAX", "10000"))
+# Flush when this many clicks are waiting, or every FLUSH_INTERVAL seconds
+BATCH_SIZE = int(os.getenv("CLICK_BATCH_SIZE", "500"))
+FLUSH_INTERVAL = float(os.getenv("CLICK_FLUSH_INTERVAL", "1.0"))
+# "drop": reject clicks while the buffer is full; "block": wait up to
+# BLOCK_TIMEOUT seconds for room first (backpressure on the request)
+OVERFLOW = os.getenv("CLICK_OVERFLOW", "drop")
+BLOCK_TIMEOUT = float(os.getenv("CLICK_BLOCK_TIMEOUT", "0.05"))
+
+_queue = queue.Queue(maxsize=QUEUE_MAX)
+_stats = {"accepted": 0, "flushed": 0, "dropped": 0, "failed": 0, "batches": 0}
+_stats_lock = threading.Lock()
+_flush_lock = threading.Lock()
+_stop = threading.Event()
+_flusher = None
+_flusher_pid = None
+
+
+def _count(key, n=1):
+    with _stats_lock:
+        _stats[key] += n
+
+
+# ──────────────── Producer Side ────────────────
+
+def enqueue_click(data):
+    """Buffer one click document. Returns False if it was dropped."""
+    _ensure_flusher()
+    try:
+        if OVERFLOW == "block":
+            _queue.put(data, timeout=BLOCK_TIMEOUT)
+        else:
+            _queue.put_nowait(data)
+    except queue.Full:
+        _count("dropped")
+        return False
+    _count("accepted")
+    return True
+
+
+def click_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["queued"] = _queue.qsize()
+    stats["capacity"] = QUEUE_MAX
+    return stats
+
+
+# ──────────────── Background Flush ────────────────
+
+def _ensure_flusher():
+    # Started lazily and per process, so gunicorn workers forked after import
+    # each get their own thread
+    global _flusher, _flusher_pid
+    if _flusher is not None and _flusher_pid == os.getpid() and _flusher.is_alive():
+        return
+    with _flush_lock:
+        if _flusher is None or _flusher_pid != os.getpid() or not _flusher.is_alive():
+            _flusher = threading.Thread(target=_flush_loop, name="click-flusher", daemon=True)
+            _flusher_pid = os.getpid()
+            _flusher.start()
+
+
+def _flush_loop():
+    while not _stop.is_set():
+        batch = _take_batch(FLUSH_INTERVAL)
+        if batch:
+            _write(batch)
+
+
+def _take_batch(wait):
+    # Collect up to BATCH_SIZE clicks, waiting at most `wait` seconds overall
+    batch = []
+    deadline = time.monotonic() + wait
+    while len(batch) < BATCH_SIZE:
+        remaining = deadline - time.monotonic()
+        try:
+            batch.append(_queue.get(timeout=remaining) if remaining > 0 else _queue.get_nowait())
+        except queue.Empty:
+            break
+    return batch
+
+
+def _write(batch):
+    try:
+        get_click_logs_collection().insert_many(batch, ordered=False)
+        _count("flushed", len(batch))
+        _count("batches")
+    except Exception as e:
+        _count("failed", len(batch))
+        logging.error(f"[click_logger] Failed to write {len(batch)} clicks: {e}")
+
+
+def flush_clicks():
+    """Write everything still buffered; used on shutdown."""
+    while True:
+        batch = _take_batch(0)
+        if not batch:
+            return
+        _write(batch)
+
+
+@atexit.register
+def _shutdown():
+    _stop.set()
+    if _flusher is not None and _flusher_pid == os.getpid():
+        _flusher.join(timeout=FLUSH_INTERVAL + 5)
+    flush_clicks()
+
+
+# ──────────────── Routes ────────────────
+
 @click_api.route("/log_click", methods=["POST"])
 def log_click():
-    data = request.get_json()
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Expected a JSON object"}), 400
     data["ip"] = request.remote_addr
     data["ua"] = request.headers.get("User-Agent")
-    get_click_logs_collection().insert_one(data)
+    # stored later in a batch, so keep the time the click arrived
+    data["received_at"] = datetime.utcnow()
+
+    if not enqueue_click(data):
+        return jsonify({"status": "dropped"}), 503
+    return jsonify({"status": "queued"}), 202
+
 
-    return jsonify({"status": "logged"}), 200
+@click_api.route("/click_stats", methods=["GET"])
+def get_click_stats():
+    return jsonify(click_stats()), 200
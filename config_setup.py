@@ -1,10 +1,33 @@
 import os
 
+from flask_session import Session
+
+from session_store import HybridSessionInterface
+
+
 def configure_app(app):
     app.config.update(
-        SESSION_TYPE="filesystem",
-        SESSION_FILE_DIR="./.flask_session",
-        SESSION_FILE_THRESHOLD=100 * 1024 * 1024,
         SESSION_PERMANENT=False,
         SECRET_KEY=os.environ.get("SECRET_KEY", "dev_secret")
     )
+
+    # "hybrid": signed cookie, spilling to a local SQLite file for large
+    # sessions; "filesystem" / "redis": Flask-Session (redis needs the redis
+    # package and SESSION_REDIS_URL)
+    backend = os.environ.get("SESSION_BACKEND", "hybrid")
+    if backend == "hybrid":
+        app.session_interface = HybridSessionInterface()
+    elif backend == "redis":
+        import redis
+        app.config.update(
+            SESSION_TYPE="redis",
+            SESSION_REDIS=redis.from_url(os.getenv("SESSION_REDIS_URL", "redis://localhost:6379/0")),
+        )
+        Session(app)
+    else:
+        app.config.update(
+            SESSION_TYPE="filesystem",
+            SESSION_FILE_DIR="./.flask_session",
+            SESSION_FILE_THRESHOLD=100 * 1024 * 1024,
+        )
+        Session(app)
@@ -0,0 +1,282 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import Counter
+
+import numpy as np
+
+from core import catalog_store
+from core.data_utils import field_projection, load_data, normalize
+from core.feature_store import load_store, remove_store, stored_filter
+from db.collections import SYSTEMS, get_items_collection
+
+# Seconds a cached catalog may be served before it is reloaded. Invalidation
+# is per process, so this bounds how stale other gunicorn workers can get.
+MAX_AGE = float(os.getenv("CATALOG_MAX_AGE", "300"))
+# Catalogs are published here once per host and mapped read-only by every
+# worker (see core.catalog_store). Opt-in, e.g. /dev/shm/recsys_catalogs for
+# gunicorn; empty keeps one copy per process
+SHARED_DIR = os.getenv("CATALOG_SHARED_DIR", "")
+
+_catalogs = {}
+_generations = {}
+_load_locks = {}
+_rejected = {}      # system -> documents left out of its last load
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "reloads": 0, "invalidations": 0}
+
+
+class Catalog:
+    """Normalized items of one system, loaded once and shared by requests.
+
+    `items` are Item records. `matrix` holds every item's feature vector as
+    one contiguous uint8 row, in the same order as `items`/`ids`; `index`
+    maps an item id to its row. Catalogs loaded through the feature store
+    have no `features` in their items; the matrix is the one source of
+    vectors.
+    `version` fingerprints the ids and features, e.g. to tell whether
+    precomputed recommendations still match the catalog.
+
+    A catalog attached from a shared segment (`segment` is set) has the same
+    interface, but its items, ids and index are read-only views over mapped
+    files and items are decoded on access.
+    """
+
+    __slots__ = ("system", "items", "ids", "index", "matrix", "version", "loaded_at", "segment")
+
+    def __init__(self, system, items, matrix=None):
+        self.system = system
+        self.items = items
+        self.ids = [it.id for it in items]
+        self.index = {item_id: row for row, item_id in enumerate(self.ids)}
+        self.matrix = feature_matrix(items) if matrix is None else matrix
+        self.version = catalog_version(self.ids, self.matrix)
+        self.loaded_at = time.monotonic()
+        self.segment = None
+
+    @classmethod
+    def attach(cls, system, segment):
+        meta, ids, index, matrix, items = catalog_store.attach(SHARED_DIR, segment)
+        catalog = cls.__new__(cls)
+        catalog.system = system
+        catalog.items, catalog.ids, catalog.index, catalog.matrix = items, ids, index, matrix
+        catalog.version = meta["version"]
+        # age counts from publication, so all workers reload the same segment
+        catalog.loaded_at = time.monotonic() - (time.time() - meta["published_at"])
+        catalog.segment = segment
+        return catalog
+
+    def rows(self, item_ids):
+        """Row numbers of the given ids, skipping ids not in the catalog."""
+        return [self.index[i] for i in item_ids if i in self.index]
+
+    def __len__(self):
+        return len(self.items)
+
+
+# ───────────── Cache Access ─────────────
+
+def get_catalog(system):
+    """Return the cached catalog of `system`, loading it on first use.
+
+    Items are shared between requests and must be treated as read-only.
+    """
+    system = str(system)
+    entry = _catalogs.get(system)
+    if entry is not None and _is_fresh(entry):
+        _count("hits")
+        return entry
+
+    with _lock:
+        load_lock = _load_locks.setdefault(system, threading.Lock())
+
+    # One loader per system; concurrent requests wait and reuse its result.
+    with load_lock:
+        current = _catalogs.get(system)
+        if current is not None and current is not entry:
+            _count("hits")
+            return current
+
+        _count("misses")
+        if entry is not None or _generations.get(system):
+            _count("reloads")
+
+        generation = _generations.get(system, 0)
+        catalog = _load_shared(system) if SHARED_DIR else _build(system)
+        with _lock:
+            # Only publish if nothing invalidated the system while we loaded.
+            if _generations.get(system, 0) == generation:
+                _catalogs[system] = catalog
+        return catalog
+
+
+def cached_catalog(system):
+    """The cached catalog of `system` if it is loaded and fresh, else None.
+    Never touches the database."""
+    entry = _catalogs.get(str(system))
+    if entry is not None and _is_fresh(entry):
+        return entry
+    return None
+
+
+def _is_fresh(entry):
+    if time.monotonic() - entry.loaded_at >= MAX_AGE:
+        return False
+    # another worker may have republished or invalidated the shared segment
+    return entry.segment is None or catalog_store.current(SHARED_DIR, entry.system) == entry.segment
+
+
+def _load_shared(system):
+    # One process per host loads from Mongo and publishes; the others wait on
+    # the lock and attach to its segment
+    for _ in range(3):
+        segment = catalog_store.current(SHARED_DIR, system)
+        if segment is None or not _segment_fresh(segment):
+            with catalog_store.locked(SHARED_DIR, system):
+                segment = catalog_store.current(SHARED_DIR, system)
+                if segment is None or not _segment_fresh(segment):
+                    catalog = _build(system)
+                    segment = os.path.basename(catalog_store.publish(
+                        SHARED_DIR, system, catalog.ids, catalog.matrix, catalog.items, catalog.version
+                    ))
+        try:
+            return Catalog.attach(system, segment)
+        except FileNotFoundError:
+            continue  # replaced between readlink and open; look again
+    raise RuntimeError(f"Could not attach the shared catalog of '{system}'")
+
+
+def _build(system):
+    store = load_store(system)
+    if store is not None:
+        # vectors from the packed store; Mongo only sends the display fields,
+        # and only of the items the store holds (the detail path rejects
+        # the others for their vector)
+        docs = load_data(system, fields="listing", query=stored_filter(system))
+        items = _normalize(system, docs, "listing")
+        rows = store.index.lookup([it.id for it in items])
+        if (rows >= 0).all():
+            return Catalog(system, items, store.matrix(rows))
+        # items added behind the store's back; it is out of date
+        logging.error(f"[catalog] Feature store of '{system}' is missing items; reading vectors from Mongo")
+        remove_store(system)  # rebuilt on the next load
+    return Catalog(system, _normalize(system, load_data(system, fields="detail"), "detail"))
+
+
+def _normalize(system, docs, fields):
+    # malformed documents are left out of the catalog rather than failing it
+    rejected = []
+    items = normalize(docs, SYSTEMS[system]["mapping"], fields, rejected)
+    if rejected:
+        logging.error(f"[catalog] {len(rejected)} documents of '{system}' have missing or malformed mapped fields, "
+                      f"e.g. one with fields {sorted(map(str, rejected[0] or ()))[:10]}")
+    items, odd = _common_width(items)
+    if odd:
+        logging.error(f"[catalog] {len(odd)} items of '{system}' have a feature vector of another width, "
+                      f"e.g. item {odd[0].id} with {len(odd[0].features)} features")
+    with _lock:
+        _rejected[system] = len(rejected) + len(odd)
+    return items
+
+
+def _common_width(items):
+    """(items whose vector has the most common width, the other items).
+    Items without a vector are kept."""
+    widths = Counter(len(it.features) for it in items if it.features is not None)
+    if len(widths) < 2:
+        return items, []
+    width = widths.most_common(1)[0][0]
+    keep, odd = [], []
+    for it in items:
+        (keep if it.features is None or len(it.features) == width else odd).append(it)
+    return keep, odd
+
+
+def _segment_fresh(segment):
+    try:
+        return time.time() - catalog_store.read_meta(SHARED_DIR, segment)["published_at"] < MAX_AGE
+    except FileNotFoundError:
+        return False
+
+
+def get_item(system, item_id):
+    """One normalized item by its mapped id, or None.
+
+    Served from the cached catalog when there is one; otherwise a single
+    find_one on the mapped id field, which has an index (ensure_item_index).
+    Items loaded from the catalog are shared and must not be modified.
+    """
+    system, item_id = str(system), str(item_id)
+    catalog = cached_catalog(system)
+    if catalog is not None:
+        _count("hits")
+        row = catalog.index.get(item_id)
+        return catalog.items[row] if row is not None else None
+
+    mapping = SYSTEMS[system]["mapping"]
+    # normalize() stringifies ids, so numeric ids in Mongo must match too
+    candidates = [item_id]
+    try:
+        number = int(item_id)
+        if str(number) == item_id:
+            candidates.append(number)
+    except ValueError:
+        pass
+    doc = get_items_collection(system).find_one(
+        {mapping["id"]: {"$in": candidates}}, field_projection(mapping, "detail")
+    )
+    items = normalize([doc], mapping) if doc is not None else []
+    return items[0] if items else None
+
+
+def invalidate_catalog(system):
+    system = str(system)
+    with _lock:
+        _generations[system] = _generations.get(system, 0) + 1
+        _catalogs.pop(system, None)
+        _stats["invalidations"] += 1
+    if SHARED_DIR:
+        # waits for a load in progress, then makes every worker reload
+        with catalog_store.locked(SHARED_DIR, system):
+            catalog_store.unpublish(SHARED_DIR, system)
+
+
+def catalog_generation(system):
+    """How often this process invalidated `system`; changes on every edit."""
+    return _generations.get(str(system), 0)
+
+
+def feature_matrix(items):
+    if not items:
+        return np.zeros((0, 0), dtype=np.uint8)
+    width = len(items[0].features)
+    for it in items:
+        if len(it.features) != width:
+            raise ValueError(f"Item {it.id} has {len(it.features)} features, expected {width}")
+    # the vectors are already uint8 rows; joining them is the whole matrix
+    rows = bytearray().join(it.features for it in items)
+    return np.frombuffer(rows, dtype=np.uint8).reshape(len(items), width)
+
+
+def catalog_version(ids, matrix):
+    # Content fingerprint: equal in every process that loaded the same data
+    digest = hashlib.sha1("\0".join(ids).encode())
+    digest.update(str(matrix.shape).encode())
+    digest.update(np.ascontiguousarray(matrix).tobytes())
+    return digest.hexdigest()
+
+
+def catalog_stats():
+    with _lock:
+        stats = dict(_stats)
+        stats["cached"] = {name: len(c) for name, c in _catalogs.items()}
+        stats["shared"] = {name: c.segment for name, c in _catalogs.items() if c.segment}
+        stats["rejected"] = {name: n for name, n in _rejected.items() if n}
+    return stats
+
+
+def _count(key):
+    with _lock:
+        _stats[key] += 1
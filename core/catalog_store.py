@@ -0,0 +1,218 @@
+"""Catalog segments shared by all worker processes on a host.
+
+A segment is a directory of flat files holding one normalized catalog:
+
+    matrix.npy    uint8 feature matrix
+    items.bin     the Items, msgspec-encoded back to back
+    offsets.npy   start of every item in items.bin, plus the end
+    ids.npy       item ids as fixed-width bytes, in row order
+    sorted.npy    the same ids sorted, for binary search
+    order.npy     row of every sorted id
+    meta.json     system, version, count, published_at
+
+Workers map the files read-only, so every process shares the same pages
+instead of holding its own copy. `<system>.current` is a symlink to the live
+segment; publishing writes a new directory and swaps the link with an atomic
+rename, and processes that still map the old segment keep it until they
+re-attach.
+"""
+import fcntl
+import os
+import shutil
+import time
+import uuid
+from collections.abc import Sequence
+from contextlib import contextmanager
+from urllib.parse import quote
+
+import msgspec
+import numpy as np
+
+from core.data_utils import Item
+
+_encoder = msgspec.json.Encoder(enc_hook=str)
+_decoder = msgspec.json.Decoder()
+_item_decoder = msgspec.json.Decoder(Item)
+
+
+class SharedItems(Sequence):
+    """Read-only list of items decoded from a segment on access.
+
+    Every access returns a new Item, so callers can't change what other
+    workers see. Templates that serialize the whole list need list(...).
+    """
+
+    def __init__(self, blob, offsets):
+        self._blob = blob
+        self._offsets = offsets
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, row):
+        if isinstance(row, slice):
+            return [self[r] for r in range(*row.indices(len(self)))]
+        if row < 0:
+            row += len(self)
+        if not 0 <= row < len(self):
+            raise IndexError("item row out of range")
+        start, end = self._offsets[row], self._offsets[row + 1]
+        return _item_decoder.decode(self._blob[start:end])
+
+    def __iter__(self):
+        for row in range(len(self)):
+            yield self[row]
+
+
+class SharedIds(Sequence):
+    def __init__(self, ids):
+        self._ids = ids
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __getitem__(self, row):
+        if isinstance(row, slice):
+            return [self[r] for r in range(*row.indices(len(self)))]
+        return self._ids[row].decode()
+
+
+class SharedIndex:
+    """Item id -> row lookup by binary search over the sorted ids."""
+
+    def __init__(self, sorted_ids, order):
+        self._sorted = sorted_ids
+        self._order = order
+
+    def get(self, item_id, default=None):
+        key = str(item_id).encode()
+        if not len(self._sorted) or len(key) > self._sorted.dtype.itemsize:
+            return default
+        pos = int(np.searchsorted(self._sorted, key))
+        if pos < len(self._sorted) and self._sorted[pos] == key:
+            return int(self._order[pos])
+        return default
+
+    def lookup(self, item_ids):
+        """Rows of many ids at once, -1 where an id is unknown."""
+        keys = np.array([str(i).encode() for i in item_ids], dtype=bytes)
+        if not len(keys) or not len(self._sorted):
+            return np.full(len(keys), -1, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(self._sorted, keys), len(self._sorted) - 1)
+        return np.where(self._sorted[pos] == keys, self._order[pos], -1)
+
+    def __getitem__(self, item_id):
+        row = self.get(item_id)
+        if row is None:
+            raise KeyError(item_id)
+        return row
+
+    def __contains__(self, item_id):
+        return self.get(item_id) is not None
+
+    def __len__(self):
+        return len(self._sorted)
+
+
+# ───────────── Publishing ─────────────
+
+def publish(root, system, ids, matrix, items, version):
+    """Write a new segment for `system` under `root` and make it current.
+    Returns the segment path."""
+    os.makedirs(root, exist_ok=True)
+    name = slug(system)
+    path = os.path.join(root, f"{name}.{uuid.uuid4().hex}")
+    os.mkdir(path)
+    try:
+        np.save(os.path.join(path, "matrix.npy"), np.ascontiguousarray(matrix))
+        offsets = [0]
+        with open(os.path.join(path, "items.bin"), "wb") as out:
+            for item in items:
+                raw = _encoder.encode(item)
+                out.write(raw)
+                offsets.append(offsets[-1] + len(raw))
+        np.save(os.path.join(path, "offsets.npy"), np.array(offsets, dtype=np.int64))
+        encoded = np.array([i.encode() for i in ids], dtype=bytes) if ids else np.array([], dtype="S1")
+        np.save(os.path.join(path, "ids.npy"), encoded)
+        order = np.argsort(encoded, kind="stable")
+        np.save(os.path.join(path, "sorted.npy"), encoded[order])
+        np.save(os.path.join(path, "order.npy"), order.astype(np.int64))
+        meta = {"system": system, "version": version, "count": len(ids), "published_at": time.time()}
+        with open(os.path.join(path, "meta.json"), "wb") as out:
+            out.write(_encoder.encode(meta))
+
+        link = os.path.join(root, f"{name}.current")
+        tmp = f"{link}.{uuid.uuid4().hex}"
+        os.symlink(os.path.basename(path), tmp)
+        os.replace(tmp, link)
+    except Exception:
+        shutil.rmtree(path, ignore_errors=True)
+        raise
+    _remove_old(root, name, keep=os.path.basename(path))
+    return path
+
+
+def unpublish(root, system):
+    """Drop the current segment so every worker reloads the catalog."""
+    name = slug(system)
+    try:
+        os.unlink(os.path.join(root, f"{name}.current"))
+    except FileNotFoundError:
+        pass
+    _remove_old(root, name, keep=None)
+
+
+def _remove_old(root, name, keep):
+    # Mapped files stay readable after unlink, so workers still using an old
+    # segment are unaffected
+    for entry in os.listdir(root):
+        if entry.startswith(f"{name}.") and entry != keep and not entry.endswith((".current", ".lock")):
+            shutil.rmtree(os.path.join(root, entry), ignore_errors=True)
+
+
+# ───────────── Attaching ─────────────
+
+def current(root, system):
+    """Name of the live segment of `system`, or None."""
+    try:
+        return os.readlink(os.path.join(root, f"{slug(system)}.current"))
+    except OSError:
+        return None
+
+
+def read_meta(root, segment):
+    with open(os.path.join(root, segment, "meta.json"), "rb") as f:
+        return _decoder.decode(f.read())
+
+
+def attach(root, segment):
+    """Map a segment read-only: (meta, ids, index, matrix, items)."""
+    path = os.path.join(root, segment)
+    meta = read_meta(root, segment)
+    matrix = np.load(os.path.join(path, "matrix.npy"), mmap_mode="r")
+    offsets = np.load(os.path.join(path, "offsets.npy"), mmap_mode="r")
+    ids = np.load(os.path.join(path, "ids.npy"), mmap_mode="r")
+    sorted_ids = np.load(os.path.join(path, "sorted.npy"), mmap_mode="r")
+    order = np.load(os.path.join(path, "order.npy"), mmap_mode="r")
+    if offsets[-1]:
+        blob = np.memmap(os.path.join(path, "items.bin"), dtype=np.uint8, mode="r")
+    else:
+        blob = np.zeros(0, dtype=np.uint8)  # empty files can't be mapped
+    return meta, SharedIds(ids), SharedIndex(sorted_ids, order), matrix, SharedItems(blob, offsets)
+
+
+@contextmanager
+def locked(root, system):
+    """Exclusive lock over loading and publishing `system`, across processes."""
+    os.makedirs(root, exist_ok=True)
+    with open(os.path.join(root, f"{slug(system)}.lock"), "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def slug(system):
+    # "." separates the system from the segment suffix, so it is quoted too
+    return quote(str(system), safe="").replace(".", "%2E")
@@ -1,26 +1,199 @@
+import logging
+import threading
+from typing import Any
+
+import msgspec
+import numpy as np
+
+from db.collections import SYSTEMS
 from db.connection import get_db
 
-def load_data(system):
-    items = list(get_db()[system].find())
+# Mapped fields (keys of a system mapping) each kind of reader needs. Mongo
+# only sends these, so wide documents cost no more than narrow ones.
+PRESETS = {
+    # profile solving and scoring
+    "scoring": ("id", "featureVector"),
+    # item cards and lists
+    "listing": ("id", "name", "description", "image", "latitude", "longitude"),
+    # everything normalize() knows
+    "detail": ("id", "name", "description", "image", "featureVector", "latitude", "longitude"),
+}
+
+
+class Item(msgspec.Struct, array_like=True, gc=False, omit_defaults=True):
+    """One normalized item.
+
+    Fields the preset didn't ask for are None. `features` is the feature
+    vector as bytes, one per feature (the item's row of the catalog matrix).
+    Display fields keep whatever type the document has. Items only hold
+    plain values, so the cyclic GC doesn't track them, and they encode as
+    arrays in shared catalog segments.
+    """
+    id: str
+    name: Any = None
+    description: Any = None
+    image: Any = None
+    features: bytes | None = None
+    latitude: Any = None
+    longitude: Any = None
+    distance: float | None = None
+
+    def to_dict(self):
+        """The fields that are set, except the vector; for JSON responses."""
+        return {
+            field: value for field in DISPLAY_FIELDS
+            if (value := getattr(self, field)) is not None
+        }
+
+
+DISPLAY_FIELDS = ("id", "name", "description", "image", "latitude", "longitude", "distance")
+
+
+def vector_bytes(vector):
+    """A feature vector (list of whole numbers in 0-255) as bytes.
+
+    Raises TypeError or ValueError for anything else, including values a
+    uint8 would silently wrap or truncate (-1, 0.5, 300.0).
+    """
+    if not isinstance(vector, list):
+        raise TypeError(f"feature vector must be a list, not {type(vector).__name__}")
+    try:
+        return bytes(vector)
+    except TypeError:
+        pass  # float-valued features
+    values = np.asarray(vector)
+    if values.ndim != 1 or values.dtype.kind not in "biuf":
+        raise TypeError("feature vector must be a flat list of numbers")
+    if not ((values >= 0) & (values <= 255) & (values == np.floor(values))).all():
+        raise ValueError("feature values must be whole numbers in 0-255")
+    return values.astype(np.uint8).tobytes()
+
+
+def vector_error(docs, mapping):
+    """Why the feature vectors of `docs` can't be loaded, naming the first
+    bad one, or None. Checked when items are uploaded or added, since the
+    catalog leaves such items out."""
+    id_field, vec_field = mapping.get("id"), mapping.get("featureVector")
+    for doc in docs:
+        if vec_field not in doc:
+            continue
+        try:
+            vector_bytes(doc[vec_field])
+        except (TypeError, ValueError) as e:
+            return f"Item {doc.get(id_field)!r}: {e}"
+    return None
+
+
+def field_set(fields):
+    """The mapped field names of a preset name or an iterable of names."""
+    if fields is None:
+        return PRESETS["detail"]
+    if isinstance(fields, str):
+        return PRESETS[fields]
+    return tuple(fields)
+
+
+def field_projection(mapping, fields):
+    """Mongo projection of the document fields behind `fields`."""
+    wanted = field_set(fields)
+    return {"_id": 0, **{mapping[f]: 1 for f in wanted if f in mapping}}
+
+
+def load_data(system, projection=None, fields=None, query=None):
+    # fields (a preset or mapped names) takes precedence over a raw projection
+    if fields is not None:
+        projection = field_projection(SYSTEMS[system]["mapping"], fields)
+    items = list(get_db()[system].find(query or {}, projection))
     print(f"Loaded {len(items)} items from '{system}'")
     return items
 
-def normalize(data, mapping):
-    out = []
-    for it in data:
-        if mapping["id"] not in it or mapping["featureVector"] not in it:
-            raise Exception("Dataset missing mapped fields")
-        item = {
-            "id":           str(it[mapping["id"]]),
-            "name":         it.get(mapping["name"], "Unknown"),
-            "description":  it.get(mapping["description"], ""),
-            "image":        it.get(mapping["image"], ""),
-            "featureVector": it[mapping["featureVector"]],
-        }
-        if "latitude" in mapping and mapping["latitude"] in it:
-            item["latitude"] = it[mapping["latitude"]]
-        if "longitude" in mapping and mapping["longitude"] in it:
-            item["longitude"] = it[mapping["longitude"]]
-        out.append(item)
+def normalize(data, mapping, fields=None, rejected=None):
+    """Normalized items (Item) of raw documents.
+
+    fields: a preset or mapped names; the other fields of the items are None.
+    Documents without the mapped id, or with a missing or malformed vector
+    when it is wanted, are left out and appended to `rejected` if a list is
+    given.
+    """
+    bad = [] if rejected is None else rejected
+    before = len(bad)
+    out = compiled(mapping, fields)(data, bad)
+    if len(bad) > before:
+        logging.warning(f"[normalize] Skipped {len(bad) - before} documents with missing or malformed mapped fields")
     return out
 
+
+# ───────────── Compiled normalizers ─────────────
+# normalize() for one mapping and field set is generated as a plain loop
+# with the field names bound as constants, so nothing about the mapping is
+# looked up per document. Compiled once per distinct mapping; a changed
+# mapping (update_system) simply compiles a new one, and past MAX_COMPILED
+# the oldest normalizer is dropped.
+
+MAX_COMPILED = 64
+
+_compiled = {}      # (mapping items, fields) -> normalizer, oldest first
+_compile_lock = threading.Lock()
+
+# Defaults of the display fields a document may lack. The id and the vector
+# are required (no entry here); coordinates are left None when missing.
+_SPEC = {
+    "name": "Unknown",
+    "description": "",
+    "image": "",
+}
+
+
+def compiled(mapping, fields=None):
+    wanted = field_set(fields)
+    key = (tuple(sorted(mapping.items())), wanted)
+    fn = _compiled.get(key)
+    if fn is None:
+        with _compile_lock:
+            fn = _compiled.get(key)
+            if fn is None:
+                while len(_compiled) >= MAX_COMPILED:
+                    _compiled.pop(next(iter(_compiled)))
+                fn = _compiled[key] = _compile(mapping, wanted)
+    return fn
+
+
+def _compile(mapping, wanted):
+    consts = {"Item": Item, "vector_bytes": vector_bytes, "F_id": mapping["id"]}
+    # Item arguments in field order; trailing defaults are left off
+    args = ["str(it[F_id])"]
+    for field in PRESETS["detail"][1:]:
+        if field not in wanted:
+            args.append("None")
+        elif field in _SPEC:
+            consts[f"F_{field}"] = mapping[field]
+            consts[f"D_{field}"] = _SPEC[field]
+            args.append(f"it.get(F_{field}, D_{field})")
+        elif field == "featureVector":
+            consts["F_featureVector"] = mapping["featureVector"]
+            args.append("vector_bytes(it[F_featureVector])")
+        elif field in mapping:
+            # coordinates stay None when the document has none
+            consts[f"F_{field}"] = mapping[field]
+            args.append(f"it.get(F_{field})")
+        else:
+            args.append("None")
+    while args[-1] == "None":
+        args.pop()
+
+    lines = [
+        "def normalize(data, rejected):",
+        "    out = []",
+        "    append = out.append",
+        "    for it in data:",
+        "        try:",
+        f"            append(Item({', '.join(args)}))",
+        "        except (KeyError, TypeError, AttributeError, ValueError, OverflowError):",
+        "            rejected.append(it)",
+        "    return out",
+    ]
+
+    # field names are only ever referenced through the bound constants
+    namespace = dict(consts)
+    exec(compile("\n".join(lines), f"<normalize {mapping['id']}>", "exec"), namespace)
+    return namespace["normalize"]
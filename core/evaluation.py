@@ -0,0 +1,109 @@
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+from core.math_utils import calc_delta, est_rating
+from core.solvers import fit_profile, solver_for
+
+# Processes used to fan out train/test splits
+WORKERS = int(os.getenv("EVAL_WORKERS", str(os.cpu_count() or 1)))
+
+_pool = None   # shared by all evaluations in the process, WORKERS processes
+_pool_lock = threading.Lock()
+
+
+def make_splits(total, train_sizes, trials, seed):
+    """Reproducible random splits: (train_size, train_idx, test_idx) per trial."""
+    rng = random.Random(seed)
+    indices = list(range(total))
+    splits = []
+    for size in train_sizes:
+        for _ in range(trials):
+            train = rng.sample(indices, size)
+            chosen = set(train)
+            splits.append((size, train, [i for i in indices if i not in chosen]))
+    return splits
+
+
+def evaluate(system, vectors, ratings, train_sizes, trials=10, seed=None, workers=None):
+    """Cross-validate profile fitting on rated items.
+
+    For every train size, `trials` random splits are fitted and scored by
+    the MAE of the estimated ratings on the held-out items. Splits are
+    independent, so they run on a process pool. Returns per train size the
+    mean and standard deviation of the MAE and the time spent fitting, plus
+    the seed that reproduces the splits.
+    """
+    if seed is None:
+        seed = random.randrange(2 ** 32)
+    workers = WORKERS if workers is None else workers
+    splits = make_splits(len(vectors), train_sizes, trials, seed)
+    n_features = len(vectors[0])
+    tasks = [(solver_for(system), vectors, ratings, n_features, train, test)
+             for _, train, test in splits]
+
+    started = time.perf_counter()
+    results = _map(tasks, workers)
+    elapsed = time.perf_counter() - started
+
+    by_size = {}
+    for (size, _, _), (mae, seconds) in zip(splits, results):
+        entry = by_size.setdefault(size, {"maes": [], "fit_seconds": 0.0})
+        entry["maes"].append(mae)
+        entry["fit_seconds"] += seconds
+
+    report = {}
+    for size, entry in by_size.items():
+        maes = np.array(entry["maes"])
+        report[str(size)] = {
+            "mean": round(float(maes.mean()), 4),
+            "std": round(float(maes.std()), 4),
+            "trials": len(maes),
+            "fit_seconds": round(entry["fit_seconds"], 4),
+        }
+    return {"seed": seed, "elapsed_seconds": round(elapsed, 4), "by_train_size": report}
+
+
+def _map(tasks, workers):
+    global _pool
+    workers = min(workers, WORKERS, len(tasks))
+    if workers <= 1:
+        return [_run_split(*t) for t in tasks]
+    # one batch per worker: at most `workers` processes of the shared pool
+    # work on this call, and each pickles the data once
+    batches = [tasks[i::workers] for i in range(workers)]
+    try:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ProcessPoolExecutor(max_workers=WORKERS)
+            pool = _pool
+        done = list(pool.map(_run_batch, batches))
+    except BrokenProcessPool:
+        logging.error("[evaluate] Evaluation pool broken, running splits inline")
+        with _pool_lock:
+            if _pool is pool:
+                _pool = None
+        return [_run_split(*t) for t in tasks]
+    results = [None] * len(tasks)
+    for i, batch_results in enumerate(done):
+        results[i::workers] = batch_results
+    return results
+
+
+def _run_batch(tasks):
+    return [_run_split(*t) for t in tasks]
+
+
+def _run_split(solver, vectors, ratings, n_features, train_idx, test_idx):
+    started = time.perf_counter()
+    deltas = calc_delta([ratings[i] for i in train_idx], n_features)
+    profile = fit_profile(None, [vectors[i] for i in train_idx], deltas, solver=solver)
+    seconds = time.perf_counter() - started
+    errors = [abs(ratings[i] - est_rating(profile, vectors[i], n_features)) for i in test_idx]
+    return sum(errors) / len(errors), seconds
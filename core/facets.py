@@ -0,0 +1,127 @@
+"""Facet bitmaps for filtered browsing.
+
+Items can carry a list of facet values ("cuisines.Italian", "priceLevel.$$",
+...) in FACET_FIELD. For each system the values are kept in memory as one
+bitmap per value over the catalog rows (uint64 words, bit r = catalog row
+r), so a filter is a few vectorized ANDs and the per-value counts of the
+result one bitwise_count. Filtered listings page through the rows of
+such a mask (core.listing.facet_page).
+
+Building the bitmaps reads the field of every item from Mongo, so they are
+rebuilt only when the catalog content changes, when this process edits an
+item (invalidate_catalog), or after FACET_MAX_AGE seconds, which is how
+edits made by other workers are picked up. A catalog simply reloaded after
+CATALOG_MAX_AGE reuses them. Mongo keeps a multikey index on the field for
+queries that still go there (ensure_item_index).
+"""
+import os
+import threading
+import time
+
+import numpy as np
+
+from core.catalog import catalog_generation, get_catalog
+from db.collections import SYSTEMS, get_items_collection
+
+FACET_FIELD = "features"
+BUILD_BATCH = 10000
+FACET_MAX_AGE = float(os.getenv("FACET_MAX_AGE", "3600"))
+
+_indexes = {}
+_lock = threading.Lock()
+
+
+class FacetIndex:
+    """Bitmaps of one catalog content (`key`). `values` lists the facet values in
+    the row order of `bitmaps`, a (len(values), words) uint64 matrix."""
+
+    __slots__ = ("key", "size", "values", "positions", "bitmaps", "built_at")
+
+    def __init__(self, key, size, rows_by_value):
+        self.key = key
+        self.size = size
+        self.built_at = time.monotonic()
+        self.values = sorted(rows_by_value)
+        self.positions = {value: i for i, value in enumerate(self.values)}
+        words = (size + 63) // 64
+        self.bitmaps = np.zeros((len(self.values), words), dtype="<u8")
+        bits = np.zeros(words * 64, dtype=bool)
+        for i, value in enumerate(self.values):
+            bits[:] = False
+            bits[rows_by_value[value]] = True
+            self.bitmaps[i] = np.packbits(bits, bitorder="little").view("<u8")
+
+    def mask(self, values):
+        """Bitmap of the rows that have every one of `values`."""
+        words = self.bitmaps.shape[1]
+        full = np.zeros(words * 64, dtype=bool)
+        full[:self.size] = True
+        mask = np.packbits(full, bitorder="little").view("<u8")
+        for value in values:
+            pos = self.positions.get(value)
+            if pos is None:
+                return np.zeros(words, dtype="<u8")
+            mask = mask & self.bitmaps[pos]
+        return mask
+
+    def counts(self, mask):
+        """{value: rows in `mask` that have it}, for the values present."""
+        if not self.values:
+            return {}
+        counts = np.bitwise_count(self.bitmaps & mask).sum(axis=1)
+        return {self.values[i]: int(counts[i]) for i in np.flatnonzero(counts)}
+
+
+def rows_of(mask, size):
+    """Row numbers set in a bitmap, ascending."""
+    return np.flatnonzero(np.unpackbits(mask.view(np.uint8), bitorder="little", count=size))
+
+
+def summary(system, values):
+    """(number of items having all facet `values`, {value: count among them})."""
+    index = get_facets(system)
+    mask = index.mask(values)
+    return int(np.bitwise_count(mask).sum()), index.counts(mask)
+
+
+def get_facets(system, catalog=None):
+    """The FacetIndex of `system`, built on first use and again when the
+    catalog content or generation changes or the bitmaps are FACET_MAX_AGE old."""
+    system = str(system)
+    catalog = catalog or get_catalog(system)
+    key = _catalog_key(catalog)
+    index = _indexes.get(system)
+    if _current(index, key):
+        return index
+    with _lock:
+        index = _indexes.get(system)
+        if not _current(index, key):
+            index = _indexes[system] = build_facets(system, catalog)
+    return index
+
+
+def _current(index, key):
+    return index is not None and index.key == key and time.monotonic() - index.built_at < FACET_MAX_AGE
+
+
+def build_facets(system, catalog):
+    id_field = SYSTEMS[system]["mapping"]["id"]
+    rows_by_value = {}
+    cursor = get_items_collection(system).find(
+        {FACET_FIELD: {"$exists": True}}, {"_id": 0, id_field: 1, FACET_FIELD: 1}
+    ).batch_size(BUILD_BATCH)
+    for doc in cursor:
+        row = catalog.index.get(str(doc.get(id_field)))
+        values = doc.get(FACET_FIELD)
+        if row is None or not isinstance(values, list):
+            continue
+        for value in values:
+            if isinstance(value, str):
+                rows_by_value.setdefault(value, []).append(row)
+    return FacetIndex(_catalog_key(catalog), len(catalog), rows_by_value)
+
+
+def _catalog_key(catalog):
+    # the version alone misses facet edits that leave the vectors alone;
+    # the generation catches this process's, FACET_MAX_AGE other workers'
+    return catalog.version, catalog_generation(catalog.system)
@@ -0,0 +1,325 @@
+"""Bit-packed feature vectors of a system, on disk.
+
+    python -m core.feature_store [system ...]
+
+Decoding the BSON feature arrays of every item is the slowest part of
+loading a large system. The store keeps them as one row of packed bits per
+item (np.packbits) in a flat file that is opened with np.memmap, next to an
+id index in the catalog segment format (core.catalog_store):
+
+    <system>.<gen>.bits        rows of ceil(width / 8) bytes
+    <system>.<gen>.ids.npy     ids in row order
+    <system>.<gen>.sorted.npy  the same ids sorted
+    <system>.<gen>.order.npy   row of every sorted id
+    <system>.json              width, rows, gen, bits, built_at
+
+The json file is replaced atomically and names the files that are current,
+so readers never see a half-written store.
+
+It is built from the item collection on first use and kept current by
+update_store as items are added or edited, which writes the changed and
+new rows to the next generation. Only 0/1 vectors of one width can be stored;
+other systems are marked unsupported and keep reading Mongo.
+"""
+import argparse
+import glob
+import json
+import logging
+import os
+import time
+
+import numpy as np
+
+from core.catalog_store import SharedIds, SharedIndex, locked, slug
+from db.collections import SYSTEMS, get_items_collection
+
+STORE_DIR = os.getenv("FEATURE_STORE_DIR", "./.feature_store")
+# Full rebuilds catch item changes made outside the app; by default as
+# often as catalogs are reloaded, so both go stale for the same time
+MAX_AGE = float(os.getenv("FEATURE_STORE_MAX_AGE", os.getenv("CATALOG_MAX_AGE", "300")))
+BUILD_BATCH = 10000
+
+_stores = {}
+
+
+class FeatureStore:
+    """Read-only view of one system's store.
+
+    `packed` is the memory-mapped (rows, row_bytes) bit matrix; `ids` and
+    `index` map between rows and item ids like a Catalog's.
+    """
+
+    __slots__ = ("system", "width", "packed", "ids", "index", "built_at", "key")
+
+    def __init__(self, system, meta, key):
+        self.system = system
+        self.width = meta["width"]
+        self.built_at = meta["built_at"]
+        self.key = key
+        row_bytes = _row_bytes(self.width)
+        if meta["rows"]:
+            self.packed = np.memmap(_path(system, meta["bits"]), dtype=np.uint8, mode="r",
+                                    shape=(meta["rows"], row_bytes))
+        else:
+            self.packed = np.zeros((0, row_bytes), dtype=np.uint8)
+        prefix = f"{meta['gen']}."
+        ids = np.load(_path(system, prefix + "ids.npy"), mmap_mode="r")
+        self.ids = SharedIds(ids)
+        self.index = SharedIndex(np.load(_path(system, prefix + "sorted.npy"), mmap_mode="r"),
+                                 np.load(_path(system, prefix + "order.npy"), mmap_mode="r"))
+
+    def matrix(self, rows=None):
+        """Unpacked uint8 feature rows, all of them or the given row numbers."""
+        packed = self.packed if rows is None else self.packed[rows]
+        return np.unpackbits(packed, axis=1, count=self.width)
+
+    def vectors(self, item_ids):
+        """{item_id: vector} for the ids in the store."""
+        found = {i: row for i in item_ids if (row := self.index.get(i)) is not None}
+        matrix = self.matrix(list(found.values()))
+        return {i: vec for i, vec in zip(found, matrix.tolist())}
+
+    def __len__(self):
+        return len(self.packed)
+
+
+# ───────────── Reading ─────────────
+
+def load_store(system, build=True):
+    """The feature store of `system`, or None if it has none.
+
+    With `build`, a missing or expired store is built first (one process at
+    a time). Returns None for systems whose vectors can't be packed.
+    """
+    system = str(system)
+    meta, key = _read_meta(system)
+    if build and (meta is None or time.time() - meta["built_at"] > MAX_AGE):
+        with locked(STORE_DIR, system):
+            meta, key = _read_meta(system)
+            if meta is None or time.time() - meta["built_at"] > MAX_AGE:
+                build_store(system)
+                meta, key = _read_meta(system)
+    if meta is None or meta.get("unsupported"):
+        return None
+
+    store = _stores.get(system)
+    if store is None or store.key != key:
+        try:
+            store = _stores[system] = FeatureStore(system, meta, key)
+        except (OSError, ValueError):
+            return None  # rewritten meanwhile; the next call sees the new one
+    return store
+
+
+def _read_meta(system):
+    path = _path(system, "json")
+    try:
+        st = os.stat(path)
+        with open(path) as f:
+            # replaced atomically, so a new inode means a new store
+            return json.load(f), (st.st_ino, st.st_mtime_ns)
+    except (OSError, ValueError):
+        return None, None
+
+
+# ───────────── Writing ─────────────
+
+def stored_filter(system):
+    """Query for the items a store holds: those whose vector is an array.
+    Documents with no vector, or a null or scalar one, are left out."""
+    return {SYSTEMS[system]["mapping"]["featureVector"]: {"$type": "array"}}
+
+
+def build_store(system):
+    """(Re)build the store of `system` from its item collection.
+    Callers hold the system's lock."""
+    mapping = SYSTEMS[system]["mapping"]
+    id_field, vec_field = mapping["id"], mapping["featureVector"]
+    os.makedirs(STORE_DIR, exist_ok=True)
+    started = time.time()
+    ids, width = [], None
+    meta, _ = _read_meta(system)
+    gen = (meta or {}).get("gen", 0) + 1
+    tmp = _path(system, f"{gen}.bits")
+
+    cursor = get_items_collection(system).find(
+        stored_filter(system), {"_id": 0, id_field: 1, vec_field: 1}
+    ).batch_size(BUILD_BATCH)
+    with open(tmp, "wb") as out:
+        batch_ids, batch = [], []
+        for doc in cursor:
+            vec = doc.get(vec_field)
+            if id_field not in doc or not isinstance(vec, list):
+                continue
+            if width is None:
+                width = len(vec)
+            if len(vec) != width:
+                return _unsupported(system, tmp, f"item {doc[id_field]} has {len(vec)} features, expected {width}")
+            batch_ids.append(str(doc[id_field]))
+            batch.append(vec)
+            if len(batch) == BUILD_BATCH:
+                if not _write_rows(out, batch):
+                    return _unsupported(system, tmp, "feature values other than 0/1")
+                ids += batch_ids
+                batch_ids, batch = [], []
+        if batch:
+            if not _write_rows(out, batch):
+                return _unsupported(system, tmp, "feature values other than 0/1")
+            ids += batch_ids
+
+    _publish(system, gen, ids, width or 0, f"{gen}.bits", started)
+    logging.info(f"[feature_store] Built {system}: {len(ids)} items, {width} features")
+
+
+def update_store(system, docs):
+    """Write the vectors of added or edited item documents into the store.
+
+    Known ids are rewritten in place and new ones appended. Nothing happens
+    when the system has no store yet; it is built on first use.
+    """
+    system = str(system)
+    mapping = SYSTEMS[system]["mapping"]
+    id_field, vec_field = mapping["id"], mapping["featureVector"]
+
+    with locked(STORE_DIR, system):
+        meta, _ = _read_meta(system)
+        if meta is None or meta.get("unsupported"):
+            return
+        store = FeatureStore(system, meta, None)
+        changed, added = {}, {}   # row -> vector, new id -> vector
+        for doc in docs:
+            if id_field not in doc or vec_field not in doc:
+                continue
+            item_id = str(doc[id_field])
+            row = store.index.get(item_id)
+            if row is None:
+                added[item_id] = doc[vec_field]
+            else:
+                changed[row] = doc[vec_field]
+
+        vectors = list(changed.values()) + list(added.values())
+        if not vectors:
+            return
+        packed = _pack(vectors, meta["width"])
+        if packed is None:
+            # a new width or non-binary values; rebuild (or give up) on next use
+            _remove(system)
+            return
+
+        # other workers map the current file, so the rows go to a new
+        # generation that the meta switches to atomically
+        gen = meta["gen"] + 1
+        rows = np.array(store.packed)
+        rows[list(changed)] = packed[:len(changed)]
+        with open(_path(system, f"{gen}.bits"), "wb") as out:
+            out.write(rows.tobytes())
+            out.write(packed[len(changed):].tobytes())
+        _publish(system, gen, list(store.ids) + list(added),
+                 meta["width"], f"{gen}.bits", meta["built_at"])
+
+
+def remove_store(system):
+    """Delete the store of `system`; it is rebuilt from Mongo on next use."""
+    system = str(system)
+    with locked(STORE_DIR, system):
+        _remove(system)
+
+
+def _remove(system):
+    _stores.pop(system, None)
+    for path in [_path(system, "json")] + _gen_files(system):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _publish(system, gen, ids, width, bits, built_at):
+    encoded = np.array([i.encode() for i in ids], dtype=bytes) if ids else np.array([], dtype="S1")
+    order = np.argsort(encoded, kind="stable")
+    prefix = f"{gen}."
+    np.save(_path(system, prefix + "ids.npy"), encoded)
+    np.save(_path(system, prefix + "sorted.npy"), encoded[order])
+    np.save(_path(system, prefix + "order.npy"), order.astype(np.int64))
+    _write_meta(system, {"width": width, "rows": len(ids), "gen": gen, "bits": bits,
+                         "built_at": built_at})
+    # processes that mapped the old files keep them until they reload
+    keep = {_path(system, prefix + name) for name in ("ids.npy", "sorted.npy", "order.npy")}
+    keep.add(_path(system, bits))
+    for path in _gen_files(system):
+        if path not in keep:
+            os.remove(path)
+
+
+def _write_meta(system, meta):
+    tmp = _path(system, "json.tmp")
+    with open(tmp, "w") as f:
+        json.dump(meta, f)
+    os.replace(tmp, _path(system, "json"))
+
+
+def _unsupported(system, tmp, reason):
+    logging.error(f"[feature_store] Not storing {system}: {reason}")
+    os.remove(tmp)
+    _remove(system)
+    _write_meta(system, {"unsupported": reason, "built_at": time.time()})
+
+
+def _write_rows(out, vectors):
+    packed = _pack(vectors, len(vectors[0]))
+    if packed is None:
+        return False
+    out.write(packed.tobytes())
+    return True
+
+
+def _pack(vectors, width):
+    try:
+        matrix = np.asarray(vectors, dtype=float)
+    except (TypeError, ValueError):
+        return None
+    if matrix.shape != (len(vectors), width) or not np.isin(matrix, (0, 1)).all():
+        return None
+    return np.packbits(matrix.astype(np.uint8), axis=1)
+
+
+def _row_bytes(width):
+    return (width + 7) // 8
+
+
+def _path(system, suffix):
+    return os.path.join(STORE_DIR, f"{slug(system)}.{suffix}")
+
+
+def _gen_files(system):
+    # <slug>.<gen>.*; slugs contain no "."
+    pattern = os.path.join(glob.escape(STORE_DIR), glob.escape(slug(system)) + ".[0-9]*.*")
+    return glob.glob(pattern)
+
+
+# ───────────── CLI ─────────────
+
+def main(argv=None):
+    from dotenv import load_dotenv
+    from db.collections import load_existing_collections
+    from db.connection import init_db
+
+    parser = argparse.ArgumentParser(description="Build bit-packed feature stores.")
+    parser.add_argument("systems", nargs="*", help="systems to build (default: all)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    load_dotenv()
+    init_db()
+    load_existing_collections()
+
+    for system in args.systems or list(SYSTEMS):
+        if system not in SYSTEMS:
+            logging.error(f"[feature_store] Unknown system '{system}'")
+            continue
+        with locked(STORE_DIR, system):
+            build_store(system)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""Item locations for the "Near Me" listing.
+
+Systems whose mapping has `latitude` and `longitude` keep a GeoJSON point
+in every item document under GEO_FIELD, with a 2dsphere index on it, so a
+nearby query reads only the items around the user ($geoNear). Items with
+missing or invalid coordinates get GEO_FIELD = None and are never near
+anything. Where the index can't be used, nearby() falls back to scanning
+the coordinates with a vectorized haversine.
+"""
+import logging
+import os
+
+import numpy as np
+from pymongo import GEOSPHERE, UpdateOne
+from pymongo.errors import OperationFailure
+
+from db.collections import SYSTEMS, get_items_collection, get_system_metadata_collection
+
+GEO_FIELD = "_geo"
+# system_metadata key: the [latitude, longitude] fields points were last
+# backfilled from, so restarts don't scan the collection again
+BACKFILL_KEY = "geo_backfilled"
+RADIUS_KM = float(os.getenv("NEARBY_RADIUS_KM", "25"))
+LIMIT = int(os.getenv("NEARBY_LIMIT", "100"))
+EARTH_RADIUS_KM = 6371.0
+BACKFILL_BATCH = 1000
+
+
+def has_location(mapping):
+    return bool(mapping) and "latitude" in mapping and "longitude" in mapping
+
+
+def geo_point(doc, mapping):
+    """The GeoJSON point of an item document, or None."""
+    try:
+        lat = float(doc[mapping["latitude"]])
+        lon = float(doc[mapping["longitude"]])
+    except (KeyError, TypeError, ValueError):
+        return None
+    if not valid_location(lat, lon):
+        return None
+    return {"type": "Point", "coordinates": [lon, lat]}
+
+
+def valid_location(lat, lon):
+    # also rejects NaN
+    return -90 <= lat <= 90 and -180 <= lon <= 180
+
+
+def add_points(system, docs):
+    """Set GEO_FIELD on item documents about to be inserted."""
+    mapping = SYSTEMS.get(system, {}).get("mapping")
+    if has_location(mapping):
+        for doc in docs:
+            doc[GEO_FIELD] = geo_point(doc, mapping)
+    return docs
+
+
+def update_points(system, docs):
+    """Rewrite GEO_FIELD of stored item documents whose coordinates changed."""
+    mapping = SYSTEMS.get(system, {}).get("mapping")
+    if not has_location(mapping):
+        return
+    ops = [
+        UpdateOne({"_id": doc["_id"]}, {"$set": {GEO_FIELD: geo_point(doc, mapping)}})
+        for doc in docs if doc
+    ]
+    if ops:
+        get_items_collection(system).bulk_write(ops, ordered=False)
+
+
+def clear_points(system):
+    """Drop every stored point, e.g. when the coordinate fields are remapped.
+    The next ensure_geo_index backfills them again."""
+    get_items_collection(system).update_many({}, {"$unset": {GEO_FIELD: ""}})
+    get_system_metadata_collection().update_one(
+        {"collection_name": system}, {"$unset": {BACKFILL_KEY: ""}}
+    )
+
+
+def ensure_geo_index(system, mapping):
+    """Give items missing a point one and build the 2dsphere index.
+    Returns False when the system has no coordinates or the index failed.
+
+    The backfill scans the whole collection (the sparse index can't find
+    documents without the field), so it runs once per coordinate mapping
+    and is recorded under BACKFILL_KEY; items added later get their point
+    on insert (add_points).
+    """
+    if not has_location(mapping):
+        return False
+    collection = get_items_collection(system)
+    metadata = get_system_metadata_collection()
+    lat_field, lon_field = mapping["latitude"], mapping["longitude"]
+    try:
+        if not metadata.find_one({"collection_name": system, BACKFILL_KEY: [lat_field, lon_field]},
+                                 {"_id": 1}):
+            _backfill(collection, mapping)
+            metadata.update_one({"collection_name": system},
+                                {"$set": {BACKFILL_KEY: [lat_field, lon_field]}}, upsert=True)
+        collection.create_index([(GEO_FIELD, GEOSPHERE)])
+    except OperationFailure as e:
+        logging.error(f"[ensure_geo_index] No geo index for '{system}': {e}")
+        return False
+    return True
+
+
+def _backfill(collection, mapping):
+    lat_field, lon_field = mapping["latitude"], mapping["longitude"]
+    cursor = collection.find(
+        {GEO_FIELD: {"$exists": False}}, {lat_field: 1, lon_field: 1}
+    ).batch_size(BACKFILL_BATCH)
+    ops = []
+    for doc in cursor:
+        ops.append(UpdateOne({"_id": doc["_id"]}, {"$set": {GEO_FIELD: geo_point(doc, mapping)}}))
+        if len(ops) == BACKFILL_BATCH:
+            collection.bulk_write(ops, ordered=False)
+            ops = []
+    if ops:
+        collection.bulk_write(ops, ordered=False)
+
+
+# ───────────── Queries ─────────────
+
+def haversine_km(lat, lon, lats, lons):
+    """Great-circle distances in km from (lat, lon) to arrays of points."""
+    φ1, φ2 = np.radians(lat), np.radians(lats)
+    Δφ = φ2 - φ1
+    Δλ = np.radians(lons) - np.radians(lon)
+    a = np.sin(Δφ / 2) ** 2 + np.cos(φ1) * np.cos(φ2) * np.sin(Δλ / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def nearby(system, lat, lon, query=None, radius_km=RADIUS_KM, limit=LIMIT, projection=None):
+    """Item documents matching `query` within radius_km of (lat, lon),
+    nearest first and at most `limit`, each with its "distance" in km.
+    `projection` limits the fields returned."""
+    query = query or {}
+    try:
+        project = [{"$project": {**projection, "distance": 1}}] if projection else []
+        return list(get_items_collection(system).aggregate([
+            {"$geoNear": {
+                "near": {"type": "Point", "coordinates": [lon, lat]},
+                "key": GEO_FIELD,
+                "distanceField": "distance",
+                "distanceMultiplier": 0.001,
+                "maxDistance": radius_km * 1000,
+                "query": query,
+                "spherical": True,
+            }},
+            {"$limit": limit},
+        ] + project))
+    except OperationFailure as e:
+        logging.warning(f"[nearby] $geoNear failed on '{system}', scanning instead: {e}")
+    return scan_nearby(system, lat, lon, query, radius_km, limit, projection)
+
+
+def scan_nearby(system, lat, lon, query=None, radius_km=RADIUS_KM, limit=LIMIT, projection=None):
+    """nearby() without an index: reads only the coordinates of the matching
+    items, then the full documents of the nearest ones."""
+    mapping = SYSTEMS[system]["mapping"]
+    lat_field, lon_field = mapping["latitude"], mapping["longitude"]
+    collection = get_items_collection(system)
+    ids, lats, lons = [], [], []
+    for doc in collection.find(query or {}, {lat_field: 1, lon_field: 1}):
+        point = geo_point(doc, mapping)
+        if point:
+            ids.append(doc["_id"])
+            lons.append(point["coordinates"][0])
+            lats.append(point["coordinates"][1])
+    if not ids:
+        return []
+
+    distances = haversine_km(lat, lon, np.array(lats), np.array(lons))
+    inside = np.flatnonzero(distances <= radius_km)
+    if len(inside) > limit:
+        inside = inside[np.argpartition(distances[inside], limit - 1)[:limit]]
+    inside = inside[np.argsort(distances[inside], kind="stable")]
+
+    projection = {**projection, "_id": 1} if projection else None
+    docs = {d["_id"]: d for d in collection.find({"_id": {"$in": [ids[i] for i in inside]}}, projection)}
+    out = []
+    for i in inside:
+        doc = docs.get(ids[i])
+        if doc is not None:
+            doc["distance"] = float(distances[i])
+            out.append(doc)
+    return out
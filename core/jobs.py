@@ -0,0 +1,174 @@
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from core.solvers import is_optimal, refit_profile, solver_for
+from core.users import set_taste
+
+# Solver processes shared by all request threads of this web worker
+WORKERS = int(os.getenv("SOLVER_WORKERS", "2"))
+# Seconds a page request waits for its solve before answering without it
+WAIT = float(os.getenv("SOLVER_WAIT", "10"))
+# Seconds a finished job stays pollable
+JOB_TTL = float(os.getenv("SOLVER_JOB_TTL", "600"))
+
+_pool = None
+_jobs = {}
+_active = {}
+_lock = threading.RLock()
+
+
+class Job:
+    """One profile fit for a (user, system) pair.
+
+    While a job is queued or running, new submissions for the same pair are
+    folded into it: the newest inputs are kept in `pending` and solved as soon
+    as the current run finishes, so the job always ends with the latest
+    ratings and callers keep polling a single id.
+    """
+
+    __slots__ = ("id", "user_id", "system", "persist", "status", "profile", "changed",
+                 "error", "pending", "submitted_at", "finished_at", "done")
+
+    def __init__(self, user_id, system, persist):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.system = system
+        self.persist = persist
+        self.status = "queued"
+        self.profile = None
+        self.changed = False
+        self.error = None
+        self.pending = None
+        self.submitted_at = time.time()
+        self.finished_at = None
+        self.done = threading.Event()
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "user_id": self.user_id,
+            "system": self.system,
+            "status": self.status,
+            "profile": self.profile,
+            "error": self.error,
+            "submitted_at": self.submitted_at,
+            "finished_at": self.finished_at,
+        }
+
+
+# ───────────── Submission ─────────────
+
+def submit_fit(user_id, system, vectors, deltas, previous=None, persist=True):
+    """Queue a profile fit and return its Job.
+
+    If `previous` (the stored taste vector) is still optimal the job is
+    finished on the spot without touching the pool. With `persist` the
+    result is written through set_taste when it differs from `previous`.
+    """
+    user_id, system = str(user_id), str(system)
+    key = (user_id, system)
+    inputs = (solver_for(system), vectors, deltas, previous)
+
+    with _lock:
+        _prune()
+        job = _active.get(key)
+        if job is not None:
+            job.pending = inputs
+            return job
+
+        job = Job(user_id, system, persist)
+        _jobs[job.id] = job
+        if previous is not None and is_optimal(previous, vectors, deltas):
+            _complete(job, previous, changed=False)
+            return job
+        _active[key] = job
+        _launch(job, inputs)
+    return job
+
+
+def get_job(job_id):
+    with _lock:
+        return _jobs.get(job_id)
+
+
+def wait_for(job, timeout=None):
+    """Block until `job` is finished; True if it finished in time."""
+    return job.done.wait(timeout)
+
+
+def job_stats():
+    with _lock:
+        counts = {}
+        for job in _jobs.values():
+            counts[job.status] = counts.get(job.status, 0) + 1
+        return {"workers": WORKERS, "active": len(_active), "jobs": counts}
+
+
+# ───────────── Worker Side ─────────────
+
+def _run(solver, vectors, deltas, previous):
+    # Runs in a pool process; the solver is resolved by the parent so a
+    # system registered after the pool forked still gets its own backend
+    return refit_profile(None, vectors, deltas, previous, solver=solver)
+
+
+def _launch(job, inputs):
+    global _pool
+    job.status = "running"
+    try:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=WORKERS)
+        future = _pool.submit(_run, *inputs)
+    except BrokenProcessPool:
+        logging.error("[_launch] Solver pool broken, restarting it")
+        _pool = ProcessPoolExecutor(max_workers=WORKERS)
+        future = _pool.submit(_run, *inputs)
+    future.add_done_callback(lambda f: _finished(job, f))
+
+
+def _finished(job, future):
+    try:
+        profile, changed = future.result()
+    except Exception as e:
+        logging.error(f"[_finished] Profile fit for {job.user_id}/{job.system} failed: {e}")
+        with _lock:
+            _active.pop((job.user_id, job.system), None)
+            job.status, job.error = "failed", str(e)
+            job.finished_at = time.time()
+        job.done.set()
+        return
+
+    with _lock:
+        # compared with the stored taste, not with an intermediate result
+        job.changed = job.changed or changed
+        if job.pending is not None:
+            # newer ratings arrived meanwhile; warm-start them from this result
+            solver, vectors, deltas, _ = job.pending
+            job.pending = None
+            _launch(job, (solver, vectors, deltas, profile))
+            return
+        _active.pop((job.user_id, job.system), None)
+    _complete(job, profile, job.changed)
+
+
+def _complete(job, profile, changed):
+    if job.persist and changed:
+        try:
+            set_taste(job.user_id, job.system, profile)
+        except Exception as e:
+            logging.error(f"[_complete] Could not store taste for {job.user_id}/{job.system}: {e}")
+    job.profile = profile
+    job.status = "done"
+    job.finished_at = time.time()
+    job.done.set()
+
+
+def _prune():
+    cutoff = time.time() - JOB_TTL
+    for job_id in [j.id for j in _jobs.values() if j.finished_at and j.finished_at < cutoff]:
+        del _jobs[job_id]
@@ -0,0 +1,110 @@
+"""Pages of items for the listing pages.
+
+Unfiltered pages are read from Mongo with keyset pagination on the mapped
+id field (which has an index, see ensure_item_index): a page ends with a
+cursor, the encoded last id, and the next page asks for the ids after it.
+Only the displayed fields are fetched. Page cost does not depend on how far
+into the listing the cursor is or on the size of the system.
+
+Filtered pages never query Mongo: they walk the rows set in the facet
+bitmap of the filter (core.facets) over the cached catalog, in catalog
+order, and the cursor is the last row shown.
+"""
+import base64
+import os
+
+import numpy as np
+from bson import json_util
+
+from core.catalog import get_catalog
+from core.data_utils import field_projection, normalize
+from core.facets import get_facets, rows_of
+from core.geo import RADIUS_KM, nearby
+from db.collections import SYSTEMS, get_items_collection
+
+PAGE_SIZE = int(os.getenv("LISTING_PAGE_SIZE", "48"))
+MAX_PAGE_SIZE = 200
+
+
+def item_page(system, query=None, after=None, limit=PAGE_SIZE):
+    """(items, next cursor) for the items matching `query` whose id comes
+    after the cursor `after`, in id order. The cursor is None on the last
+    page. Raises ValueError for a malformed cursor."""
+    mapping = SYSTEMS[system]["mapping"]
+    id_field = mapping["id"]
+    projection = field_projection(mapping, "listing")
+
+    query = dict(query or {})
+    query[id_field] = {"$gt": decode_cursor(after)} if after else {"$exists": True}
+    docs = list(
+        get_items_collection(system).find(query, projection).sort(id_field, 1).limit(limit + 1)
+    )
+    more = len(docs) > limit
+    docs = docs[:limit]
+    cursor = encode_cursor(docs[-1][id_field]) if more else None
+    return normalize(docs, mapping, "listing"), cursor
+
+
+def facet_page(system, values, after=None, limit=PAGE_SIZE):
+    """(items, next cursor) for the catalog items having every facet value
+    in `values`, in catalog order, after the cursor `after`. The cursor is
+    None on the last page. Raises ValueError for a malformed cursor."""
+    catalog = get_catalog(system)
+    rows = rows_of(get_facets(system, catalog).mask(values), len(catalog))
+    start = 0
+    if after:
+        start = int(np.searchsorted(rows, _cursor_row(catalog, decode_cursor(after)), side="right"))
+    page = rows[start:start + limit + 1]
+    more = len(page) > limit
+    page = page[:limit]
+    cursor = None
+    if more:
+        last = int(page[-1])
+        cursor = encode_cursor({"row": last, "id": catalog.ids[last]})
+    return [catalog.items[r] for r in page], cursor
+
+
+def _cursor_row(catalog, cursor):
+    # rows move when the catalog is reloaded with items added or removed;
+    # follow the item to its new row while it is still there
+    try:
+        row, item_id = int(cursor["row"]), cursor["id"]
+    except (TypeError, KeyError, ValueError) as e:
+        raise ValueError(f"bad cursor: {cursor!r}") from e
+    if row < len(catalog) and catalog.ids[row] == item_id:
+        return row
+    return catalog.index.get(item_id, row)
+
+
+def items_by_id(system, item_ids):
+    """Display fields of the given items, in that order, from the cached
+    catalog. Unknown ids are skipped."""
+    catalog = get_catalog(system)
+    return [catalog.items[row].to_dict() for row in catalog.rows(item_ids)]
+
+
+def nearby_items(system, lat, lon, query=None, radius_km=RADIUS_KM):
+    """The items within `radius_km` of (lat, lon) matching `query`, nearest
+    first, with `distance` (km) set."""
+    mapping = SYSTEMS[system]["mapping"]
+    id_field = mapping["id"]
+    docs = nearby(system, lat, lon, query, radius_km=radius_km,
+                  projection=field_projection(mapping, "listing"))
+    # normalize() leaves malformed documents out, so match distances by id
+    distances = {str(doc[id_field]): doc["distance"] for doc in docs if id_field in doc}
+    items = normalize(docs, mapping, "listing")
+    for it in items:
+        it.distance = distances[it.id]
+    return items
+
+
+def encode_cursor(value):
+    # extended JSON keeps the id's BSON type, so $gt compares like with like
+    return base64.urlsafe_b64encode(json_util.dumps(value).encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        return json_util.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception as e:
+        raise ValueError(f"bad cursor: {cursor!r}") from e
@@ -0,0 +1,82 @@
+"""Small cache for documents read on almost every request.
+
+Lookups are remembered for the rest of the current request (flask.g) and
+for TTL seconds in the process. Writes through core.users / core.systems
+invalidate the process entry; other gunicorn workers see the change when
+their entry expires, so keep TTL short. Cached values are shared and must
+be treated as read-only.
+"""
+import os
+import threading
+import time
+
+from flask import g, has_app_context
+
+TTL = float(os.getenv("LOOKUP_CACHE_TTL", "5"))
+# Per kind; a full kind is cleared rather than scanned for expired entries
+MAX_ENTRIES = 10000
+
+_entries = {}       # kind -> {key: (expires, value)}
+_generations = {}   # kind -> invalidation count
+_lock = threading.Lock()
+_stats = {"request_hits": 0, "hits": 0, "misses": 0}
+
+
+def cached(kind, key, load):
+    """The value for (kind, key), calling load() only on a miss."""
+    memo = _request_memo().setdefault(kind, {})
+    if key in memo:
+        _count("request_hits")
+        return memo[key]
+
+    now = time.monotonic()
+    entry = _entries.get(kind, {}).get(key)
+    if entry is not None and entry[0] > now:
+        _count("hits")
+        value = entry[1]
+    else:
+        _count("misses")
+        generation = _generations.get(kind, 0)
+        value = load()
+        with _lock:
+            # an invalidation during load() means the value may be stale
+            if _generations.get(kind, 0) == generation:
+                entries = _entries.setdefault(kind, {})
+                if len(entries) >= MAX_ENTRIES:
+                    entries.clear()
+                entries[key] = (now + TTL, value)
+    memo[key] = value
+    return value
+
+
+def invalidate(kind, key=None):
+    """Forget one entry, or every entry of `kind` when key is None."""
+    with _lock:
+        _generations[kind] = _generations.get(kind, 0) + 1
+        if key is None:
+            _entries.pop(kind, None)
+        else:
+            _entries.get(kind, {}).pop(key, None)
+    memo = _request_memo()
+    if key is None:
+        memo.pop(kind, None)
+    else:
+        memo.get(kind, {}).pop(key, None)
+
+
+def lookup_stats():
+    with _lock:
+        return dict(_stats, entries={kind: len(e) for kind, e in _entries.items()})
+
+
+def _request_memo():
+    if not has_app_context():
+        return {}
+    if "lookup_memo" not in g:
+        g.lookup_memo = {}
+    return g.lookup_memo
+
+
+def _count(key):
+    with _lock:
+        _stats[key] += 1
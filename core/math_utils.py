@@ -1,3 +1,4 @@
+import numpy as np
 from pulp import LpProblem, LpMinimize, LpInteger, LpBinary, LpVariable, lpSum, PULP_CBC_CMD
 
 s = 5 # Maximum rating value (scale is from 1 to s)
@@ -34,3 +35,42 @@ def est_rating(profile, features, n):
                 for u, r in zip(profile, features))
     # Estimate the rating by converting delta to rating scale
     return s - (delta*(s-1)/n)
+
+def est_ratings(profile, matrix, n=None):
+    # Vectorized est_rating over every row of a 0/1 feature matrix.
+    # A mismatch is a -1 preference on a present feature or a +1 preference
+    # on an absent one, so per row: delta = row @ (neg - pos) + sum(pos).
+    cols = matrix.shape[1]
+    n = n or cols
+    # Like zip() in est_rating, features beyond the profile never mismatch
+    p = np.zeros(cols)
+    head = [0 if u is None else u for u in profile[:cols]]
+    p[:len(head)] = head
+    neg, pos = (p == -1), (p == 1)
+    weights = neg.astype(np.int32) - pos.astype(np.int32)
+    delta = matrix @ weights + int(pos.sum())
+    return s - (delta*(s-1)/n)
+
+def top_k(scores, k=10, offset=0, exclude=None, min_score=None):
+    # Row indices of the best `k` scores after skipping the first `offset`,
+    # best first. Ties keep row order, exactly like a stable descending sort,
+    # but only the rows that can make the page are ever sorted.
+    scores = np.asarray(scores, dtype=float)
+    keep = np.ones(len(scores), dtype=bool)
+    if exclude:
+        keep[list(exclude)] = False
+    if min_score is not None:
+        keep &= scores >= min_score
+    rows = np.flatnonzero(keep)
+    vals = scores[rows]
+
+    want = offset + k
+    if want <= 0 or not len(rows):
+        return []
+    if want < len(rows):
+        cutoff = vals[np.argpartition(-vals, want - 1)[:want]].min()
+        # Everything tied with the cutoff stays in so ties resolve by row
+        near = np.flatnonzero(vals >= cutoff)
+        rows, vals = rows[near], vals[near]
+    order = np.lexsort((rows, -vals))
+    return rows[order][offset:want].tolist()
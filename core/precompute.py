@@ -0,0 +1,185 @@
+"""Offline recommendation lists for every user of a system.
+
+    python -m core.precompute movie [--top-k 100]
+
+Scores the whole catalog for every user with a taste vector for the system
+and stores their top-K items in the `recommendations` collection. The
+dashboard serves a stored list while it is fresh: same taste vector, same
+catalog version and younger than RECS_MAX_AGE.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+
+import numpy as np
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from core import math_utils
+from core.catalog import get_catalog
+from core.math_utils import top_k
+from core.ratings import rated_items
+from core.taste_profiles import iter_system_profiles
+from db.collections import SYSTEMS, get_recommendations_collection
+
+# Items stored per user; pages beyond this are scored live
+TOP_K = int(os.getenv("RECS_TOP_K", "100"))
+# Stored lists older than this are ignored (a nightly job plus slack)
+MAX_AGE = timedelta(hours=float(os.getenv("RECS_MAX_AGE_HOURS", "26")))
+# Users scored per matrix product
+USER_BLOCK = 256
+WRITE_BATCH = 500
+
+
+def taste_hash(profile):
+    return hashlib.sha1(json.dumps(profile).encode()).hexdigest()
+
+
+# ───────────── Batch Scoring ─────────────
+
+def score_block(matrix, profiles, n):
+    """Estimated ratings of every item for several profiles at once, as an
+    items x users array. Same arithmetic as est_ratings, one product per
+    block: delta = matrix @ (neg - pos).T + sum(pos)."""
+    cols = matrix.shape[1]
+    P = np.zeros((len(profiles), cols))
+    for u, profile in enumerate(profiles):
+        head = [0 if v is None else v for v in profile[:cols]]
+        P[u, :len(head)] = head
+    pos, neg = (P == 1), (P == -1)
+    weights = neg.astype(np.float32) - pos.astype(np.float32)
+    # float32 is exact here: every delta is an integer far below 2**24
+    delta = np.rint(matrix.astype(np.float32) @ weights.T) + pos.sum(axis=1)
+    s = math_utils.s
+    return s - (delta * (s - 1) / n)
+
+
+def precompute_system(system, top=TOP_K):
+    """Score and store recommendations for every user of `system`.
+    Returns the number of users written."""
+    catalog = get_catalog(system)
+    if not len(catalog):
+        return 0
+    n = catalog.matrix.shape[1]
+    rated = rated_items(system)
+    written = 0
+    computed_at = datetime.utcnow()
+
+    block, ops = [], []
+    for user_id, profile in iter_system_profiles(system):
+        block.append((user_id, profile))
+        if len(block) == USER_BLOCK:
+            ops += _score_users(catalog, n, block, rated, system, top, computed_at)
+            block = []
+        if len(ops) >= WRITE_BATCH:
+            written += _write(ops)
+            ops = []
+    if block:
+        ops += _score_users(catalog, n, block, rated, system, top, computed_at)
+    if ops:
+        written += _write(ops)
+    logging.info(f"[precompute] {system}: stored recommendations for {written} users")
+    return written
+
+
+def _score_users(catalog, n, users, rated, system, top, computed_at):
+    scores = score_block(catalog.matrix, [profile for _, profile in users], n)
+    ops = []
+    for col, (user_id, profile) in enumerate(users):
+        # the dashboard excludes what the user rated through the web pages
+        seen = rated.get(str(user_id), ())
+        column = scores[:, col]
+        rows = top_k(column, top, exclude=catalog.rows(seen))
+        ops.append(UpdateOne(
+            {"user_id": user_id, "system": system},
+            {"$set": {
+                "items": [[catalog.ids[r], float(column[r])] for r in rows],
+                "complete": len(rows) < top,
+                "taste_hash": taste_hash(profile),
+                "catalog_version": catalog.version,
+                "computed_at": computed_at,
+            }},
+            upsert=True,
+        ))
+    return ops
+
+
+def _write(ops):
+    get_recommendations_collection().bulk_write(ops, ordered=False)
+    return len(ops)
+
+
+# ───────────── Serving ─────────────
+
+def stored_page(user_id, system, catalog, profile, offset, count, min_score=None):
+    """A page of precomputed (row, score) pairs, or None when the stored list
+    is missing, stale, or too short to answer this page exactly."""
+    entry = get_recommendations_collection().find_one(
+        {"user_id": ObjectId(user_id), "system": system}
+    )
+    if (
+        not entry
+        or entry.get("catalog_version") != catalog.version
+        or entry.get("taste_hash") != taste_hash(profile)
+        or datetime.utcnow() - entry["computed_at"] > MAX_AGE
+    ):
+        return None
+
+    items = entry["items"]
+    if min_score is not None:
+        # the list is sorted, so nothing past it can reach min_score if its
+        # last score is already below
+        complete = entry["complete"] or (items and items[-1][1] < min_score)
+        items = [it for it in items if it[1] >= min_score]
+    else:
+        complete = entry["complete"]
+    if offset + count > len(items) and not complete:
+        return None
+
+    page = []
+    for item_id, score in items[offset:offset + count]:
+        row = catalog.index.get(item_id)
+        if row is None:
+            return None
+        page.append((row, score))
+    return page
+
+
+def drop_stored(user_id, system):
+    """Forget a user's stored list, e.g. after their ratings changed."""
+    get_recommendations_collection().delete_one({"user_id": ObjectId(user_id), "system": system})
+
+
+# ───────────── CLI ─────────────
+
+def main(argv=None):
+    from dotenv import load_dotenv
+    from db.collections import create_indexes, load_existing_collections
+    from db.connection import init_db
+
+    parser = argparse.ArgumentParser(description="Precompute top-K recommendations.")
+    parser.add_argument("systems", nargs="*", help="systems to process (default: all)")
+    parser.add_argument("--top-k", type=int, default=TOP_K)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    load_dotenv()
+    init_db()
+    create_indexes()
+    load_existing_collections()
+
+    for system in args.systems or list(SYSTEMS):
+        if system not in SYSTEMS:
+            logging.error(f"[precompute] Unknown system '{system}'")
+            continue
+        try:
+            precompute_system(system, args.top_k)
+        except Exception as e:
+            logging.error(f"[precompute] {system} failed: {e}")
+
+
+if __name__ == "__main__":
+    main()
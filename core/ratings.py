@@ -1,141 +1,295 @@
+"""Ratings, one document per (user, system, item):
+
+    {user_id: ObjectId, system, item_id: str, value: float, timestamp}
+
+`user_id` is the users._id. Functions here take it as an ObjectId (the web
+routes, from the session) or a username (the API), which is resolved
+through core.users. Reads project {item_id, value} only, so they are
+answered from the (user_id, system, item_id, value) index alone.
+
+Older databases also hold username-keyed ratings and ratings stored under
+`rating`; convert them once, before serving, with
+
+    python -m core.ratings [--batch N] [--restart]
+
+Until that run has finished (see migrated()), reads also match the
+username and fall back to `rating`, at the cost of the covered query.
+"""
+import argparse
+import math
 from datetime import datetime
-from db.collections import SYSTEMS, get_ratings_collection, get_items_collection
+from bson import ObjectId
+from pymongo import DeleteOne, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from core.lookup_cache import cached, invalidate
+from core.users import user_object_id, username_of
+from db.collections import (
+    SYSTEMS, get_migrations_collection, get_ratings_collection, get_users_collection,
+)
 import logging
 
+MIGRATE_BATCH = 1000
+MIGRATION_ID = "ratings_schema"
+# item_id and value only, so the query is covered by the index
+VALUES = {"_id": 0, "item_id": 1, "value": 1}
+LEGACY_VALUES = {"_id": 0, "item_id": 1, "value": 1, "rating": 1}
+
+
+def user_key(user_id):
+    """The stored user_id: ObjectIds pass through, usernames are looked up.
+    None for unknown users."""
+    if isinstance(user_id, ObjectId):
+        return user_id
+    if user_id in (None, ""):
+        return None
+    return user_object_id(user_id)
+
+def migrated():
+    """Whether migrate_schema has finished on this database (cached briefly)."""
+    def load():
+        state = get_migrations_collection().find_one({"_id": MIGRATION_ID}, {"done": 1})
+        return bool(state and state.get("done"))
+
+    return cached("migration", MIGRATION_ID, load)
+
+
+def _reader(user_id):
+    """(user_id condition, projection) for reading one user's ratings, or
+    (None, None) for an unknown user. Before the migration the condition
+    also matches ratings still keyed by username."""
+    key = user_key(user_id)
+    if key is None:
+        return None, None
+    if migrated():
+        return key, VALUES
+    name = username_of(key) if isinstance(user_id, ObjectId) else str(user_id)
+    return ({"$in": [key, name]} if name else key), LEGACY_VALUES
+
+
+def _owner(user_id):
+    # the user_id condition of _reader, for deletes
+    return _reader(user_id)[0]
+
+
 def add_ratings(user_id, system, ratings):
+    """Upsert a batch of ratings in one unordered bulk write.
+
+    Returns False for a missing user/system or an unknown system, otherwise
+    the write_ratings() report.
+    """
     if not user_id or not system or not ratings:
         return False
     if system not in SYSTEMS:
         return False
-
-    user_id = str(user_id)
-    system = str(system)
-
-    collection = get_ratings_collection()
+    return write_ratings(user_id, str(system), ratings)
+
+
+def write_ratings(user_id, system, ratings):
+    """Upsert {"item_id", "value"/"rating"} dicts for one user with a single
+    unordered bulk_write of UpdateOne upserts.
+
+    The score is stored as `value` under the user's ObjectId (see
+    user_key). If an item appears more than once in the batch, the last
+    entry wins and the earlier ones are reported as rejected. Returns
+    per-item status in input order plus totals:
+        {"inserted": 2, "updated": 1, "rejected": 1,
+         "items": [{"item_id": "7", "status": "inserted"}, ...]}
+    """
+    user_id = user_key(user_id)
+    items = []
+    latest = {}
     for r in ratings:
-        item_id = str(r.get("item_id"))
+        r = r if isinstance(r, dict) else {}
+        item_id = r.get("item_id")
         val = r.get("rating") if "rating" in r else r.get("value")
-        if not item_id or val is None:
-            continue
         try:
             val = float(val)
-        except ValueError:
+        except (TypeError, ValueError):
+            val = None
+        if user_id is None:
+            items.append({"item_id": item_id, "status": "rejected", "error": "unknown user"})
             continue
-        collection.update_one(
+        if item_id in (None, "") or val is None or not math.isfinite(val):
+            items.append({"item_id": item_id, "status": "rejected", "error": "invalid item_id or value"})
+            continue
+        item_id = str(item_id)
+        if item_id in latest:
+            items[latest[item_id][0]].update(status="rejected", error="superseded later in the batch")
+        latest[item_id] = (len(items), val)
+        items.append({"item_id": item_id, "status": None})
+
+    ops, order = [], []
+    now = datetime.utcnow()
+    for item_id, (_, val) in latest.items():
+        order.append(item_id)
+        ops.append(UpdateOne(
             {"user_id": user_id, "system": system, "item_id": item_id},
-            {"$set": {"value": val, "timestamp": datetime.utcnow()}},
-            upsert=True
-        )
-    return True
-
+            {"$set": {"value": val, "timestamp": now}},
+            upsert=True,
+        ))
 
+    status = {}
+    if ops:
+        try:
+            result = get_ratings_collection().bulk_write(ops, ordered=False)
+            upserted = result.upserted_ids
+        except BulkWriteError as e:
+            # unordered: every op without a write error still went through
+            upserted = {u["index"]: u["_id"] for u in e.details.get("upserted", [])}
+            for err in e.details.get("writeErrors", []):
+                status[order[err["index"]]] = ("rejected", err.get("errmsg"))
+                logging.error(f"[write_ratings] {order[err['index']]}: {err.get('errmsg')}")
+        for idx, item_id in enumerate(order):
+            status.setdefault(item_id, ("inserted" if idx in upserted else "updated", None))
+
+    totals = {"inserted": 0, "updated": 0, "rejected": 0}
+    for entry in items:
+        if entry["status"] is None:
+            entry["status"], error = status[entry["item_id"]]
+            if error:
+                entry["error"] = error
+        totals[entry["status"]] += 1
+    return {**totals, "items": items}
 
 
 def add_rating(user_id, system, item_id, value):
-    user_id = str(user_id)
+    user_id = user_key(user_id)
     system = str(system)
     item_id = str(item_id)
     try:
         value = float(value)
     except ValueError:
         return False
-
-    collection = get_ratings_collection()
-
-    existing = collection.find_one({
-        "user_id": user_id,
-        "system": system,
-        "item_id": item_id
-    })
-
-    if existing:
+    if user_id is None:
         return False
 
-    collection.insert_one({
-        "user_id": user_id,
-        "system": system,
-        "item_id": item_id,
-        "value": value,
-        "timestamp": datetime.utcnow()
-    })
+    try:
+        # the unique index rejects an existing rating
+        get_ratings_collection().insert_one({
+            "user_id": user_id,
+            "system": system,
+            "item_id": item_id,
+            "value": value,
+            "timestamp": datetime.utcnow()
+        })
+    except DuplicateKeyError:
+        return False
     return True
 
 
 def get_ratings(user_id, system):
-    user_id = str(user_id)
-    system = str(system)
+    return [
+        {"item_id": item_id, "value": value}
+        for item_id, value in get_rating_map(user_id, system).items()
+    ]
+
+
+def get_rating_map(user_id, system):
+    """{item_id: value} of one user in one system (a covered index query)."""
+    owner, projection = _reader(user_id)
+    if owner is None:
+        return {}
+    cursor = get_ratings_collection().find({"user_id": owner, "system": str(system)}, projection)
+    return _values(cursor)
+
+
+def get_rating(user_id, system, item_id):
+    """The value a user gave one item, or None."""
+    owner, projection = _reader(user_id)
+    if owner is None:
+        return None
+    cursor = get_ratings_collection().find(
+        {"user_id": owner, "system": str(system), "item_id": str(item_id)}, projection
+    )
+    return _values(cursor).get(str(item_id))
+
 
-    cursor = get_ratings_collection().find({"user_id": user_id, "system": system})
-    result = []
+def _values(cursor):
+    # {item_id: score}; unmigrated documents may hold `rating` instead
+    values = {}
     for doc in cursor:
-        result.append({
-            "item_id": doc.get("item_id"),
-            "value": doc.get("value")
-        })
-    return result
+        score = _score(doc)
+        if score is not None:
+            values[doc["item_id"]] = score
+    return values
+
 
+def rated_items(system):
+    """{user _id as str: set of item_ids} of every user who rated `system`."""
+    legacy = not migrated()
+    rated = {}
+    for r in get_ratings_collection().find({"system": str(system)}, {"_id": 0, "user_id": 1, "item_id": 1}):
+        user_id = r.get("user_id")
+        if legacy and not isinstance(user_id, ObjectId):
+            user_id = user_object_id(user_id)  # still keyed by username
+        if user_id is not None:
+            rated.setdefault(str(user_id), set()).add(r["item_id"])
+    return rated
 
 
 def update_rating(user_id, system, item_id, value):
-    user_id = str(user_id)
+    user_id = user_key(user_id)
     system = str(system)
     item_id = str(item_id)
     try:
         value = float(value)
     except ValueError:
         return False
+    if user_id is None:
+        return False
 
     result = get_ratings_collection().update_one(
         {"user_id": user_id, "system": system, "item_id": item_id},
-        {"$set": {"value": value}}
+        {"$set": {"value": value, "timestamp": datetime.utcnow()}}
     )
     return result.modified_count > 0
 
 
 def delete_rating(user_id, system, item_id):
-    user_id = str(user_id)
+    owner = _owner(user_id)
     system = str(system)
     item_id = str(item_id)
+    if owner is None:
+        return False
 
-    result = get_ratings_collection().delete_one(
-        {"user_id": user_id, "system": system, "item_id": item_id}
+    result = get_ratings_collection().delete_many(
+        {"user_id": owner, "system": system, "item_id": item_id}
     )
     return result.deleted_count > 0
 
 
 def delete_all_ratings(user_id, system):
+    owner = _owner(user_id)
+    if owner is None:
+        return 0
     result = get_ratings_collection().delete_many({
-        "user_id": user_id,
-        "system": system
+        "user_id": owner,
+        "system": str(system)
     })
     return result.deleted_count
 
 def get_ratings_by_items(user_id, system, item_ids):
-    user_id = str(user_id)
+    owner, projection = _reader(user_id)
     system = str(system)
     item_ids = [str(i) for i in item_ids]
+    if owner is None:
+        return {}
 
-    ratings_col = get_items_collection('ratings')
     query = {
-        "user_id": user_id,
+        "user_id": owner,
         "system": system,
         "item_id": {"$in": item_ids}
     }
-    cursor = ratings_col.find(query)
-
-    result = {r["item_id"]: r["value"] for r in cursor}
-    return result
+    cursor = get_ratings_collection().find(query, projection)
+    return _values(cursor)
 
 def delete_all_user_ratings(user_id):
     collection = get_ratings_collection()
-    user_id = str(user_id)
+    owner = _owner(user_id)
+    if owner is None:
+        return 0
 
-    # Debug: print how many ratings actually match before deletion
-    match_count = collection.count_documents({"user_id": user_id})
-    logging.info(f"Found {match_count} ratings for user_id='{user_id}'")
-
-    # Delete those ratings
-    result = collection.delete_many({"user_id": user_id})
+    result = collection.delete_many({"user_id": owner})
     logging.info(f"Deleted {result.deleted_count} ratings for user '{user_id}'")
 
     return result.deleted_count
@@ -145,4 +299,144 @@ def delete_all_user_ratings(user_id):
 def delete_all_ratings_in_system(system_id):
     collection = get_ratings_collection()
     result = collection.delete_many({"system": system_id})
-    return result.deleted_count
\ No newline at end of file
+    return result.deleted_count
+
+
+# ───────────── Migration ─────────────
+
+def migrate_schema(batch=MIGRATE_BATCH, restart=False):
+    """Rewrite ratings into the canonical schema, `batch` documents at a time
+    in _id order.
+
+    Username keys become the user's ObjectId and `rating` becomes `value`.
+    When both forms of one rating exist the newer one is kept. Progress is
+    checkpointed in the migrations collection after every batch, so an
+    interrupted run continues where it stopped; `restart` starts over.
+    Ratings of unknown users are left as they are and counted as skipped.
+    Returns the totals {"converted", "merged", "skipped"}.
+    """
+    migrations = get_migrations_collection()
+    state = {} if restart else migrations.find_one({"_id": MIGRATION_ID}) or {}
+    last = state.get("last_id")
+    totals = {key: state.get(key, 0) for key in ("converted", "merged", "skipped")}
+
+    collection = get_ratings_collection()
+    while True:
+        query = {"_id": {"$gt": last}} if last is not None else {}
+        docs = list(collection.find(query).sort("_id", 1).limit(batch))
+        if not docs:
+            break
+        for key, count in _migrate_batch(docs).items():
+            totals[key] += count
+        last = docs[-1]["_id"]
+        migrations.update_one(
+            {"_id": MIGRATION_ID},
+            {"$set": {"last_id": last, **totals, "done": False, "updated_at": datetime.utcnow()}},
+            upsert=True,
+        )
+        logging.info(f"[ratings] Migrated up to {last}: {totals}")
+
+    migrations.update_one(
+        {"_id": MIGRATION_ID},
+        {"$set": {**totals, "done": True, "updated_at": datetime.utcnow()}},
+        upsert=True,
+    )
+    invalidate("migration")
+    return totals
+
+
+def _score(doc):
+    value = doc.get("value")
+    return doc.get("rating") if value is None else value
+
+
+def _migrate_batch(docs):
+    counts = {"converted": 0, "merged": 0, "skipped": 0}
+    legacy = [
+        d for d in docs
+        if not isinstance(d.get("user_id"), ObjectId) or "rating" in d or d.get("value") is None
+    ]
+    if not legacy:
+        return counts
+
+    names = {d["user_id"] for d in legacy if isinstance(d.get("user_id"), str)}
+    users = {
+        u["username"]: u["_id"]
+        for u in get_users_collection().find({"username": {"$in": list(names)}}, {"username": 1})
+    } if names else {}
+
+    resolved = []   # (doc, user ObjectId, score)
+    for d in legacy:
+        user_id = d.get("user_id")
+        user_id = user_id if isinstance(user_id, ObjectId) else users.get(user_id)
+        score = _score(d)
+        if user_id is None or score is None:
+            counts["skipped"] += 1
+            continue
+        resolved.append((d, user_id, score))
+    # docs keyed by ObjectId first: they only change fields, never their key
+    resolved.sort(key=lambda entry: not isinstance(entry[0]["user_id"], ObjectId))
+
+    # the documents that currently hold each canonical key
+    holders = {}
+    cursor = get_ratings_collection().find(
+        {
+            "user_id": {"$in": list({user_id for _, user_id, _ in resolved})},
+            "system": {"$in": list({d.get("system") for d, _, _ in resolved})},
+            "item_id": {"$in": list({d.get("item_id") for d, _, _ in resolved})},
+        },
+        {"user_id": 1, "system": 1, "item_id": 1, "value": 1, "rating": 1, "timestamp": 1},
+    )
+    for h in cursor:
+        holders[(h["user_id"], h.get("system"), h.get("item_id"))] = h
+
+    ops = []
+    for d, user_id, score in resolved:
+        key = (user_id, d.get("system"), d.get("item_id"))
+        holder = holders.get(key)
+        if holder is None or holder["_id"] == d["_id"]:
+            ops.append(UpdateOne(
+                {"_id": d["_id"]},
+                {"$set": {"user_id": user_id, "value": score}, "$unset": {"rating": ""}},
+            ))
+            holders[key] = {**d, "user_id": user_id, "value": score}
+            counts["converted"] += 1
+            continue
+        # both forms exist; keep the newer score in the canonical document
+        newer = (d.get("timestamp") or datetime.min) > (holder.get("timestamp") or datetime.min)
+        if newer or _score(holder) is None:
+            ops.append(UpdateOne(
+                {"_id": holder["_id"]},
+                {"$set": {"value": score, "timestamp": d.get("timestamp")}, "$unset": {"rating": ""}},
+            ))
+            holders[key] = {**holder, "value": score, "timestamp": d.get("timestamp")}
+        ops.append(DeleteOne({"_id": d["_id"]}))
+        counts["merged"] += 1
+
+    if ops:
+        # ordered: a merge must land after the conversion of its holder
+        get_ratings_collection().bulk_write(ops, ordered=True)
+    return counts
+
+
+def main(argv=None):
+    from dotenv import load_dotenv
+    from db.collections import create_indexes
+    from db.connection import init_db
+
+    parser = argparse.ArgumentParser(description="Convert ratings to the canonical schema.")
+    parser.add_argument("--batch", type=int, default=MIGRATE_BATCH)
+    parser.add_argument("--restart", action="store_true", help="ignore the saved checkpoint")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    load_dotenv()
+    init_db()
+    totals = migrate_schema(batch=args.batch, restart=args.restart)
+    # the covering index includes `value`, so build it once values are in place
+    create_indexes()
+    logging.info(f"[ratings] Done: {totals}")
+
+
+if __name__ == "__main__":
+    main()
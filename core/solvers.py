@@ -0,0 +1,362 @@
+import logging
+import os
+
+import numpy as np
+
+from core.math_utils import calc_delta, solve_profile
+from db.collections import SYSTEMS
+
+# Backend used by systems that do not name one in their config
+DEFAULT_SOLVER = os.getenv("PROFILE_SOLVER", "cbc")
+# Frontier size at which the native solver gives up and hands over to CBC
+MAX_NODES = int(os.getenv("PROFILE_SOLVER_MAX_NODES", "5000"))
+# Smaller budget for re-optimising a stored profile after a rating edit
+REFIT_MAX_NODES = int(os.getenv("PROFILE_REFIT_MAX_NODES", "300"))
+
+_EPS = 1e-9
+
+
+# ───────────── Objective ─────────────
+
+def profile_errors(profile, vectors, deltas):
+    """Per-item |mismatches - delta| of a profile, the terms of the MILP
+    objective. Mismatches count the same way as in solve_profile: a 1 in
+    the profile hits zero features, a -1 hits every other value."""
+    zero = np.asarray(vectors, dtype=float) == 0
+    return _errors(profile, zero, np.asarray(deltas, dtype=float))
+
+
+def profile_objective(profile, vectors, deltas):
+    return float(profile_errors(profile, vectors, deltas).sum())
+
+
+def _errors(profile, zero, d):
+    return np.abs(_mismatches(profile, zero) - d)
+
+
+def _mismatches(profile, zero):
+    p = np.array([0.0 if v is None else float(v) for v in profile])
+    return zero @ (p == 1).astype(float) + (~zero) @ (p == -1).astype(float)
+
+
+# ───────────── Native Solver ─────────────
+
+def solve_native(vectors, deltas, start=None, max_nodes=MAX_NODES):
+    """Exact solver for the solve_profile MILP without CBC.
+
+    Feature j adds one mismatch to every rated item where it is 0 (x=1),
+    to every item where it is not 0 (x=-1), or to none (x=0). Features
+    with the same or complementary zero pattern P are interchangeable, so
+    they form one class, and adding the complement of P is adding 1 to all
+    items minus P. Every item's mismatch count is therefore B + s_i, where
+    s = sum of w_c * P_c over classes (w_c = #P picks - #complement picks)
+    and B is a shift shared by all items, which has a closed-form optimum.
+
+    A local search over w gives a candidate; its residual signs give an L1
+    dual bound that often proves it optimal on the spot. Otherwise a
+    breadth-first branch-and-bound over w, with the whole frontier held in
+    NumPy arrays, finishes the job. `start` seeds the search (e.g. the
+    stored profile). Returns None if the frontier outgrows `max_nodes`
+    before optimality is proven.
+    """
+    zero = np.asarray(vectors, dtype=float) == 0
+    d = np.asarray(deltas, dtype=float)
+    model = _ClassModel(zero)
+
+    w = model.from_profile(start) if start is not None else np.zeros(model.K, dtype=int)
+    w, best_obj, shift = model.descend(w, d)
+    lam = _dual_signs(model.s(w) + shift - d, zero, d)
+    if _column_dual(lam, zero, d) >= best_obj - _EPS:
+        return model.to_profile(w, shift)
+
+    result = model.branch_and_bound(d, best_obj, lam, max_nodes)
+    if result is None:
+        return None
+    if result is True:
+        return model.to_profile(w, shift)
+    return model.to_profile(*result)
+
+
+def _dual_signs(residual, zero, d):
+    # Multipliers for the dual bound: complementary slackness fixes them to
+    # the residual signs, except on exactly fitted items, which get a short
+    # coordinate ascent over a few candidate values
+    lam = np.sign(residual)
+    tight = np.flatnonzero(residual == 0)
+    for _ in range(2):
+        for i in tight:
+            best_val, best_l = _column_dual(lam, zero, d), lam[i]
+            for val in (-1.0, -0.5, 0.0, 0.5, 1.0):
+                lam[i] = val
+                got = _column_dual(lam, zero, d)
+                if got > best_val + _EPS:
+                    best_val, best_l = got, val
+            lam[i] = best_l
+    return lam
+
+
+def _column_dual(lam, zero, d):
+    # L1 dual of the LP relaxation for multipliers lam in [-1, 1]: every
+    # feature takes whichever of x=0, x=1, x=-1 is cheapest under lam
+    on_zero = lam @ zero
+    on_rest = lam @ ~zero
+    return float(-lam @ d + np.minimum(0, np.minimum(on_zero, on_rest)).sum())
+
+
+class _ClassModel:
+    """The profile MILP rewritten over feature classes and a shared shift."""
+
+    def __init__(self, zero):
+        self.zero = zero
+        m, cols = zero.shape
+        groups = {}
+        self.uniform = []
+        for j in range(cols):
+            pattern = zero[:, j]
+            if pattern.all() or not pattern.any():
+                self.uniform.append(j)
+                continue
+            # canonical pattern leaves item 0 out
+            key = (~pattern if pattern[0] else pattern).tobytes()
+            groups.setdefault(key, []).append(j)
+
+        # big classes first, so the search decides the most influential ones early
+        members = sorted(groups.values(), key=len, reverse=True)
+        self.members = members
+        self.K = len(members)
+        self.patterns = np.array(
+            [~zero[:, ms[0]] if zero[0, ms[0]] else zero[:, ms[0]] for ms in members], dtype=float
+        ).reshape(self.K, m)
+        self.sizes = np.array([len(ms) for ms in members], dtype=int)
+        self.U = len(self.uniform)
+
+    def s(self, w):
+        return w @ self.patterns
+
+    def shift_range(self, w):
+        # B = complement picks + uniform features, given w_c = a_c - b_c, a_c + b_c <= g_c
+        lo = np.maximum(0, -w).sum(axis=-1)
+        hi = ((self.sizes - w) // 2).sum(axis=-1) + self.U
+        return lo, hi
+
+    def descend(self, w, d):
+        # Steepest descent; a move sets one w_c to any value or shifts two
+        # classes by one step each
+        K = self.K
+        sc = np.repeat(np.arange(K), 2 * self.sizes + 1)
+        sv = np.concatenate([np.arange(-g, g + 1) for g in self.sizes]) if K else sc
+        c1, c2 = np.triu_indices(K, 1)
+        pc1, pc2 = np.repeat(c1, 4), np.repeat(c2, 4)
+        ps1 = np.tile([-1, -1, 1, 1], len(c1))
+        ps2 = np.tile([-1, 1, -1, 1], len(c1))
+        single, pairs = np.arange(len(sc)), np.arange(len(sc), len(sc) + len(pc1))
+
+        obj, shift = self.evaluate(w[None, :], d)
+        obj, shift = float(obj[0]), int(shift[0])
+        while K:
+            cand = np.repeat(w[None, :], len(sc) + len(pc1), axis=0)
+            cand[single, sc] = sv
+            cand[pairs, pc1] += ps1
+            cand[pairs, pc2] += ps2
+            cand = cand[(np.abs(cand) <= self.sizes).all(axis=1)]
+            objs, shifts = self.evaluate(cand, d)
+            k = int(objs.argmin())
+            if objs[k] >= obj - _EPS:
+                break
+            w, obj, shift = cand[k], float(objs[k]), int(shifts[k])
+        return w, obj, shift
+
+    def evaluate(self, W, d):
+        lo, hi = self.shift_range(W)
+        return _best_shift(d - W @ self.patterns, np.atleast_1d(lo), np.atleast_1d(hi))
+
+    def branch_and_bound(self, d, best_obj, lam, max_nodes):
+        """Search w class by class. Returns (w, shift) for a better profile,
+        True if the incumbent is optimal, None if the frontier got too big."""
+        K, m = self.K, self.zero.shape[0]
+        sizes, patterns = self.sizes, self.patterns
+        reach = np.zeros((K + 1, m))
+        free = np.zeros(K + 1)
+        half = np.zeros(K + 1)
+        for i in range(K - 1, -1, -1):
+            reach[i] = reach[i + 1] + sizes[i] * patterns[i]
+            free[i] = free[i + 1] + sizes[i]
+            half[i] = half[i + 1] + sizes[i] // 2
+
+        best = True
+        W = np.zeros((1, K), dtype=int)
+        S = np.zeros((1, m))
+        lo = np.zeros(1)
+        hi = np.zeros(1)
+        for i in range(K):
+            g = sizes[i]
+            steps = np.arange(-g, g + 1)
+            F, C = len(S), len(steps)
+            S = (S[:, None, :] + steps[None, :, None] * patterns[i]).reshape(F * C, m)
+            lo = (lo[:, None] + np.maximum(0, -steps)[None, :]).reshape(-1)
+            hi = (hi[:, None] + ((g - steps) // 2)[None, :]).reshape(-1)
+            W = np.repeat(W, C, axis=0)
+            W[:, i] = np.tile(steps, F)
+
+            # feasible completions: every later class at w=0
+            objs, shifts = _best_shift(d - S, lo, hi + half[i + 1] + self.U)
+            k = int(objs.argmin())
+            if objs[k] < best_obj - _EPS:
+                best_obj, best = float(objs[k]), (W[k].copy(), int(shifts[k]))
+            if i == K - 1:
+                break
+
+            bounds = _shift_bound(d - S, reach[i + 1], lo, hi + free[i + 1] + self.U,
+                                  patterns[i + 1:], sizes[i + 1:], lam)
+            keep = bounds < best_obj - _EPS
+            if not keep.any():
+                break
+            S, lo, hi, W = S[keep], lo[keep], hi[keep], W[keep]
+            if len(S) > max_nodes:
+                logging.info(f"[solve_native] frontier exceeded {max_nodes} nodes")
+                return None
+        return best
+
+    def from_profile(self, profile):
+        x = np.array([0.0 if v is None else float(v) for v in profile])
+        w = np.zeros(self.K, dtype=int)
+        if len(x) != self.zero.shape[1]:
+            return w
+        for c, members in enumerate(self.members):
+            for j in members:
+                same = bool((self.zero[:, j] == self.patterns[c].astype(bool)).all())
+                if x[j]:
+                    # x=1 adds the zero pattern of column j, x=-1 its complement
+                    w[c] += 1 if (x[j] == 1) == same else -1
+        return w
+
+    def to_profile(self, w, shift):
+        # split the shift into per-class complement picks, then uniform features
+        counts = [max(0, -int(wc)) for wc in w]
+        extra = shift - sum(counts)
+        for c, wc in enumerate(w):
+            step = min((self.sizes[c] - wc) // 2 - counts[c], extra)
+            counts[c] += step
+            extra -= step
+
+        profile = [0.0] * self.zero.shape[1]
+        for c, (wc, b) in enumerate(zip(w, counts)):
+            a = int(wc) + b
+            for pos, j in enumerate(self.members[c][:a + b]):
+                same = bool((self.zero[:, j] == self.patterns[c].astype(bool)).all())
+                # the first `a` members add the pattern, the next `b` its complement
+                profile[j] = 1.0 if (pos < a) == same else -1.0
+        for j in self.uniform[:extra]:
+            # uniform features add one mismatch to every item
+            profile[j] = 1.0 if self.zero[0, j] else -1.0
+        return profile
+
+
+def _best_shift(t, lo, hi):
+    # Exact min over an integer shift B in [lo, hi] of sum_i |B - t_i|, per
+    # row. The sum is convex in B with its minimum at the median of t, so
+    # the best integer shift is the floor or ceil of the clipped median.
+    mid = np.clip(np.median(t, axis=1), lo, hi)
+    cands = np.clip(np.stack([np.floor(mid), np.ceil(mid)], axis=1), lo[:, None], hi[:, None])
+    errs = np.abs(cands[:, :, None] - t[:, None, :]).sum(axis=2)
+    k = errs.argmin(axis=1)
+    rows = np.arange(len(t))
+    return errs[rows, k], cands[rows, k]
+
+
+def _shift_bound(t, r, lo, hi, patterns, sizes, lam):
+    # Lower bound on sum_i |B + s_i - t_i| per row, over the undecided
+    # classes and a shared shift B in [lo, hi]. First each item on its own:
+    # s_i can still move by r_i either way, which leaves a convex sum of
+    # interval distances minimised at the median of the interval ends.
+    ends = np.concatenate([t - r, t + r], axis=1)
+    B = np.clip(np.median(ends, axis=1), lo, hi)[:, None]
+    bound = (np.maximum(B - (t + r), 0) + np.maximum((t - r) - B, 0)).sum(axis=1)
+    # Then the L1 dual, both with the residual signs of that solution and
+    # with the incumbent's: it also sees a class pushing items it should
+    # move in opposite directions.
+    for signs in (np.sign(B - t), np.broadcast_to(lam, t.shape)):
+        total = signs.sum(axis=1)
+        dual = (-(signs * t).sum(axis=1) - np.abs(signs @ patterns.T) @ sizes
+                + np.minimum(lo * total, hi * total))
+        bound = np.maximum(bound, dual)
+    return bound
+
+
+# ───────────── Backend Selection ─────────────
+
+def _cbc(vectors, deltas, start=None):
+    return solve_profile(vectors, deltas)
+
+
+def _native(vectors, deltas, start=None):
+    profile = solve_native(vectors, deltas, start)
+    if profile is None:
+        # proof of optimality got too expensive; CBC finishes the job
+        profile = solve_profile(vectors, deltas)
+    return profile
+
+
+SOLVERS = {
+    "cbc": _cbc,
+    "native": _native,
+}
+
+
+def solver_for(system):
+    name = SYSTEMS.get(str(system), {}).get("solver") or DEFAULT_SOLVER
+    if name not in SOLVERS:
+        logging.error(f"[solver_for] Unknown solver '{name}' for '{system}', using cbc")
+        name = "cbc"
+    return name
+
+
+def fit_profile(system, vectors, deltas, start=None, solver=None):
+    """Fit a profile with the solver configured for `system` (or the named
+    `solver`). Both backends return an optimal profile; `start` only speeds
+    up the native one."""
+    return SOLVERS[solver or solver_for(system)](vectors, deltas, start)
+
+
+# ───────────── Incremental Refit ─────────────
+
+def training_set(catalog, ratings):
+    """Rated feature vectors (with the rating appended, as the routes have
+    always built them), their deltas and the feature count, in catalog order."""
+    n = catalog.matrix.shape[1]
+    rows = sorted(catalog.rows(ratings))
+    vectors = [catalog.matrix[row].tolist() + [ratings[catalog.ids[row]]] for row in rows]
+    deltas = calc_delta([ratings[catalog.ids[row]] for row in rows], n)
+    return vectors, deltas, n
+
+
+def is_optimal(profile, vectors, deltas):
+    """True if `profile` provably minimises the MILP objective for this
+    training set: an L1 dual bound built from its residual signs reaches its
+    objective. A stale or wrongly sized profile simply fails the check."""
+    if not profile or not vectors or len(profile) != len(vectors[0]):
+        return False
+    zero = np.asarray(vectors, dtype=float) == 0
+    d = np.asarray(deltas, dtype=float)
+    residual = _mismatches(profile, zero) - d
+    objective = float(np.abs(residual).sum())
+    return _column_dual(_dual_signs(residual, zero, d), zero, d) >= objective - _EPS
+
+
+def refit_profile(system, vectors, deltas, previous=None, solver=None):
+    """Fit a profile after ratings changed, reusing `previous` (the stored
+    taste vector) when it is still optimal. Returns (profile, changed);
+    when `changed` is False the stored vector can be left as it is."""
+    if previous is None or not vectors or len(previous) != len(vectors[0]):
+        return fit_profile(system, vectors, deltas, solver=solver), True
+    if is_optimal(previous, vectors, deltas):
+        return previous, False
+
+    # Short native search seeded with the old profile; a rating edit usually
+    # moves the optimum only a little. Full solve if that does not settle it.
+    profile = solve_native(vectors, deltas, start=previous, max_nodes=REFIT_MAX_NODES)
+    if profile is None:
+        return fit_profile(system, vectors, deltas, start=previous, solver=solver), True
+    if profile_objective(profile, vectors, deltas) >= profile_objective(previous, vectors, deltas) - _EPS:
+        return previous, False
+    return profile, True
@@ -1,21 +1,38 @@
-from db.collections import get_system_metadata_collection, get_db, get_items_collection, SYSTEMS
+from db.collections import get_system_metadata_collection, get_db, get_items_collection, ensure_item_index, SYSTEMS
+from core.catalog import invalidate_catalog
+from core.data_utils import field_projection
+from core.feature_store import load_store, remove_store, update_store
+from core.geo import add_points, clear_points, update_points
+from core.lookup_cache import cached, invalidate
+from core.taste_profiles import delete_system_profiles
 import logging
+from flask import g, has_app_context
 from db.collections import get_items_collection
 
 
-def create_system(system_id, display_name, mapping):
+def create_system(system_id, display_name, mapping, solver=None):
     system_id = str(system_id)
     doc = {
         "collection_name": system_id,
         "display": display_name,
         "mapping": mapping,
     }
-    return get_system_metadata_collection().insert_one(doc).inserted_id
+    if solver:
+        # profile solver backend, see core.solvers.SOLVERS
+        doc["solver"] = solver
+    inserted_id = get_system_metadata_collection().insert_one(doc).inserted_id
+    # after the insert: the geo backfill records itself on this document
+    ensure_item_index(system_id, mapping)
+    invalidate("system", system_id)
+    return inserted_id
 
 
 def get_system(system_name):
     system_name = str(system_name)
-    doc = get_system_metadata_collection().find_one({"collection_name": system_name}, {"_id": 0})
+    # metadata is cached briefly (core.lookup_cache); the dict is shared
+    doc = cached("system", system_name, lambda: get_system_metadata_collection().find_one(
+        {"collection_name": system_name}, {"_id": 0}
+    ))
     if doc:
         return doc
 
@@ -35,6 +52,18 @@ def update_system(system_id, updates):
     result = get_system_metadata_collection().update_one(
         {"collection_name": system_id}, {"$set": updates}
     )
+    invalidate("system", system_id)
+    if system_id in SYSTEMS:
+        # keep the in-memory registry in step with the stored metadata
+        for key in ("display", "mapping", "solver"):
+            if key in updates:
+                SYSTEMS[system_id][key] = updates[key]
+    if "mapping" in updates:
+        # points follow the mapped coordinate fields; rebuilt just below
+        clear_points(system_id)
+        ensure_item_index(system_id, updates["mapping"])
+        remove_store(system_id)
+        invalidate_catalog(system_id)
     return result.modified_count > 0
 
 
@@ -42,7 +71,12 @@ def delete_system(system_name):
     system_name = str(system_name)
     db = get_db()
     db.drop_collection(system_name)
+    delete_system_profiles(system_name)
+    invalidate("taste")
+    remove_store(system_name)
+    invalidate_catalog(system_name)
     result = get_system_metadata_collection().delete_one({"collection_name": system_name})
+    invalidate("system", system_name)
     return result.deleted_count > 0
 
 def list_systems():
@@ -56,7 +90,9 @@ def add_items_to_system(system_id, new_items):
     collection = get_items_collection(system_id)
 
     try:
-        result = collection.insert_many(new_items)
+        result = collection.insert_many(add_points(system_id, new_items))
+        _sync_store(system_id, new_items)
+        invalidate_catalog(system_id)
         logging.info(f"Inserted {len(result.inserted_ids)} items into '{system_id}'")
         return True
     except Exception as e:
@@ -80,43 +116,98 @@ def edit_item_in_system(system_id, item_id, updated_fields):
         {"$set": updated_fields}
     )
 
+    if result.modified_count:
+        mapping = SYSTEMS.get(system_id, {}).get("mapping", {})
+        vector_changed = mapping.get("featureVector") in updated_fields
+        location_changed = bool({mapping.get("latitude"), mapping.get("longitude")} & set(updated_fields))
+        if vector_changed or location_changed:
+            doc = collection.find_one({"WineID": item_id})
+            if vector_changed:
+                _sync_store(system_id, [doc])
+            if location_changed:
+                update_points(system_id, [doc])
+        invalidate_catalog(system_id)
     logging.info(f"Modified count: {result.modified_count}")
     return result.modified_count > 0
 
 
 
+def _sync_store(system, docs):
+    # Keep the packed feature store in step with Mongo; if that fails, drop
+    # it so the next load rebuilds it rather than serving old vectors
+    if system not in SYSTEMS:
+        return
+    try:
+        update_store(system, [d for d in docs if d])
+    except Exception as e:
+        logging.error(f"[_sync_store] Could not update the feature store of '{system}': {e}")
+        remove_store(system)
+
+
 def get_features(item_id, system):
-    system = str(system)
     item_id = str(item_id)
-    collection = get_items_collection(system)
-
-    system_info = get_system(system)
-    if not system_info:
-        logging.error(f"[get_features] System '{system}' not found")
-        raise ValueError(f"System '{system}' not found")
-
-    mapping = system_info.get("mapping", {})
-    id_field = mapping.get("id")
-    if not id_field:
-        logging.error(f"[get_features] System '{system}' mapping missing 'id'")
-        raise ValueError(f"System '{system}' missing mapping.id")
-
-    item = collection.find_one({id_field: item_id})
-    if not item:
-        logging.error(f"[get_features] Item {item_id} not found in system '{system}' using field '{id_field}'")
-        raise ValueError(f"Item {item_id} not found in system '{system}'")
-
-    vector = (
-        item.get("FeatureVector") or
-        item.get("featureVector") or
-        item.get("feature_vector")
-    )
-
+    vector = get_features_many([item_id], system).get(item_id)
     if vector is None:
-        logging.error(f"[get_features] Item {item_id} in system '{system}' has no FeatureVector")
-        raise ValueError(f"Item {item_id} has no FeatureVector")
-
+        raise ValueError(f"Item {item_id} not found in system '{system}' or has no FeatureVector")
     return vector
 
 
-
+def get_features_many(item_ids, system):
+    """Feature vectors of several items as {item_id: vector}, with one `$in`
+    query for whatever this request has not fetched yet. Items that do not
+    exist or have no vector are left out."""
+    system = str(system)
+    item_ids = [str(i) for i in item_ids]
+    memo = _feature_memo(system)
+    missing = [i for i in dict.fromkeys(item_ids) if i not in memo]
+
+    # the packed store answers without touching Mongo when it is built
+    store = load_store(system, build=False) if missing and system in SYSTEMS else None
+    if store is not None:
+        memo.update(store.vectors(missing))
+        missing = [i for i in missing if i not in memo]
+
+    if missing:
+        system_info = get_system(system)
+        if not system_info:
+            logging.error(f"[get_features_many] System '{system}' not found")
+            raise ValueError(f"System '{system}' not found")
+
+        mapping = system_info.get("mapping", {})
+        id_field = mapping.get("id")
+        if not id_field:
+            logging.error(f"[get_features_many] System '{system}' mapping missing 'id'")
+            raise ValueError(f"System '{system}' missing mapping.id")
+
+        # ids may be stored as numbers; the index on id_field serves both forms
+        candidates = missing + [int(i) for i in missing if i.isdigit() and str(int(i)) == i]
+        # the "scoring" fields, plus the vector names older datasets used
+        projection = {**field_projection(mapping, "scoring"),
+                      "FeatureVector": 1, "featureVector": 1, "feature_vector": 1}
+        for item in get_items_collection(system).find({id_field: {"$in": candidates}}, projection):
+            vector = (
+                item.get(mapping.get("featureVector")) or
+                item.get("FeatureVector") or
+                item.get("featureVector") or
+                item.get("feature_vector")
+            )
+            if vector is None:
+                logging.error(f"[get_features_many] Item {item.get(id_field)} in system '{system}' has no FeatureVector")
+                continue
+            memo.setdefault(str(item.get(id_field)), vector)
+
+        for i in missing:
+            if i not in memo:
+                logging.error(f"[get_features_many] Item {i} not found in system '{system}' using field '{id_field}'")
+
+    return {i: memo[i] for i in item_ids if i in memo}
+
+
+def _feature_memo(system):
+    # Vectors fetched during the current request, so repeated lookups of the
+    # same items cost nothing; outside a request nothing is remembered
+    if not has_app_context():
+        return {}
+    if "feature_memo" not in g:
+        g.feature_memo = {}
+    return g.feature_memo.setdefault(system, {})
@@ -0,0 +1,137 @@
+"""Taste profiles, one document per (user, system), in `taste_profiles`.
+
+    {user_id: ObjectId, system, profile: <int8 bytes>, version, solved_at}
+
+A profile entry is -1, 0 or 1, so one signed byte each. `version` counts
+the writes of a profile. Profiles used to live under the user document's
+`taste_vector.<system>`; migrate them with
+
+    python -m core.taste_profiles [--unset]
+"""
+import argparse
+import logging
+from datetime import datetime
+
+import numpy as np
+from bson import Binary, ObjectId
+from pymongo import UpdateOne
+
+from db.collections import get_taste_profiles_collection, get_users_collection
+
+MIGRATE_BATCH = 500
+
+
+def pack(profile):
+    # solver values can be off by rounding noise (0.9999999), so round first
+    values = np.rint(np.array([0 if v is None else v for v in profile], dtype=float))
+    return Binary(values.astype(np.int8).tobytes())
+
+
+def unpack(data):
+    return np.frombuffer(data, dtype=np.int8).tolist()
+
+
+# ───────────── Access ─────────────
+
+def save_profile(user_id, system, profile):
+    get_taste_profiles_collection().update_one(
+        {"user_id": ObjectId(user_id), "system": system},
+        {"$set": {"profile": pack(profile), "solved_at": datetime.utcnow()}, "$inc": {"version": 1}},
+        upsert=True,
+    )
+
+
+def load_profiles(user_id):
+    """{system: profile} of one user."""
+    return {
+        doc["system"]: unpack(doc["profile"])
+        for doc in get_taste_profiles_collection().find(
+            {"user_id": ObjectId(user_id)}, {"_id": 0, "system": 1, "profile": 1}
+        )
+    }
+
+
+def iter_system_profiles(system, batch_size=1000):
+    """(user_id, profile) for every user with a profile in `system`; one
+    scan of the system index."""
+    cursor = get_taste_profiles_collection().find(
+        {"system": system}, {"_id": 0, "user_id": 1, "profile": 1}
+    ).batch_size(batch_size)
+    for doc in cursor:
+        yield doc["user_id"], unpack(doc["profile"])
+
+
+def delete_profile(user_id, system):
+    get_taste_profiles_collection().delete_one({"user_id": ObjectId(user_id), "system": system})
+
+
+def delete_user_profiles(user_id):
+    get_taste_profiles_collection().delete_many({"user_id": ObjectId(user_id)})
+
+
+def delete_system_profiles(system):
+    get_taste_profiles_collection().delete_many({"system": system})
+
+
+# ───────────── Migration ─────────────
+
+def migrate_embedded(unset=False, batch=MIGRATE_BATCH):
+    """Copy `users.taste_vector.<system>` into taste_profiles.
+
+    Profiles that already exist in the collection are newer and are left
+    alone, so the migration can be re-run (or resumed) at any time. With
+    `unset` the embedded vectors are removed afterwards. Returns the number
+    of profiles copied.
+    """
+    users = get_users_collection()
+    copied, ops, migrated = 0, [], []
+    cursor = users.find({"taste_vector": {"$exists": True}}, {"taste_vector": 1})
+    for user in cursor:
+        for system, profile in (user.get("taste_vector") or {}).items():
+            if not profile:
+                continue
+            ops.append(UpdateOne(
+                {"user_id": user["_id"], "system": system},
+                {"$setOnInsert": {"profile": pack(profile), "version": 1, "solved_at": None}},
+                upsert=True,
+            ))
+        migrated.append(user["_id"])
+        if len(ops) >= batch:
+            copied += _flush(ops, migrated if unset else [])
+            ops, migrated = [], []
+    if ops or migrated:
+        copied += _flush(ops, migrated if unset else [])
+    return copied
+
+
+def _flush(ops, unset_ids):
+    copied = 0
+    if ops:
+        result = get_taste_profiles_collection().bulk_write(ops, ordered=False)
+        copied = result.upserted_count
+    if unset_ids:
+        # only after the copies are written, so a crash loses nothing
+        get_users_collection().update_many({"_id": {"$in": unset_ids}}, {"$unset": {"taste_vector": ""}})
+    return copied
+
+
+def main(argv=None):
+    from dotenv import load_dotenv
+    from db.collections import create_indexes
+    from db.connection import init_db
+
+    parser = argparse.ArgumentParser(description="Move embedded taste vectors into taste_profiles.")
+    parser.add_argument("--unset", action="store_true", help="remove users.taste_vector afterwards")
+    parser.add_argument("--batch", type=int, default=MIGRATE_BATCH)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    load_dotenv()
+    init_db()
+    create_indexes()
+    copied = migrate_embedded(unset=args.unset, batch=args.batch)
+    logging.info(f"[taste_profiles] Copied {copied} profiles")
+
+
+if __name__ == "__main__":
+    main()
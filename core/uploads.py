@@ -0,0 +1,220 @@
+import os
+import re
+import time
+import uuid
+
+import msgspec
+
+# Parsed uploads wait here (one NDJSON file per upload) until they are mapped
+UPLOAD_DIR = os.getenv("DATASET_UPLOAD_DIR", "./.dataset_uploads")
+# Spooled uploads older than this many seconds are removed on the next upload
+UPLOAD_TTL = float(os.getenv("DATASET_UPLOAD_TTL", "86400"))
+READ_CHUNK = 1 << 20
+INSERT_BATCH = int(os.getenv("DATASET_INSERT_BATCH", "1000"))
+SAMPLE_SIZE = 5
+MAX_FIELDS = 1000
+
+# Only these bytes change the parser state; everything else is skipped
+_TOKENS = re.compile(rb'[{}\[\]"\\]')
+_encoder = msgspec.json.Encoder()
+_decoder = msgspec.json.Decoder()
+
+
+class UploadError(ValueError):
+    pass
+
+
+# ───────────── Streaming Parse ─────────────
+
+def iter_json_objects(stream, chunk_size=READ_CHUNK):
+    """Yield the objects of a top-level JSON array read from a binary stream.
+
+    Only the element being parsed is held in memory. The splitter tracks
+    nesting and strings to find where each element ends; msgspec decodes
+    (and fully validates) it. Raises UploadError unless the input is an
+    array of objects.
+    """
+    depth = 0
+    in_str = False
+    skip = 0            # index in the chunk up to which bytes are escaped
+    started = done = False
+    count = 0
+    part = bytearray()  # current element, carried across chunks
+    gap = bytearray()   # bytes between elements (whitespace and commas)
+    elem_start = None
+
+    head = stream.read(3)
+    pending = b"" if head == b"\xef\xbb\xbf" else head   # skip a UTF-8 BOM
+    while True:
+        chunk = pending + stream.read(chunk_size)
+        pending = b""
+        if not chunk:
+            break
+        if done:
+            if chunk.strip():
+                raise UploadError("Unexpected data after the closing ']'.")
+            continue
+        gap_start = 0 if elem_start is None else None
+
+        for m in _TOKENS.finditer(chunk, skip):
+            k = m.start()
+            if k < skip:
+                continue
+            c = chunk[k]
+            if in_str:
+                if c == 0x5C:       # backslash escapes the next byte
+                    skip = k + 2
+                elif c == 0x22:
+                    in_str = False
+                continue
+            if depth == 0:
+                if c != 0x5B or started or chunk[:k].strip():
+                    raise UploadError("JSON must be an array of objects.")
+                started = True
+                depth = 1
+                gap_start = k + 1
+                continue
+            if c == 0x22:
+                if depth == 1:
+                    raise UploadError("JSON must be an array of objects.")
+                in_str = True
+            elif c in (0x7B, 0x5B):  # { [
+                if depth == 1:
+                    if c != 0x7B:
+                        raise UploadError("JSON must be an array of objects.")
+                    _check_gap(gap + chunk[gap_start:k], count, closing=False)
+                    gap.clear()
+                    elem_start, gap_start = k, None
+                depth += 1
+            elif c in (0x7D, 0x5D):  # } ]
+                depth -= 1
+                if depth == 1:
+                    part += chunk[elem_start:k + 1]
+                    yield _decode(part)
+                    count += 1
+                    part.clear()
+                    elem_start, gap_start = None, k + 1
+                elif depth == 0:
+                    if c != 0x5D:
+                        raise UploadError("JSON must be an array of objects.")
+                    _check_gap(gap + chunk[gap_start:k], count, closing=True)
+                    if chunk[k + 1:].strip():
+                        raise UploadError("Unexpected data after the closing ']'.")
+                    done = True
+                    break
+
+        if not done:
+            if elem_start is not None:
+                part += chunk[elem_start:]
+                elem_start = 0
+            elif started:
+                gap = bytearray((gap + chunk[gap_start:]).strip())
+                if len(gap) > 1:
+                    raise UploadError("JSON must be an array of objects.")
+            elif chunk.strip():
+                raise UploadError("JSON must be an array of objects.")
+        skip = max(0, skip - len(chunk))
+
+    if not done:
+        raise UploadError("Unexpected end of file." if started else "JSON must be an array of objects.")
+
+
+def _check_gap(gap, count, closing):
+    # Before the first element and before ']' only whitespace, else one comma
+    expected = b"" if count == 0 or closing else b","
+    if gap.strip() != expected:
+        raise UploadError("JSON must be an array of objects.")
+
+
+def _decode(raw):
+    try:
+        obj = _decoder.decode(raw)
+    except msgspec.DecodeError as e:
+        raise UploadError(f"Invalid JSON: {e}") from None
+    if not isinstance(obj, dict):
+        raise UploadError("JSON must be an array of objects.")
+    return obj
+
+
+# ───────────── Spooled Uploads ─────────────
+
+def spool_upload(stream):
+    """Parse an uploaded JSON array into a spool file.
+
+    Returns the upload summary {"id", "count", "fields", "sample"}: the record
+    count, the top-level field names seen across all records, and the first
+    few records for the mapping step. The session should only hold the id.
+    """
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    _remove_stale()
+    upload_id = uuid.uuid4().hex
+    fields, sample, count = set(), [], 0
+    path = _path(upload_id, "ndjson")
+    try:
+        with open(path, "wb") as out:
+            for obj in iter_json_objects(stream):
+                out.write(_encoder.encode(obj) + b"\n")
+                if len(fields) < MAX_FIELDS:
+                    fields.update(obj)
+                if len(sample) < SAMPLE_SIZE:
+                    sample.append(obj)
+                count += 1
+    except Exception:
+        _unlink(path)
+        raise
+
+    meta = {"id": upload_id, "count": count, "fields": sorted(fields), "sample": sample}
+    with open(_path(upload_id, "meta.json"), "wb") as out:
+        out.write(_encoder.encode(meta))
+    return meta
+
+
+def get_upload(upload_id):
+    """Summary of a spooled upload, or None if it no longer exists."""
+    try:
+        with open(_path(upload_id, "meta.json"), "rb") as f:
+            return _decoder.decode(f.read())
+    except (OSError, ValueError):
+        return None
+
+
+def iter_upload_batches(upload_id, size=INSERT_BATCH):
+    """Yield the spooled records in lists of at most `size`."""
+    batch = []
+    with open(_path(upload_id, "ndjson"), "rb") as f:
+        for line in f:
+            batch.append(_decoder.decode(line))
+            if len(batch) >= size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+def discard_upload(upload_id):
+    _unlink(_path(upload_id, "ndjson"))
+    _unlink(_path(upload_id, "meta.json"))
+
+
+def _path(upload_id, ext):
+    if not re.fullmatch(r"[0-9a-f]{32}", str(upload_id)):
+        raise UploadError("Bad upload id.")
+    return os.path.join(UPLOAD_DIR, f"{upload_id}.{ext}")
+
+
+def _unlink(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _remove_stale():
+    cutoff = time.time() - UPLOAD_TTL
+    for name in os.listdir(UPLOAD_DIR):
+        path = os.path.join(UPLOAD_DIR, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
@@ -1,4 +1,5 @@
-from bson import ObjectId
+from core.lookup_cache import cached, invalidate
+from core.taste_profiles import delete_user_profiles, load_profiles, save_profile
 from db.collections import get_users_collection
 from utils.security import hash_pw
 
@@ -8,21 +9,23 @@ def create_user(username, password):
     username = str(username)
     if find_user(username):
         return None
-    return get_users_collection().insert_one({
+    user_id = get_users_collection().insert_one({
         "username": username,
         "password_hash": hash_pw(password),
-        "taste_vector": {},
     }).inserted_id
+    invalidate("user", username)
+    invalidate("user_id", username)
+    return user_id
 
 
 # ─────────── User Management ───────────
 
 def get_user(username):
+    # Cached briefly (core.lookup_cache); the returned dict is shared
     username = str(username)
-    user = get_users_collection().find_one(
+    return cached("user", username, lambda: get_users_collection().find_one(
         {"username": username}, {"_id": 0, "password_hash": 0}
-    )
-    return user
+    ))
 
 
 def update_user(username, updated_fields):
@@ -32,12 +35,44 @@ def update_user(username, updated_fields):
     result = get_users_collection().update_one(
         {"username": username}, {"$set": updated_fields}
     )
+    for name in {username, str(updated_fields.get("username", username))}:
+        invalidate("user", name)
+        invalidate("user_id", name)
+    invalidate("username")
     return result.modified_count > 0
 
 def delete_user(username):
     username = str(username)
-    result = get_users_collection().delete_one({"username": username})
-    return result.deleted_count > 0
+    user = get_users_collection().find_one_and_delete({"username": username}, {"_id": 1})
+    invalidate("user", username)
+    invalidate("user_id", username)
+    if user is None:
+        return False
+    invalidate("username", str(user["_id"]))
+    delete_user_profiles(user["_id"])
+    invalidate("taste", str(user["_id"]))
+    return True
+
+
+def user_object_id(username):
+    """The _id of a user by username, or None; cached like get_user.
+    Ratings and taste profiles are keyed by it."""
+    username = str(username)
+
+    def load():
+        user = get_users_collection().find_one({"username": username}, {"_id": 1})
+        return user["_id"] if user else None
+
+    return cached("user_id", username, load)
+
+
+def username_of(user_id):
+    """The username of a user by _id, or None; cached like get_user."""
+    def load():
+        user = get_users_collection().find_one({"_id": user_id}, {"username": 1})
+        return user["username"] if user else None
+
+    return cached("username", str(user_id), load)
 
 
 def find_user(username):
@@ -50,18 +85,22 @@ def check_pw(user, pw):
 
 
 # ─────────── Taste Vector Handling ───────────
+# Stored in the taste_profiles collection (core.taste_profiles)
 
 def set_taste(user_id, system, vec):
     user_id = str(user_id)
     system = str(system)
-    get_users_collection().update_one(
-        {"_id": ObjectId(user_id)},
-        {"$set": {f"taste_vector.{system}": vec}},
-    )
+    save_profile(user_id, system, vec)
+    invalidate("taste", user_id)
 
 def get_taste(user_id, system):
     user_id = str(user_id)
     system = str(system)
-    user = get_users_collection().find_one({"_id": ObjectId(user_id)})
-    return user.get("taste_vector", {}).get(system)
+    return get_tastes(user_id).get(system)
+
+def get_tastes(user_id):
+    """All taste vectors of a user by system, cached like get_user."""
+    user_id = str(user_id)
+
+    return cached("taste", user_id, lambda: load_profiles(user_id))
 
@@ -37,6 +37,15 @@ def get_ratings_collection():
 def get_system_metadata_collection():
     return get_db()["system_metadata"]
 
+def get_recommendations_collection():
+    return get_db()["recommendations"]
+
+def get_taste_profiles_collection():
+    return get_db()["taste_profiles"]
+
+def get_migrations_collection():
+    return get_db()["migrations"]
+
 def get_items_collection(system_name):
     return get_db()[system_name]
 
@@ -47,6 +56,38 @@ def create_indexes():
     get_ratings_collection().create_index(
         [("user_id", 1), ("system", 1), ("item_id", 1)], unique=True
     )
+    # covers the {item_id, value} reads of one user's ratings (core.ratings)
+    get_ratings_collection().create_index(
+        [("user_id", 1), ("system", 1), ("item_id", 1), ("value", 1)]
+    )
+    get_recommendations_collection().create_index(
+        [("user_id", 1), ("system", 1)], unique=True
+    )
+    # per-user reads use the first, whole-system scans and deletes the second
+    get_taste_profiles_collection().create_index(
+        [("user_id", 1), ("system", 1)], unique=True
+    )
+    get_taste_profiles_collection().create_index("system")
+    existing = set(get_db().list_collection_names())
+    for name, cfg in SYSTEMS.items():
+        if name in existing:
+            ensure_item_index(name, cfg["mapping"])
+
+
+def ensure_item_index(system, mapping):
+    from core.facets import FACET_FIELD
+    from core.geo import ensure_geo_index
+
+    collection = get_items_collection(system)
+    # Single-item lookups (item pages, get_features) query the mapped id field
+    id_field = (mapping or {}).get("id")
+    if id_field:
+        collection.create_index(id_field)
+    # Multikey index for facet filters ({features: {$all: [...]}})
+    if collection.find_one({FACET_FIELD: {"$exists": True}}, {"_id": 1}):
+        collection.create_index(FACET_FIELD)
+    # Systems with coordinates get GeoJSON points and a 2dsphere index
+    ensure_geo_index(system, mapping)
 
 # ───────────── Dynamic Collection Loader ─────────────
 
@@ -54,7 +95,8 @@ def load_existing_collections() -> None:
 
     db = get_db()
     exclude = {
-        "users", "ratings", "system.indexes", "system_metadata","click_logs"
+        "users", "ratings", "system.indexes", "system_metadata","click_logs",
+        "recommendations", "taste_profiles", "migrations",
     }
     for cname in db.list_collection_names():
         if cname in exclude or cname in SYSTEMS:
@@ -74,7 +116,9 @@ def load_existing_collections() -> None:
         SYSTEMS[cname] = {
             "display": cname.capitalize(),
             "mapping": mapping,
+            "solver": meta.get("solver") if meta else None,
         }
+        ensure_item_index(cname, mapping)
         print(f"Registered '{cname}' with mapping {mapping}")
 
 def get_click_logs_collection():
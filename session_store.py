@@ -0,0 +1,182 @@
+import logging
+import os
+import secrets
+import sqlite3
+import threading
+import time
+
+from flask import has_request_context, request
+from flask.sessions import SecureCookieSession, SecureCookieSessionInterface
+from itsdangerous import BadSignature
+
+# ──────────────── Settings ────────────────
+# Anonymous sessions that serialize to at most this many bytes live in the
+# signed cookie itself; larger ones go to SQLite and the cookie only holds
+# the id
+COOKIE_MAX = int(os.getenv("SESSION_COOKIE_MAX", "3000"))
+# Sessions holding any of these keys are always kept in SQLite, so logging
+# out revokes them and their contents never reach the client
+SERVER_KEYS = ("user_id", "username")
+# The session is for ids and flags, not data. Larger sessions are still
+# saved, but logged as errors
+MAX_BYTES = int(os.getenv("SESSION_MAX_BYTES", str(64 * 1024)))
+DB_PATH = os.getenv("SESSION_DB", "./.flask_session/sessions.sqlite3")
+# Seconds an idle server-side session is kept
+TTL = int(os.getenv("SESSION_TTL", str(7 * 24 * 3600)))
+# Expired rows are purged on every Nth server-side write
+PURGE_EVERY = 200
+
+
+class HybridSession(SecureCookieSession):
+    def __init__(self, initial=None, sid=None):
+        super().__init__(initial)
+        self.sid = sid
+        # the user the session was opened for; a new one gets a new sid
+        self.opened_for = self.get("user_id")
+
+
+class HybridSessionInterface(SecureCookieSessionInterface):
+    """Signed-cookie sessions that move to a local SQLite file when large
+    or logged in.
+
+    Unchanged sessions are never written, and small anonymous ones (mostly
+    flashes) cost no disk I/O at all. Logged-in sessions (SERVER_KEYS) are
+    always rows, so clearing the session on logout deletes the row and a
+    copied cookie stops working. The cookie value is "c.<signed payload>" or
+    "s.<signed id>" for a row in SQLite; rows expire after TTL seconds
+    without a write.
+    """
+
+    session_class = HybridSession
+
+    def __init__(self, path=DB_PATH, ttl=TTL, cookie_max=COOKIE_MAX, max_bytes=MAX_BYTES):
+        self.store = SessionDB(path)
+        self.ttl = ttl
+        self.cookie_max = cookie_max
+        self.max_bytes = max_bytes
+
+    def open_session(self, app, request):
+        s = self.get_signing_serializer(app)
+        if s is None:
+            return None
+        raw = request.cookies.get(self.get_cookie_name(app))
+        if not raw:
+            return self.session_class()
+        kind, _, value = raw.partition(".")
+        try:
+            if kind == "c":
+                data = s.loads(value, max_age=self.ttl)
+                # logins are only honoured from revocable rows
+                if not any(key in data for key in SERVER_KEYS):
+                    return self.session_class(data)
+            if kind == "s":
+                sid = s.loads(value, max_age=self.ttl)
+                data = self.store.get(sid)
+                if data is not None:
+                    return self.session_class(s.serializer.loads(data), sid=sid)
+        except (BadSignature, ValueError):
+            pass
+        return self.session_class()
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.accessed:
+            response.vary.add("Cookie")
+
+        if not session:
+            if session.modified:
+                if session.sid:
+                    self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path,
+                                       secure=self.get_cookie_secure(app),
+                                       httponly=self.get_cookie_httponly(app),
+                                       samesite=self.get_cookie_samesite(app))
+            return
+        if not self.should_set_cookie(app, session):
+            return
+
+        s = self.get_signing_serializer(app)
+        payload = s.serializer.dumps(dict(session))
+        size = len(payload)
+        if size > self.max_bytes:
+            logging.error(f"[session_store] Saving a {size} byte session for {_request_path()} "
+                          f"(limit {self.max_bytes}); keep large data out of the session")
+
+        server_side = size > self.cookie_max or any(key in session for key in SERVER_KEYS)
+        if session.sid and (not server_side or session.get("user_id") != session.opened_for):
+            # a new login gets a new id, so an id known before it is useless
+            self.store.delete(session.sid)
+            session.sid = None
+        if not server_side:
+            value = "c." + s.dumps(dict(session))
+        else:
+            session.sid = session.sid or secrets.token_urlsafe(24)
+            self.store.put(session.sid, payload, time.time() + self.ttl)
+            value = "s." + s.dumps(session.sid)
+
+        response.set_cookie(
+            name, value,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain, path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+            partitioned=self.get_cookie_partitioned(app),
+        )
+
+
+def _request_path():
+    return request.path if has_request_context() else "?"
+
+
+# ──────────────── SQLite Store ────────────────
+
+class SessionDB:
+    """Tiny key-value table with expiry. One connection per thread and
+    process; WAL lets gunicorn workers read while another one writes."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions "
+                "(id TEXT PRIMARY KEY, data TEXT NOT NULL, expires REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS sessions_expires ON sessions (expires)")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def get(self, sid):
+        row = self._conn().execute(
+            "SELECT data FROM sessions WHERE id = ? AND expires > ?", (sid, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def put(self, sid, data, expires):
+        conn = self._conn()
+        conn.execute("INSERT OR REPLACE INTO sessions (id, data, expires) VALUES (?, ?, ?)",
+                     (sid, data, expires))
+        self._writes += 1
+        if self._writes % PURGE_EVERY == 0:
+            self.purge()
+
+    def delete(self, sid):
+        self._conn().execute("DELETE FROM sessions WHERE id = ?", (sid,))
+
+    def purge(self):
+        try:
+            self._conn().execute("DELETE FROM sessions WHERE expires <= ?", (time.time(),))
+        except sqlite3.Error as e:
+            logging.error(f"[session_store] Could not purge expired sessions: {e}")